@@ -1,3 +1,5 @@
+import logging
+import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
@@ -8,41 +10,72 @@ login_manager = LoginManager()
 
 # 必须在db定义后注册user_loader
 from .models import User
+# 注册全文索引的建表/删表事件、学科相关度表的初始数据、已有表的补加列
+from . import search_index, relatedness, database
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # 返回缓存的只读快照，已登录请求不必每次查询用户、爱好和好友
+    from .user_cache import get_user_snapshot
+    return get_user_snapshot(int(user_id))
 
-def create_app():
+def create_app(config_name: str = None, **overrides):
+    """创建应用
+
+    config_name 为 config.py 中的配置名，默认取环境变量 APP_CONFIG（未设置时为 development）；
+    overrides 覆盖单个配置项
+    """
+    from config import config
     app = Flask(__name__)
+    app.config.from_object(config[config_name or os.environ.get('APP_CONFIG', 'development')])
+    app.config.update(overrides)
+    if not app.config['SECRET_KEY']:
+        raise RuntimeError('未设置 SECRET_KEY：会话签名需要随机密钥，请通过环境变量 SECRET_KEY 提供')
+    
+    # 未配置日志输出时（如 gunicorn、flask run）输出到 stderr
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    logging.getLogger(__name__).setLevel(app.config['LOG_LEVEL'])
     
     # 配置CORS - 使用更简单的配置
     CORS(app, 
-         origins=["http://localhost:3000"],
+         origins=app.config['CORS_ORIGINS'],
          allow_credentials=True,
          supports_credentials=True,
          resources={r"/*": {
-             "origins": ["http://localhost:3000"],
+             "origins": app.config['CORS_ORIGINS'],
              "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
              "allow_headers": ["Content-Type", "Authorization", "Accept"],
-             "expose_headers": ["Content-Type", "Authorization"],
+             "expose_headers": ["Content-Type", "Authorization", "X-Next-Cursor"],
              "supports_credentials": True
          }})
     
-    # 配置数据库
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///lalinea.db'
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    app.config['SECRET_KEY'] = 'your-secret-key'  # 请更改为安全的密钥
-    
     # 初始化扩展
     db.init_app(app)
     login_manager.init_app(app)
     
+    # 新连接上设置 WAL、busy_timeout 等 PRAGMA
+    from .database import configure_engine, init_db_command
+    with app.app_context():
+        configure_engine(db.engine, app.config['SQLITE_PRAGMAS'])
+    app.cli.add_command(init_db_command)
+    
+    # 请求耗时、SQL条数及N+1检测
+    if app.config['INSTRUMENTATION']:
+        from .instrumentation import init_instrumentation
+        with app.app_context():
+            init_instrumentation(app, db.engine)
+    
     # 注册路由
     from .routes import init_all_routes
     init_all_routes(app)
     
-    # 创建数据库表
-    with app.app_context():
-        db.create_all()
+    # 开发环境启动时建表，生产环境在部署时执行 flask init-db
+    if app.config['CREATE_SCHEMA_ON_STARTUP']:
+        with app.app_context():
+            db.create_all()
+    
+    # 启动分数重算后台线程
+    if app.config['SCORE_WORKER'] == 'thread':
+        from .jobs import start_worker
+        start_worker(app)
     
     return app
@@ -0,0 +1,50 @@
+import threading
+from typing import Callable, Dict, Tuple
+from flask import current_app, request
+from sqlalchemy.dialects.sqlite import insert
+from .models import CacheVersion
+from . import db
+
+_lock = threading.Lock()
+# name -> (版本号, 序列化后的响应体)
+_responses: Dict[str, Tuple[int, bytes]] = {}
+
+
+def bump_version(name: str) -> int:
+    """数据变更时调用，随调用方的事务一起提交，返回新的版本号"""
+    table = CacheVersion.__table__
+    stmt = insert(table).values(name=name, version=1).on_conflict_do_update(
+        index_elements=['name'],
+        set_={'version': table.c.version + 1}
+    )
+    return db.session.execute(stmt.returning(table.c.version)).scalar()
+
+
+def get_version(name: str) -> int:
+    version = db.session.query(CacheVersion.version).filter_by(name=name).scalar()
+    return version or 0
+
+
+def cached_json_response(name: str, build: Callable[[], object]):
+    """按版本号缓存的JSON响应，支持 ETag / If-None-Match 返回304
+
+    版本号存放在数据库中，多进程部署下各进程的缓存同样能及时失效
+    """
+    version = get_version(name)
+    etag = f'{name}-{version}'
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        with _lock:
+            cached = _responses.get(name)
+        if cached is None or cached[0] != version:
+            body = current_app.json.dumps(build()).encode()
+            with _lock:
+                _responses[name] = (version, body)
+        else:
+            body = cached[1]
+        response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    # 允许缓存，但每次使用前都需要重新验证
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -1,8 +1,18 @@
 from collections import defaultdict
-from typing import List, Set, Dict, Tuple
+from datetime import datetime
+from typing import Iterable, List, Optional, Set, Dict, Tuple
+from flask import current_app, has_app_context
 from .models import User, Hobby, CompatibilityScore
 from . import db
-from datetime import datetime
+from .graph import DistanceTable, changed_distances, changed_distances_for_edges
+from .social_graph import SocialGraph, get_social_graph
+from .score_writer import bulk_upsert_scores, delete_stale_scores
+from .relatedness import get_relatedness_table
+from .top_matches import refresh_all_top_matches
+import numpy as np
+
+# 批量重算爱好分项时每块的用户数，控制 块大小 × 用户数 矩阵的内存占用
+HOBBY_BLOCK_SIZE = 64
 
 # 学科相关度矩阵
 SUBJECT_RELATEDNESS = {
@@ -27,11 +37,11 @@ SUBJECT_RELATEDNESS = {
 }
 
 def get_subject_relatedness(subject1: str, subject2: str) -> float:
-    """计算两个学科之间的相关度"""
-    for group in SUBJECT_RELATEDNESS.values():
-        if subject1 in group and subject2 in group:
-            return group[subject1][subject2]
-    return 0.0
+    """计算两个学科之间的相关度
+
+    查询编译后的相关度表（来自 subject_relatedness 表，默认分组即上面的矩阵）
+    """
+    return get_relatedness_table().lookup(subject1, subject2)
 
 def calculate_hobby_overlap(user1_hobbies: Set[str], user2_hobbies: Set[str]) -> float:
     """计算两个用户爱好重合度"""
@@ -41,63 +51,182 @@ def calculate_hobby_overlap(user1_hobbies: Set[str], user2_hobbies: Set[str]) ->
     union = len(user1_hobbies.union(user2_hobbies))
     return intersection / union
 
+def hobby_bitset(hobby_ids: Iterable[int]) -> int:
+    """以爱好id为位号的爱好位集"""
+    bits = 0
+    for hobby_id in hobby_ids:
+        bits |= 1 << hobby_id
+    return bits
+
+def bitset_overlap(bits1: int, bits2: int) -> float:
+    """位集表示的爱好重合度，与 calculate_hobby_overlap 结果相同"""
+    if not bits1 or not bits2:
+        return 0.0
+    return (bits1 & bits2).bit_count() / (bits1 | bits2).bit_count()
+
 def calculate_subject_relatedness(user1_hobbies: Set[str], user2_hobbies: Set[str]) -> float:
-    """计算两个用户学科相关度"""
-    max_relatedness = 0.0
-    for hobby1 in user1_hobbies:
-        for hobby2 in user2_hobbies:
-            relatedness = get_subject_relatedness(hobby1, hobby2)
-            max_relatedness = max(max_relatedness, relatedness)
-    return max_relatedness
-
-def find_shortest_path(user1: User, user2: User) -> int:
-    """使用BFS找到两个用户之间的最短路径长度"""
-    if user1 == user2:
-        return 0
-    
-    visited = {user1.id}
-    queue = [(user1, 0)]  # (user, distance)
-    
-    while queue:
-        current_user, distance = queue.pop(0)
-        
-        for friend in current_user.friends:
-            if friend.id == user2.id:
-                return distance + 1
-            
-            if friend.id not in visited:
-                visited.add(friend.id)
-                queue.append((friend, distance + 1))
-    
-    return float('inf')  # 如果没有找到路径
+    """计算两个用户学科相关度：双方学科爱好之间相关度的最大值"""
+    return get_relatedness_table().max_relatedness(user1_hobbies, user2_hobbies)
 
-def calculate_compatibility(user1: User, user2: User) -> float:
-    """计算两个用户之间的兼容性分数"""
+def distance_cutoff() -> Optional[int]:
+    """关系距离的跳数上限（配置项 MAX_DISTANCE_HOPS），None 表示不限制
+
+    超过上限的用户对关系距离得分为0
+    """
+    if not has_app_context():
+        return None
+    return current_app.config.get('MAX_DISTANCE_HOPS')
+
+def find_shortest_path(user1: User, user2: User, distances: DistanceTable = None) -> int:
+    """查找两个用户之间的最短路径长度
+
+    距离来自内存中的CSR好友图，同一个 DistanceTable 内每个源用户只做一次BFS；
+    单独查询一对用户时在进程内的好友图上从两端同时BFS，到达跳数上限即停止
+    """
+    if distances is None:
+        return get_social_graph().distance(user1.id, user2.id, distance_cutoff())
+    return distances.distance(user1.id, user2.id)
+
+def calculate_components(user1: User, user2: User, distances: DistanceTable = None) -> Tuple[float, float, float]:
+    """计算两个用户之间的各项分数：(爱好重合度, 学科相关度, 关系距离得分)"""
     # 确保user1.id < user2.id
     if user1.id > user2.id:
         user1, user2 = user2, user1
     
-    # 计算爱好重合度
-    hobby_overlap = calculate_hobby_overlap(
-        {h.name for h in user1.hobbies},
-        {h.name for h in user2.hobbies}
+    # 计算爱好重合度：位集按位与/或后计数
+    hobby_overlap = bitset_overlap(
+        hobby_bitset(h.id for h in user1.hobbies), hobby_bitset(h.id for h in user2.hobbies)
     )
     
     # 计算学科相关度
     subject_relatedness = calculate_subject_relatedness(
-        {h.name for h in user1.hobbies},
-        {h.name for h in user2.hobbies}
+        {h.name for h in user1.hobbies}, {h.name for h in user2.hobbies}
     )
     
     # 计算关系距离
-    distance = find_shortest_path(user1, user2)
-    # 显式处理无穷大的情况
-    distance_factor = 0.5 / distance if distance != float('inf') else 0
+    distance = find_shortest_path(user1, user2, distances)
     
-    # 计算最终分数
-    score = hobby_overlap * 0.25 + subject_relatedness * 0.25 + distance_factor
-    
-    return score
+    return hobby_overlap, subject_relatedness, calculate_distance_factor(distance)
+
+def calculate_compatibility(user1: User, user2: User, distances: DistanceTable = None) -> float:
+    """计算两个用户之间的兼容性分数"""
+    return compose_score(*calculate_components(user1, user2, distances))
+
+def calculate_distance_factor(distance: float) -> float:
+    """关系距离得分"""
+    # 显式处理无穷大的情况
+    return 0.5 / distance if distance != float('inf') else 0
+
+def compose_score(hobby_overlap: float, subject_relatedness: float, distance_factor: float) -> float:
+    """由各分项组合出最终分数"""
+    return hobby_overlap * 0.25 + subject_relatedness * 0.25 + distance_factor
+
+def update_scores_for_friendship(user1: User, user2: User):
+    """好友关系增删后，只重写最短距离发生变化的用户对的关系距离得分
+
+    需在好友关系提交之后调用；直接修改 user_friends 时需同时增加好友图版本号，
+    否则进程内的好友图不会重新加载（set_friendship 已处理）
+    """
+    graph = get_social_graph().friend_graph((user1.id, user2.id))
+    write_distance_changes(changed_distances(graph, user1.id, user2.id, distance_cutoff()))
+
+def update_scores_for_friendships(graph, edges: List[Tuple[int, int, bool]]):
+    """多条好友关系变更后，重写最短距离发生变化的用户对
+
+    graph 为变更后的好友图，edges 为 (user1_id, user2_id, 变更前是否为好友)
+    """
+    write_distance_changes(changed_distances_for_edges(graph, edges, distance_cutoff()))
+
+def write_distance_changes(changes: List[Tuple[int, int, float]]):
+    """写入 (user1_id, user2_id, 新距离) 列表，只覆盖关系距离得分"""
+    from .hobby_index import get_hobby_index
+    if not changes:
+        return
+
+    user1_ids = [a for a, _, _ in changes]
+    user2_ids = [b for _, b, _ in changes]
+    # 爱好分项只用于新插入的行，已有行保留原值
+    hobby_overlap, subject_relatedness = get_hobby_index(
+        set(user1_ids) | set(user2_ids)
+    ).pair_terms(user1_ids, user2_ids)
+    bulk_upsert_scores(
+        user1_ids, user2_ids, hobby_overlap, subject_relatedness,
+        [calculate_distance_factor(distance) for _, _, distance in changes],
+        update=('distance_factor',)
+    )
+
+def _distance_factor_row(index, user_id: int, graph: SocialGraph = None) -> np.ndarray:
+    """一次BFS得到某用户与爱好索引中所有用户的关系距离得分
+
+    graph 为进程内的好友图，不传时取当前版本
+    """
+    if graph is None:
+        graph = get_social_graph()
+    distances = graph.distances_to(user_id, index.user_ids, distance_cutoff())
+    with np.errstate(divide='ignore'):
+        return 0.5 / distances
+
+def update_hobby_scores(user: User):
+    """用户爱好变更后，只重算爱好重合度和学科相关度
+
+    关系距离得分沿用已有记录，只有缺失的记录才需要做一次BFS
+    """
+    update_hobby_scores_for_users([user])
+
+def _stored_pair_counts(user_ids: List[int]) -> Dict[int, int]:
+    """每个用户已保存的分数记录数"""
+    rows = db.session.query(CompatibilityScore.user1_id).filter(
+        CompatibilityScore.user1_id.in_(user_ids)
+    ).union_all(db.session.query(CompatibilityScore.user2_id).filter(
+        CompatibilityScore.user2_id.in_(user_ids)
+    )).all()
+    counts = defaultdict(int)
+    for user_id, in rows:
+        counts[user_id] += 1
+    return counts
+
+def update_hobby_scores_for_users(users: List[User], block_size: int = HOBBY_BLOCK_SIZE):
+    """多个用户的爱好变更后，按块一次计算这些用户与所有用户的爱好分项
+
+    两个用户都在变更列表中时该用户对只写一次；
+    某用户缺少分数记录时才需要做一次BFS补全关系距离得分
+    """
+    from .hobby_index import get_hobby_index
+    if not users:
+        return
+    hobby_ids = {user.id: [h.id for h in user.hobbies] for user in users}
+    index = get_hobby_index(hobby_ids.keys(), {hid for ids in hobby_ids.values() for hid in ids})
+    for user_id, ids in hobby_ids.items():
+        index.set_user_hobbies(user_id, ids)
+
+    user_ids = sorted(hobby_ids)
+    touched = np.isin(index.user_ids, user_ids)
+    graph = None
+    for start in range(0, len(user_ids), block_size):
+        batch = user_ids[start:start + block_size]
+        rows = np.array([index.position[uid] for uid in batch], dtype=np.int64)
+        hobby_overlap = index.hobby_overlap_block(rows)
+        subject_relatedness = index.subject_relatedness_block(rows)
+
+        # 已有行的关系距离得分不会被覆盖，只为缺少记录的用户计算
+        distance_factor = np.zeros(hobby_overlap.shape)
+        stored = _stored_pair_counts(batch)
+        for i, user_id in enumerate(batch):
+            if stored.get(user_id, 0) < index.size - 1:
+                if graph is None:
+                    graph = get_social_graph()
+                distance_factor[i] = _distance_factor_row(index, user_id, graph)
+
+        # 去掉自身配对，以及由id更小的变更用户负责写入的用户对
+        others = np.ones(hobby_overlap.shape, dtype=bool)
+        for i, user_id in enumerate(batch):
+            others[i] = (index.user_ids != user_id) & ~(touched & (index.user_ids < user_id))
+        block_rows, columns = np.nonzero(others)
+        bulk_upsert_scores(
+            np.asarray(batch, dtype=np.int64)[block_rows], index.user_ids[columns],
+            hobby_overlap[others], subject_relatedness[others], distance_factor[others],
+            update=('hobby_overlap', 'subject_relatedness')
+        )
 
 def update_compatibility_scores(user: User = None):
     """更新兼容性分数
@@ -106,38 +235,30 @@ def update_compatibility_scores(user: User = None):
     否则更新所有用户之间的兼容性分数
     """
     if user:
-        # 只更新指定用户的兼容性分数
-        other_users = User.query.filter(User.id != user.id).all()
-        for other_user in other_users:
-            score = calculate_compatibility(user, other_user)
-            update_or_create_score(user, other_user, score)
+        # 只更新指定用户的兼容性分数：一次向量化计算该用户与所有用户的各项分数
+        from .hobby_index import get_hobby_index
+        index = get_hobby_index((user.id,), [h.id for h in user.hobbies])
+        index.set_user_hobbies(user.id, [h.id for h in user.hobbies])
+        hobby_overlap, subject_relatedness = index.score_user(user.id)
+        distance_factor = _distance_factor_row(index, user.id)
+        others = index.user_ids != user.id
+        bulk_upsert_scores(
+            np.full(others.sum(), user.id), index.user_ids[others],
+            hobby_overlap[others], subject_relatedness[others], distance_factor[others]
+        )
     else:
-        # 更新所有用户之间的兼容性分数
-        users = User.query.all()
-        for i in range(len(users)):
-            for j in range(i + 1, len(users)):
-                score = calculate_compatibility(users[i], users[j])
-                update_or_create_score(users[i], users[j], score)
-    
-    db.session.commit()
+        # 更新所有用户之间的兼容性分数：由批量引擎一次加载数据并用矩阵运算计算
+        from .compatibility_engine import iter_all_scores
+        started = datetime.utcnow()
+        for block in iter_all_scores(max_hops=distance_cutoff()):
+            bulk_upsert_scores(*block, refresh_top=False, delete_dropped=False)
+        # 本次没有写入的行对应分数已不超过存储阈值的用户对
+        delete_stale_scores(started)
+        refresh_all_top_matches()
 
-def update_or_create_score(user1: User, user2: User, score: float):
+def update_or_create_score(user1: User, user2: User, hobby_overlap: float,
+                           subject_relatedness: float, distance_factor: float):
     """更新或创建兼容性分数记录"""
-    if user1.id > user2.id:
-        user1, user2 = user2, user1
-    
-    compatibility = CompatibilityScore.query.filter_by(
-        user1_id=user1.id,
-        user2_id=user2.id
-    ).first()
-    
-    if compatibility:
-        compatibility.score = score
-        compatibility.last_updated = datetime.utcnow()
-    else:
-        compatibility = CompatibilityScore(
-            user1_id=user1.id,
-            user2_id=user2.id,
-            score=score
-        )
-        db.session.add(compatibility) 
\ No newline at end of file
+    bulk_upsert_scores(
+        [user1.id], [user2.id], [hobby_overlap], [subject_relatedness], [distance_factor]
+    )
@@ -0,0 +1,139 @@
+import json
+import os
+from collections import namedtuple
+from typing import Iterator
+import numpy as np
+from .graph import FriendGraph, load_friend_graph, bfs_distances
+from .hobby_index import HobbyIndex, load_hobby_index
+from .relatedness import RelatednessTable
+
+# 每批计算的行数，控制 block_size × 用户数 矩阵的内存占用
+DEFAULT_BLOCK_SIZE = 512
+# score_rows 每个子块最多计算的 行数 × 列数，临时矩阵每个约 BLOCK_CELLS × 8 字节，
+# 与分片大小和用户数无关
+BLOCK_CELLS = 2_000_000
+
+# 一批用户对 (user1_id < user2_id) 的各项分数
+ScoreBlock = namedtuple(
+    'ScoreBlock',
+    ['user1_ids', 'user2_ids', 'hobby_overlap', 'subject_relatedness', 'distance_factor']
+)
+
+
+class CompatibilitySnapshot:
+    """一次性从数据库加载的用户、爱好和好友关系快照"""
+
+    def __init__(self, hobbies: HobbyIndex, graph: FriendGraph):
+        self.hobbies = hobbies                # 用户 × 爱好 索引，行按用户id升序
+        self.graph = graph                    # 节点顺序与 hobbies.user_ids 一致的好友图
+
+    @property
+    def user_ids(self) -> np.ndarray:
+        return self.hobbies.user_ids
+
+    @property
+    def size(self) -> int:
+        return self.hobbies.size
+
+
+def load_snapshot() -> CompatibilitySnapshot:
+    """用四条查询加载计算所需的全部数据"""
+    hobbies = load_hobby_index()
+    return CompatibilitySnapshot(hobbies, load_friend_graph(hobbies.user_ids))
+
+
+def save_snapshot(snapshot: CompatibilitySnapshot, directory: str):
+    """把快照保存为一组 .npy 文件，供其他进程以只读mmap方式打开"""
+    os.makedirs(directory, exist_ok=True)
+    arrays = {
+        'user_ids': snapshot.hobbies.user_ids,
+        'hobby_ids': snapshot.hobbies.hobby_ids,
+        'bits': snapshot.hobbies.bits,
+        'indptr': snapshot.graph.indptr,
+        'indices': snapshot.graph.indices,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, name + '.npy'), array)
+    np.save(os.path.join(directory, 'relatedness.npy'), snapshot.hobbies.relatedness_table.matrix)
+    with open(os.path.join(directory, 'names.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'hobbies': snapshot.hobbies.hobby_names,
+            'subjects': snapshot.hobbies.relatedness_table.subjects,
+        }, f, ensure_ascii=False)
+
+
+def open_snapshot(directory: str) -> CompatibilitySnapshot:
+    """以只读mmap方式打开 save_snapshot 保存的快照，多个进程共享同一份页缓存"""
+    def load(name):
+        return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+
+    with open(os.path.join(directory, 'names.json'), encoding='utf-8') as f:
+        names = json.load(f)
+    user_ids = load('user_ids')
+    relatedness = RelatednessTable(names['subjects'], load('relatedness'))
+    hobbies = HobbyIndex(user_ids, load('hobby_ids'), names['hobbies'], load('bits'), relatedness)
+    return CompatibilitySnapshot(hobbies, FriendGraph(user_ids, load('indptr'), load('indices')))
+
+
+def distance_factor_block(snapshot: CompatibilitySnapshot, rows: slice,
+                          max_hops: int = None, columns: slice = slice(None)) -> np.ndarray:
+    """计算一批用户与 columns 中用户（默认所有用户）的关系距离得分 0.5 / distance
+
+    max_hops 为跳数上限，BFS到上限即停止，更远的用户得分为0
+    """
+    distances = np.vstack([
+        bfs_distances(snapshot.graph, source, max_depth=max_hops)[columns]
+        for source in range(*rows.indices(snapshot.size))
+    ])
+    # 不可达时 0.5 / inf 为0，与 calculate_compatibility 一致
+    with np.errstate(divide='ignore'):
+        return 0.5 / distances
+
+
+def _score_block(snapshot: CompatibilitySnapshot, rows: slice, columns: slice,
+                 max_hops: int = None) -> ScoreBlock:
+    """计算 rows × columns 子块中 j > i 的用户对"""
+    overlap = snapshot.hobbies.hobby_overlap_block(rows, columns)
+    subject = snapshot.hobbies.subject_relatedness_block(rows, columns)
+    factor = distance_factor_block(snapshot, rows, max_hops, columns)
+    local, other = np.nonzero(
+        np.arange(rows.start, rows.stop)[:, None] < np.arange(columns.start, columns.stop)[None, :]
+    )
+    return ScoreBlock(
+        snapshot.user_ids[local + rows.start],
+        snapshot.user_ids[other + columns.start],
+        overlap[local, other],
+        subject[local, other],
+        factor[local, other]
+    )
+
+
+def score_rows(snapshot: CompatibilitySnapshot, rows: slice, max_hops: int = None) -> ScoreBlock:
+    """计算 rows 中每个用户与下标更大的用户之间的各项分数（上三角）
+
+    按子块计算，每个子块只取第一行之后的列，行数使 行数 × 列数 不超过 BLOCK_CELLS，
+    临时矩阵的内存占用固定；结果按 (行, 列) 顺序与整块计算相同
+    """
+    start, stop, _ = rows.indices(snapshot.size)
+    parts = []
+    while start < stop:
+        columns = slice(start + 1, snapshot.size)
+        width = max(1, columns.stop - columns.start)
+        end = min(stop, start + max(1, BLOCK_CELLS // width))
+        parts.append(_score_block(snapshot, slice(start, end), columns, max_hops))
+        start = end
+    if not parts:
+        empty = np.empty(0, dtype=np.float64)
+        return ScoreBlock(snapshot.user_ids[:0], snapshot.user_ids[:0], empty, empty, empty)
+    if len(parts) == 1:
+        return parts[0]
+    return ScoreBlock(*(np.concatenate(field) for field in zip(*parts)))
+
+
+def iter_all_scores(snapshot: CompatibilitySnapshot = None, block_size: int = DEFAULT_BLOCK_SIZE,
+                    max_hops: int = None) -> Iterator[ScoreBlock]:
+    """分块计算所有用户对的各项分数，每次产出一个 ScoreBlock"""
+    if snapshot is None:
+        snapshot = load_snapshot()
+    for start in range(0, snapshot.size, block_size):
+        yield score_rows(snapshot, slice(start, min(start + block_size, snapshot.size)), max_hops)
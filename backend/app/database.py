@@ -0,0 +1,69 @@
+from typing import List
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
+from . import db
+
+# 在旧版本创建的数据库上补加的列：(表名, 列名, 列定义)。
+# create_all 只创建缺少的表，不会修改已有的表
+ADDED_COLUMNS = [
+    ('score_job', 'claim', 'INTEGER NOT NULL DEFAULT 0'),
+    ('score_job', 'claimed_at', 'DATETIME'),
+    ('compatibility_score', 'hobby_overlap', 'FLOAT NOT NULL DEFAULT 0.0'),
+    ('compatibility_score', 'subject_relatedness', 'FLOAT NOT NULL DEFAULT 0.0'),
+    ('compatibility_score', 'distance_factor', 'FLOAT NOT NULL DEFAULT 0.0'),
+]
+# 补加这些表的列后已有行的新列只是默认值，需要全量重算
+RESCORE_TABLES = {'compatibility_score'}
+
+
+def configure_engine(engine: Engine, pragmas: dict):
+    """在每个新建的SQLite连接上执行 PRAGMA（其他数据库忽略）"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def upgrade_schema(connection) -> List[str]:
+    """为已有的表补加新增的列，返回补加的 表名.列名 列表
+
+    补加了分数组成部分的列时加入全量重算任务，由分数线程（或 python app/init_compatibility.py）填充
+    """
+    inspector = inspect(connection)
+    added = []
+    for table, column, ddl in ADDED_COLUMNS:
+        if not inspector.has_table(table):
+            continue
+        if column not in {c['name'] for c in inspector.get_columns(table)}:
+            connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+            added.append(f'{table}.{column}')
+    if any(name.split('.')[0] in RESCORE_TABLES for name in added):
+        from .jobs import mark_all_dirty
+        mark_all_dirty(connection)
+    return added
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _after_create(target, connection, **kw):
+    upgrade_schema(connection)
+
+
+@click.command('init-db')
+@click.option('--drop', is_flag=True, help='先删除所有表')
+@with_appcontext
+def init_db_command(drop):
+    """创建数据库表、全文索引及初始数据；已有的数据库补加新版本的列"""
+    from .jobs import stop_worker
+    # 一次性命令不处理分数任务，避免后台线程在建表、删表期间访问数据库
+    stop_worker()
+    if drop:
+        db.drop_all()
+    db.create_all()
+    click.echo('数据库已初始化')
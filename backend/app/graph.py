@@ -0,0 +1,280 @@
+from itertools import chain
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+from .models import user_friends
+from . import db
+
+
+class FriendGraph:
+    """好友关系的CSR邻接结构
+
+    节点是稠密下标 0..n-1，indices[indptr[i]:indptr[i + 1]] 为节点i的好友
+    """
+    __slots__ = ('user_ids', 'indptr', 'indices', '_position')
+
+    def __init__(self, user_ids: np.ndarray, indptr: np.ndarray, indices: np.ndarray):
+        self.user_ids = user_ids
+        self.indptr = indptr
+        self.indices = indices
+        self._position = None
+
+    @property
+    def position(self) -> Dict[int, int]:
+        """用户id -> 节点下标，首次使用时构建"""
+        if self._position is None:
+            self._position = {int(uid): i for i, uid in enumerate(self.user_ids)}
+        return self._position
+
+    @property
+    def size(self) -> int:
+        return len(self.user_ids)
+
+    def neighbors(self, node: int) -> np.ndarray:
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def has_edge(self, node1: int, node2: int) -> bool:
+        return bool(np.any(self.neighbors(node1) == node2))
+
+    def with_edge(self, node1: int, node2: int) -> 'FriendGraph':
+        """返回加入 node1-node2 双向边后的新图"""
+        if self.has_edge(node1, node2):
+            return self
+        rows = np.repeat(np.arange(self.size), np.diff(self.indptr))
+        sources = np.concatenate([rows, [node1, node2]])
+        targets = np.concatenate([self.indices, [node2, node1]])
+        indptr, indices = build_csr(sources, targets, self.size)
+        return FriendGraph(self.user_ids, indptr, indices)
+
+    def without_edge(self, node1: int, node2: int) -> 'FriendGraph':
+        """返回去掉 node1-node2 双向边后的新图"""
+        keep = np.ones(len(self.indices), dtype=bool)
+        for a, b in ((node1, node2), (node2, node1)):
+            start, end = self.indptr[a], self.indptr[a + 1]
+            keep[start:end] &= self.indices[start:end] != b
+        rows = np.repeat(np.arange(self.size), np.diff(self.indptr))
+        indptr = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows[keep], minlength=self.size), out=indptr[1:])
+        return FriendGraph(self.user_ids, indptr, self.indices[keep])
+
+
+def build_csr(sources: np.ndarray, targets: np.ndarray, size: int):
+    """由边数组构建CSR的 (indptr, indices)"""
+    order = np.argsort(sources, kind='stable')
+    indices = targets[order].astype(np.int32)
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=size), out=indptr[1:])
+    return indptr, indices
+
+
+def load_friend_graph(user_ids: Iterable[int] = None, include: Iterable[int] = ()) -> FriendGraph:
+    """用一条查询从 user_friends 构建好友图
+
+    提供 user_ids 时节点顺序与其一致（不在其中的边被忽略），
+    否则节点为所有出现在关系表中的用户再加上 include 中的用户
+    """
+    # 逐个展开成整数读入；np.array 把每个 Row 当作通用序列处理，几十万行时慢一个数量级
+    result = db.session.execute(db.select(user_friends.c.user_id, user_friends.c.friend_id))
+    edges = np.fromiter(chain.from_iterable(result), dtype=np.int64).reshape(-1, 2)
+
+    if user_ids is None:
+        ids = np.union1d(edges, np.asarray(list(include), dtype=np.int64))
+    else:
+        ids = np.asarray(list(user_ids), dtype=np.int64)
+    order = np.argsort(ids)
+    sorted_ids = ids[order]
+
+    # 将用户id映射为稠密下标
+    slots = np.searchsorted(sorted_ids, edges)
+    slots[slots >= len(ids)] = 0
+    known = (sorted_ids[slots] == edges).all(axis=1) if len(ids) else np.zeros(len(edges), dtype=bool)
+    nodes = order[slots[known]]
+
+    indptr, indices = build_csr(nodes[:, 0], nodes[:, 1], len(ids))
+    return FriendGraph(ids, indptr, indices)
+
+
+def gather_neighbors(graph: FriendGraph, frontier: np.ndarray) -> np.ndarray:
+    """一次取出frontier中所有节点的好友（可能重复）"""
+    starts = graph.indptr[frontier]
+    lengths = graph.indptr[frontier + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=graph.indices.dtype)
+    # 每段的起点偏移 + 段内序号
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return graph.indices[offsets + np.arange(total)]
+
+
+def bfs_distances(graph: FriendGraph, source: int, max_depth: int = None,
+                  targets: np.ndarray = None) -> np.ndarray:
+    """从节点source按层扩展BFS，返回到所有节点的跳数，不可达为inf
+
+    max_depth: 只扩展到该层，更远的节点保持inf
+    targets: 这些节点全部到达后提前结束
+    """
+    distances = np.full(graph.size, np.inf)
+    distances[source] = 0
+    frontier = np.array([source], dtype=np.int64)
+    pending = None
+    if targets is not None:
+        pending = np.zeros(graph.size, dtype=bool)
+        pending[targets] = True
+        pending[source] = False
+    depth = 0
+    while frontier.size:
+        if pending is not None and not pending.any():
+            break
+        if max_depth is not None and depth >= max_depth:
+            break
+        depth += 1
+        candidates = gather_neighbors(graph, frontier)
+        frontier = np.unique(candidates[np.isinf(distances[candidates])])
+        distances[frontier] = depth
+        if pending is not None:
+            pending[frontier] = False
+    return distances
+
+
+def bidirectional_distance(graph: FriendGraph, source: int, target: int,
+                           max_hops: int = None) -> float:
+    """从两端同时按层扩展的BFS，返回source到target的跳数
+
+    每次扩展较小的一侧，两侧相遇即结束；max_hops 为上限，超过时返回inf
+    """
+    if source == target:
+        return 0
+    distances = (np.full(graph.size, np.inf), np.full(graph.size, np.inf))
+    distances[0][source] = 0
+    distances[1][target] = 0
+    frontiers = [np.array([source], dtype=np.int64), np.array([target], dtype=np.int64)]
+    depths = [0, 0]
+    while frontiers[0].size and frontiers[1].size:
+        if max_hops is not None and depths[0] + depths[1] >= max_hops:
+            break
+        side = 0 if frontiers[0].size <= frontiers[1].size else 1
+        own, other = distances[side], distances[1 - side]
+        candidates = gather_neighbors(graph, frontiers[side])
+        frontier = np.unique(candidates[np.isinf(own[candidates])])
+        depths[side] += 1
+        own[frontier] = depths[side]
+        met = frontier[np.isfinite(other[frontier])]
+        if met.size:
+            return float((own[met] + other[met]).min())
+        frontiers[side] = frontier
+    return float('inf')
+
+
+def changed_distances(graph: FriendGraph, user1_id: int, user2_id: int,
+                      max_hops: int = None) -> List[Tuple[int, int, float]]:
+    """好友边 user1-user2 刚被加入或删除后，找出最短距离发生变化的用户对
+
+    graph 为变更后的好友图。记 G- 为不含该边的图，du/dv 为G-中到两端的距离，
+    加入该边后 d+(s,t) = min(d-(s,t), du[s] + 1 + dv[t], dv[s] + 1 + du[t])。
+    只有 du[s] + 1 < dv[s] 且 dv[t] + 1 < du[t]（或反之）的 (s, t) 才可能变化，
+    因此只需从较小一侧的节点出发做有界BFS。
+    max_hops 为距离上限：超过上限的距离视为inf，经过该边的路径超过上限的用户对
+    关系距离得分前后都是0，不会被返回。
+    返回 (小id, 大id, 新距离) 列表
+    """
+    u = graph.position[user1_id]
+    v = graph.position[user2_id]
+    inserted = graph.has_edge(u, v)
+    without = graph.without_edge(u, v) if inserted else graph
+
+    # 上限内的距离是准确的，更远的节点为inf，不影响下面的判断
+    du = bfs_distances(without, u, max_depth=max_hops)
+    dv = bfs_distances(without, v, max_depth=max_hops)
+    near_u = np.nonzero(du + 1 < dv)[0]
+    near_v = np.nonzero(dv + 1 < du)[0]
+    if max_hops is not None:
+        near_u = near_u[du[near_u] < max_hops]
+        near_v = near_v[dv[near_v] < max_hops]
+    if near_u.size == 0 or near_v.size == 0:
+        return []
+    if near_u.size <= near_v.size:
+        sources, targets, d_source, d_target = near_u, near_v, du, dv
+    else:
+        sources, targets, d_source, d_target = near_v, near_u, dv, du
+
+    changes = []
+    for s in sources.tolist():
+        # 经过新边的路径长度
+        via_edge = d_source[s] + 1 + d_target[targets]
+        if inserted:
+            # 只需知道G-中的距离是否超过经过新边的长度
+            before = bfs_distances(without, s, max_depth=int(via_edge.max()))[targets]
+            changed = via_edge < before
+            after = via_edge
+        else:
+            # 删除后需要G-中的确切距离
+            after = bfs_distances(without, s, max_depth=max_hops, targets=targets)[targets]
+            changed = via_edge < after
+        if max_hops is not None:
+            changed &= via_edge <= max_hops
+        source_id = int(graph.user_ids[s])
+        for t, distance in zip(targets[changed].tolist(), after[changed].tolist()):
+            target_id = int(graph.user_ids[t])
+            a, b = min(source_id, target_id), max(source_id, target_id)
+            changes.append((a, b, distance))
+    return changes
+
+
+class DistanceTable:
+    """按源用户缓存BFS结果的距离表
+
+    max_hops 为距离上限，超过上限的用户按不可达处理
+    """
+
+    def __init__(self, graph: FriendGraph = None, max_hops: int = None):
+        self.graph = graph if graph is not None else load_friend_graph()
+        self.max_hops = max_hops
+        self._rows: Dict[int, np.ndarray] = {}
+
+    def row(self, node: int) -> np.ndarray:
+        """节点node到所有节点的距离"""
+        if node not in self._rows:
+            self._rows[node] = bfs_distances(self.graph, node, max_depth=self.max_hops)
+        return self._rows[node]
+
+    def distance(self, user1_id: int, user2_id: int) -> float:
+        """两个用户之间的最短路径长度，不可达或超过上限为inf"""
+        if user1_id == user2_id:
+            return 0
+        source = self.graph.position.get(user1_id)
+        target = self.graph.position.get(user2_id)
+        if source is None or target is None:
+            return float('inf')
+        # 好友关系总是双向写入，已缓存另一端的BFS结果时直接复用
+        if target in self._rows and source not in self._rows:
+            source, target = target, source
+        return float(self.row(source)[target])
+
+
+def changed_distances_for_edges(graph: FriendGraph, edges: List[Tuple[int, int, bool]],
+                                max_hops: int = None) -> List[Tuple[int, int, float]]:
+    """多条好友边变更后，找出最短距离发生变化的用户对
+
+    graph 为全部变更后的好友图，edges 为 (user1_id, user2_id, 变更前是否存在该边)。
+    先把图还原到变更前，再逐条应用变更，收集每一步距离可能变化的用户对，
+    最后在变更后的图上求这些用户对的距离。返回 (小id, 大id, 新距离) 列表
+    """
+    edges = [
+        (u, v, existed) for u, v, existed in edges
+        if graph.has_edge(graph.position[u], graph.position[v]) != existed
+    ]
+    if len(edges) == 1:
+        return changed_distances(graph, edges[0][0], edges[0][1], max_hops)
+
+    step = graph
+    for u, v, existed in edges:
+        nodes = (graph.position[u], graph.position[v])
+        step = step.with_edge(*nodes) if existed else step.without_edge(*nodes)
+
+    pairs = set()
+    for u, v, existed in edges:
+        nodes = (graph.position[u], graph.position[v])
+        step = step.without_edge(*nodes) if existed else step.with_edge(*nodes)
+        pairs.update((a, b) for a, b, _ in changed_distances(step, u, v, max_hops))
+
+    table = DistanceTable(graph, max_hops)
+    return [(a, b, table.distance(a, b)) for a, b in sorted(pairs)]
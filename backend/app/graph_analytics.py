@@ -0,0 +1,277 @@
+import argparse
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Iterator, List, Tuple
+import numpy as np
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import aliased
+from .models import User, MutualFriend, Community, CommunityMember, user_friends
+from . import db
+from .graph import FriendGraph, gather_neighbors, load_friend_graph
+
+logger = logging.getLogger(__name__)
+
+# 每个用户保留的共同好友推荐数量
+MUTUALS_K = 20
+# 计算共同好友时每块行展开的两跳路径数上限，决定单块的内存占用（每条路径约40字节）
+WEDGE_BLOCK_SIZE = 2_000_000
+# 标签传播的最大轮数，以及提前结束时每轮变化节点的比例
+LPA_MAX_ITERATIONS = 30
+LPA_TOLERANCE = 0.001
+# 共同好友结果每个事务写入的行数
+WRITE_CHUNK_SIZE = 20000
+# 分析结果的版本号名称，重新计算后加一
+ANALYTICS_VERSION = 'graph_analytics'
+
+
+def _row_blocks(graph: FriendGraph, budget: int) -> Iterator[np.ndarray]:
+    """按两跳路径数把节点切成连续的块，每块展开的路径数不超过 budget（单个节点超出时独占一块）"""
+    degrees = np.diff(graph.indptr)
+    rows = np.repeat(np.arange(graph.size), degrees)
+    # 节点i的两跳路径数 = 其好友的度数之和
+    wedges = np.bincount(rows, weights=degrees[graph.indices], minlength=graph.size)
+    cumulative = np.cumsum(wedges)
+    start = 0
+    while start < graph.size:
+        offset = cumulative[start - 1] if start else 0
+        end = max(int(np.searchsorted(cumulative, offset + budget, side='right')), start + 1)
+        yield np.arange(start, end)
+        start = end
+
+
+def mutual_friend_counts(graph: FriendGraph, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """稀疏矩阵乘积 A·A 中 rows 这些行的非零元素，去掉对角线和已是好友的位置
+
+    展开 i -> 好友m -> m的好友j 的全部两跳路径，按 (i, j) 计数即为共同好友数。
+    返回按 (i, j) 升序的 (i, j, 共同好友数)，均为节点下标
+    """
+    n = graph.size
+    degrees = np.diff(graph.indptr)
+    middles = gather_neighbors(graph, rows)
+    sources = np.repeat(rows, degrees[rows])
+    ends = gather_neighbors(graph, middles)
+    starts = np.repeat(sources, degrees[middles])
+    keep = ends != starts
+    keys, counts = np.unique(starts[keep].astype(np.int64) * n + ends[keep], return_counts=True)
+
+    friends = sources.astype(np.int64) * n + middles
+    keep = ~np.isin(keys, friends)
+    keys, counts = keys[keep], counts[keep]
+    return keys // n, keys % n, counts
+
+
+def top_mutuals(graph: FriendGraph, k: int = MUTUALS_K,
+                block_size: int = WEDGE_BLOCK_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """逐块计算每个用户共同好友最多的前k个非好友用户
+
+    按 (共同好友数降序, 用户id升序) 排名，逐块产出 (用户id, 排名, 对方用户id, 共同好友数)
+    """
+    for rows in _row_blocks(graph, block_size):
+        sources, targets, counts = mutual_friend_counts(graph, rows)
+        if not len(sources):
+            continue
+        # 节点下标与用户id同序，按下标排序即按用户id排序
+        order = np.lexsort((targets, -counts, sources))
+        sources, targets, counts = sources[order], targets[order], counts[order]
+        ranks = np.arange(len(sources)) - np.searchsorted(sources, sources) + 1
+        keep = ranks <= k
+        yield (graph.user_ids[sources[keep]], ranks[keep],
+               graph.user_ids[targets[keep]], counts[keep])
+
+
+def label_propagation(graph: FriendGraph, max_iterations: int = LPA_MAX_ITERATIONS,
+                      tolerance: float = LPA_TOLERANCE, seed: int = 0) -> np.ndarray:
+    """标签传播划分社区，返回每个节点的标签（同一社区标签相同）
+
+    每轮所有节点同时统计好友的标签，选出现最多的标签；平局时保留当前标签
+    （当前标签也在最多之列时），否则随机选一个。每轮只更新随机的一半节点，
+    避免同步更新在二分结构上来回震荡。变化的节点少于 tolerance 比例时结束
+    """
+    n = graph.size
+    rng = np.random.default_rng(seed)
+    labels = np.arange(n, dtype=np.int64)
+    rows = np.repeat(np.arange(n), np.diff(graph.indptr))
+    for iteration in range(max_iterations):
+        keys, counts = np.unique(rows * n + labels[graph.indices], return_counts=True)
+        nodes, candidates = keys // n, keys % n
+        # 计数为整数，加上小于1的偏好值只影响平局
+        preference = (candidates == labels[nodes]) * 0.5 + rng.random(len(keys)) * 0.25
+        order = np.lexsort((-(counts + preference), nodes))
+        # 每个节点排在最前的候选标签；没有好友的节点保持原标签
+        first = np.unique(nodes[order], return_index=True)[1]
+        best = labels.copy()
+        best[nodes[order[first]]] = candidates[order[first]]
+
+        changed = best != labels
+        update = changed & (rng.random(n) < 0.5)
+        labels[update] = best[update]
+        logger.debug('label propagation iteration=%d changed=%d', iteration, int(changed.sum()))
+        if changed.sum() <= tolerance * n:
+            break
+    return labels
+
+
+def communities(graph: FriendGraph, labels: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """把标签换成社区id（社区内最小的用户id），返回 (社区id, 人数, 每个节点的社区id)"""
+    _, inverse, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+    ids = np.full(len(sizes), np.iinfo(np.int64).max)
+    np.minimum.at(ids, inverse, graph.user_ids)
+    return ids, sizes, ids[inverse]
+
+
+def _insert(table, columns: Tuple[str, ...], rows: List[tuple]):
+    """executemany 插入，参数以元组直接交给驱动，省去逐行的参数处理"""
+    if rows:
+        sql = str(table.insert().compile(dialect=db.engine.dialect, column_keys=list(columns)))
+        db.session.connection().exec_driver_sql(sql, rows)
+
+
+def _replace_communities(graph: FriendGraph, labels: np.ndarray) -> Tuple[int, int]:
+    """在一个事务中整体替换社区及成员表，返回 (社区数, 最大社区人数)"""
+    community_ids, sizes, membership = communities(graph, labels)
+    now = datetime.utcnow()
+    CommunityMember.query.delete(synchronize_session=False)
+    Community.query.delete(synchronize_session=False)
+    _insert(Community.__table__, ('id', 'size', 'computed_at'),
+            [(cid, size, now) for cid, size in zip(community_ids.tolist(), sizes.tolist())])
+    _insert(CommunityMember.__table__, ('user_id', 'community_id'),
+            list(zip(graph.user_ids.tolist(), membership.tolist())))
+    db.session.commit()
+    return len(community_ids), int(sizes.max()) if len(sizes) else 0
+
+
+def _replace_mutuals(graph: FriendGraph, k: int) -> int:
+    """逐块计算并按用户id区间分批替换 mutual_friend，返回写入的行数
+
+    每个事务删除一段用户id区间内的旧结果并写入新结果（约 WRITE_CHUNK_SIZE 行），
+    写锁只短暂持有；同一用户的结果总是整体替换
+    """
+    table = MutualFriend.__table__
+    columns = ('user_id', 'rank', 'other_id', 'mutual_count')
+    # 已替换区间的上界（含），之前的用户都已写入新结果
+    done = None
+    written = 0
+    for user_ids, ranks, other_ids, counts in top_mutuals(graph, k):
+        # 在用户边界处切分
+        cuts = np.unique(np.searchsorted(user_ids, user_ids[::WRITE_CHUNK_SIZE]))
+        for start, end in zip(cuts.tolist(), cuts[1:].tolist() + [len(user_ids)]):
+            last = int(user_ids[end - 1])
+            stale = table.delete().where(table.c.user_id <= last)
+            if done is not None:
+                stale = stale.where(table.c.user_id > done)
+            db.session.execute(stale)
+            _insert(table, columns, list(zip(
+                user_ids[start:end].tolist(), ranks[start:end].tolist(),
+                other_ids[start:end].tolist(), counts[start:end].tolist())))
+            db.session.commit()
+            done = last
+            written += end - start
+    # 最后一个有结果的用户之后（如已没有好友的用户）的旧结果
+    stale = table.delete()
+    if done is not None:
+        stale = stale.where(table.c.user_id > done)
+    db.session.execute(stale)
+    db.session.commit()
+    return written
+
+
+def run_graph_analytics(k: int = MUTUALS_K, seed: int = 0) -> dict:
+    """从 user_friends 重新计算社区和共同好友，替换结果表
+
+    读取好友图后在不持有写锁的情况下计算；社区在一个事务中整体替换，
+    共同好友按用户区间分批替换（替换期间部分用户读到的仍是上一次的结果）。
+    返回统计信息
+    """
+    from .cache import bump_version
+    started = time.monotonic()
+    graph = load_friend_graph()
+    db.session.commit()
+
+    count, largest = _replace_communities(graph, label_propagation(graph, seed=seed))
+    mutuals = _replace_mutuals(graph, k)
+    bump_version(ANALYTICS_VERSION)
+    db.session.commit()
+
+    stats = {
+        'users': graph.size,
+        'friendships': len(graph.indices) // 2,
+        'communities': count,
+        'largest_community': largest,
+        'mutual_rows': mutuals,
+        'seconds': round(time.monotonic() - started, 3),
+    }
+    logger.info('graph analytics %s', stats)
+    return stats
+
+
+def get_mutuals(user_id: int, k: int = MUTUALS_K):
+    """读取某用户共同好友最多的前k个用户
+
+    按 (user_id, rank) 主键范围查询，同一条语句带出用户信息、好友标记
+    （分析之后才成为好友的用户）以及是否与该用户在同一社区，
+    返回 (MutualFriend, User, 是否好友, 是否同一社区) 列表
+    """
+    own = aliased(CommunityMember)
+    other = aliased(CommunityMember)
+    return db.session.query(
+        MutualFriend, User, user_friends.c.friend_id.isnot(None),
+        and_(own.community_id.isnot(None), own.community_id == other.community_id)
+    ).join(
+        User, User.id == MutualFriend.other_id
+    ).outerjoin(
+        user_friends,
+        (user_friends.c.user_id == user_id) & (user_friends.c.friend_id == MutualFriend.other_id)
+    ).outerjoin(
+        own, own.user_id == user_id
+    ).outerjoin(
+        other, other.user_id == MutualFriend.other_id
+    ).filter(
+        MutualFriend.user_id == user_id,
+        MutualFriend.rank <= k
+    ).order_by(MutualFriend.rank).all()
+
+
+def list_communities(position=None, limit: int = 20, min_size: int = 1):
+    """按 (人数降序, id升序) 分页列出社区，position 为上一页最后一个社区的 [人数, id]
+
+    走 ix_community_size 索引，多取一行判断是否还有下一页，返回 (本页社区, 是否还有下一页)
+    """
+    query = Community.query.filter(Community.size >= min_size)
+    if position is not None:
+        last_size, last_id = position
+        query = query.filter(or_(
+            Community.size < last_size,
+            and_(Community.size == last_size, Community.id > last_id)
+        ))
+    rows = query.order_by(Community.size.desc(), Community.id).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+
+def community_members(community_id: int):
+    """社区成员查询，通过 ix_community_member_community 索引按用户id升序读取"""
+    return db.session.query(User).join(
+        CommunityMember,
+        and_(CommunityMember.user_id == User.id, CommunityMember.community_id == community_id)
+    )
+
+
+def main():
+    """重新计算好友图分析结果：python -m app.graph_analytics
+
+    好友关系变化后不会自动重算，按需要的时效定时执行（如每小时一次的 cron）
+    """
+    from . import create_app
+    parser = argparse.ArgumentParser(description='计算共同好友和好友社区')
+    parser.add_argument('-k', type=int, default=MUTUALS_K, help='每个用户保留的共同好友推荐数')
+    parser.add_argument('--seed', type=int, default=0, help='标签传播的随机种子')
+    args = parser.parse_args()
+    app = create_app(SCORE_WORKER='off')
+    with app.app_context():
+        stats = run_graph_analytics(args.k, args.seed)
+    print(json.dumps(stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+from collections import defaultdict
+from typing import Dict, Iterable, Set
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.sqlite import insert
+from .models import user_hobbies
+from . import db
+from .cache import bump_version
+from .user_cache import invalidate_users
+
+# 每条语句处理的 (用户, 爱好) 行数
+ASSIGNMENT_CHUNK_SIZE = 5000
+
+
+def assign_hobbies(assignments: Dict[int, Iterable[int]], replace: bool = False) -> Set[int]:
+    """在一个事务中批量设置用户的爱好，返回爱好实际发生变化的用户id
+
+    assignments 为 用户id -> 爱好id列表；replace 为真时替换这些用户原有的爱好，否则只追加。
+    先一次读出这些用户已有的爱好，只插入/删除差异部分，变化的用户只加入一次分数任务
+    """
+    from .jobs import mark_hobbies_dirty_many
+    wanted = {user_id: set(hobby_ids) for user_id, hobby_ids in assignments.items()}
+    user_ids = sorted(wanted)
+    existing = defaultdict(set)
+    for start in range(0, len(user_ids), ASSIGNMENT_CHUNK_SIZE):
+        for user_id, hobby_id in db.session.execute(
+                db.select(user_hobbies.c.user_id, user_hobbies.c.hobby_id).where(
+                    user_hobbies.c.user_id.in_(user_ids[start:start + ASSIGNMENT_CHUNK_SIZE]))):
+            existing[user_id].add(hobby_id)
+
+    added = [(u, h) for u in user_ids for h in sorted(wanted[u] - existing[u])]
+    removed = [(u, h) for u in user_ids for h in sorted(existing[u] - wanted[u])] if replace else []
+    for start in range(0, len(added), ASSIGNMENT_CHUNK_SIZE):
+        db.session.execute(insert(user_hobbies).values([
+            {'user_id': u, 'hobby_id': h} for u, h in added[start:start + ASSIGNMENT_CHUNK_SIZE]
+        ]).on_conflict_do_nothing())
+    for start in range(0, len(removed), ASSIGNMENT_CHUNK_SIZE):
+        db.session.execute(user_hobbies.delete().where(
+            tuple_(user_hobbies.c.user_id, user_hobbies.c.hobby_id).in_(
+                removed[start:start + ASSIGNMENT_CHUNK_SIZE])
+        ))
+
+    touched = {u for u, _ in added} | {u for u, _ in removed}
+    if not touched:
+        db.session.rollback()
+        return touched
+    mark_hobbies_dirty_many(sorted(touched))
+    bump_version('hobbies')
+    db.session.commit()
+    invalidate_users(*touched)
+    return touched
@@ -0,0 +1,196 @@
+import threading
+import time
+from typing import Iterable, List, Tuple
+import numpy as np
+from .models import User, Hobby, user_hobbies
+from . import db
+from .relatedness import RelatednessTable, load_relatedness_table
+
+# 进程内缓存的有效期（秒），超时后重新从数据库加载，兼顾多进程部署下的一致性
+HOBBY_INDEX_TTL = 300
+# 位集每个字的位数
+WORD_BITS = 64
+
+
+class HobbyIndex:
+    """每个用户的爱好位集及学科相关度矩阵
+
+    行按用户id升序排列；bits[i] 为用户i的爱好位集，第j位对应按id升序的第j个爱好，
+    每 WORD_BITS 位一个 uint64 字。
+    max_related[i, b] 缓存用户i的爱好与第b个学科的最大相关度，
+    两个用户的学科相关度即 max(max_related[i] * subjects[j])
+    """
+
+    def __init__(self, user_ids: np.ndarray, hobby_ids: np.ndarray,
+                 hobby_names: List[str], bits: np.ndarray,
+                 relatedness: RelatednessTable):
+        self.user_ids = user_ids
+        self.hobby_ids = hobby_ids
+        self.hobby_names = hobby_names
+        self.bits = bits
+        self.position = {int(uid): i for i, uid in enumerate(user_ids)}
+        self.hobby_position = {int(hid): j for j, hid in enumerate(hobby_ids)}
+        self.hobby_counts = popcount(bits)
+        self.relatedness_table = relatedness
+        self.relatedness, self.subject_columns = relatedness.compile(hobby_names)
+        self.subjects = unpack_columns(bits, self.subject_columns)
+        self.max_related = build_max_related(self.subjects, self.relatedness)
+        self.loaded_at = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        return len(self.user_ids)
+
+    def covers(self, hobby_ids: Iterable[int]) -> bool:
+        return all(hid in self.hobby_position for hid in hobby_ids)
+
+    def set_user_hobbies(self, user_id: int, hobby_ids: Iterable[int]):
+        """就地更新某个用户的爱好行"""
+        row = self.position[user_id]
+        columns = np.array([self.hobby_position[hid] for hid in hobby_ids], dtype=np.int64)
+        self.bits[row] = pack_hobbies(np.zeros(len(columns), dtype=np.int64), columns,
+                                      1, self.bits.shape[1])[0]
+        self.hobby_counts[row] = popcount(self.bits[row])
+        self.subjects[row] = unpack_columns(self.bits[row:row + 1], self.subject_columns)[0]
+        self.max_related[row] = build_max_related(self.subjects[row:row + 1], self.relatedness)[0]
+
+    def hobby_overlap_block(self, rows, columns=slice(None)) -> np.ndarray:
+        """计算一批用户与 columns 中用户（默认所有用户）的爱好Jaccard重合度：|A & B| / |A | B|"""
+        block = self.bits[rows]
+        counts = self.hobby_counts[rows]
+        bits = self.bits[columns]
+        other_counts = self.hobby_counts[columns]
+        intersection = np.zeros((len(block), len(bits)), dtype=np.int32)
+        # 逐字按位与后计数，复用临时数组避免每个字都分配 block × 用户数 的内存
+        anded = np.empty(intersection.shape, dtype=np.uint64)
+        counted = np.empty(intersection.shape, dtype=np.uint8)
+        for word in range(self.bits.shape[1]):
+            np.bitwise_and(block[:, word, None], bits[None, :, word], out=anded)
+            np.bitwise_count(anded, out=counted)
+            intersection += counted
+        union = counts[:, None] + other_counts[None, :] - intersection
+        overlap = np.zeros(intersection.shape, dtype=np.float64)
+        # 任一方没有爱好时重合度为0，与 calculate_hobby_overlap 一致
+        valid = (counts[:, None] > 0) & (other_counts[None, :] > 0)
+        np.divide(intersection, union, out=overlap, where=valid)
+        return overlap
+
+    def subject_relatedness_block(self, rows, columns=slice(None)) -> np.ndarray:
+        """计算一批用户与 columns 中用户（默认所有用户）的最大学科相关度"""
+        max_related = self.max_related[rows]
+        subjects = self.subjects[columns]
+        result = np.zeros((len(max_related), len(subjects)), dtype=np.float64)
+        for b in range(len(self.subject_columns)):
+            np.maximum(result, np.outer(max_related[:, b], subjects[:, b]), out=result)
+        return result
+
+    def pair_terms(self, user1_ids: Iterable[int], user2_ids: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """逐对计算 (爱好重合度, 学科相关度)，两个列表等长"""
+        rows1 = np.array([self.position[uid] for uid in user1_ids], dtype=np.int64)
+        rows2 = np.array([self.position[uid] for uid in user2_ids], dtype=np.int64)
+        counts1 = self.hobby_counts[rows1]
+        counts2 = self.hobby_counts[rows2]
+        intersection = popcount(self.bits[rows1] & self.bits[rows2])
+        overlap = np.zeros(len(rows1), dtype=np.float64)
+        np.divide(intersection, counts1 + counts2 - intersection, out=overlap,
+                  where=(counts1 > 0) & (counts2 > 0))
+
+        subject = np.zeros(len(rows1), dtype=np.float64)
+        if len(self.subject_columns) and len(rows1):
+            subject = (self.max_related[rows1] * self.subjects[rows2]).max(axis=1)
+        return overlap, subject
+
+    def score_user(self, user_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """一次向量化计算某用户与所有用户的 (爱好重合度, 学科相关度)"""
+        rows = slice(self.position[user_id], self.position[user_id] + 1)
+        return self.hobby_overlap_block(rows)[0], self.subject_relatedness_block(rows)[0]
+
+
+def pack_hobbies(rows: np.ndarray, columns: np.ndarray, size: int, words: int = None) -> np.ndarray:
+    """把 (行, 爱好列) 对打包成 size 行的位集矩阵"""
+    if words is None:
+        words = max(1, -(-int(columns.max(initial=0) + 1) // WORD_BITS))
+    bits = np.zeros((size, words), dtype=np.uint64)
+    np.bitwise_or.at(
+        bits, (rows, columns // WORD_BITS),
+        np.left_shift(np.uint64(1), (columns % WORD_BITS).astype(np.uint64))
+    )
+    return bits
+
+
+def popcount(bits: np.ndarray) -> np.ndarray:
+    """位集中置位的个数（对最后一维求和）"""
+    return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+
+
+def unpack_columns(bits: np.ndarray, columns: np.ndarray) -> np.ndarray:
+    """取出指定爱好列的0/1矩阵"""
+    words = bits[:, columns // WORD_BITS]
+    shifts = (columns % WORD_BITS).astype(np.uint64)
+    return ((words >> shifts) & np.uint64(1)).astype(np.float64)
+
+
+def build_max_related(subjects: np.ndarray, relatedness: np.ndarray) -> np.ndarray:
+    """max_related[i, b] = max_a subjects[i, a] * relatedness[a, b]
+
+    即用户i的学科爱好与学科b的最大相关度，没有学科爱好时为0
+    """
+    max_related = np.zeros(subjects.shape, dtype=np.float64)
+    for a in range(relatedness.shape[0]):
+        np.maximum(max_related, np.outer(subjects[:, a], relatedness[a]), out=max_related)
+    return max_related
+
+
+def load_hobby_index() -> HobbyIndex:
+    """用四条查询构建爱好索引（含学科相关度表）"""
+    user_ids = np.array(
+        [row[0] for row in db.session.query(User.id).order_by(User.id)],
+        dtype=np.int64
+    )
+    position = {int(uid): i for i, uid in enumerate(user_ids)}
+
+    hobbies = db.session.query(Hobby.id, Hobby.name).order_by(Hobby.id).all()
+    hobby_position = {hid: j for j, (hid, _) in enumerate(hobbies)}
+    rows, columns = [], []
+    for user_id, hobby_id in db.session.execute(
+            db.select(user_hobbies.c.user_id, user_hobbies.c.hobby_id)):
+        if user_id in position and hobby_id in hobby_position:
+            rows.append(position[user_id])
+            columns.append(hobby_position[hobby_id])
+    words = max(1, -(-len(hobbies) // WORD_BITS))
+
+    return HobbyIndex(
+        user_ids,
+        np.array([hid for hid, _ in hobbies], dtype=np.int64),
+        [name for _, name in hobbies],
+        pack_hobbies(np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64),
+                     len(user_ids), words),
+        load_relatedness_table()
+    )
+
+
+_cache_lock = threading.Lock()
+_cached_index: HobbyIndex = None
+
+
+def get_hobby_index(user_ids: Iterable[int] = (), hobby_ids: Iterable[int] = ()) -> HobbyIndex:
+    """获取进程内缓存的爱好索引
+
+    缓存过期、或不包含指定的用户/爱好时重新加载
+    """
+    global _cached_index
+    with _cache_lock:
+        index = _cached_index
+        if (index is None
+                or time.monotonic() - index.loaded_at > HOBBY_INDEX_TTL
+                or not all(uid in index.position for uid in user_ids)
+                or not index.covers(hobby_ids)):
+            index = _cached_index = load_hobby_index()
+        return index
+
+
+def invalidate_hobby_index():
+    """丢弃缓存的爱好索引"""
+    global _cached_index
+    with _cache_lock:
+        _cached_index = None
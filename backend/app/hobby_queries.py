@@ -0,0 +1,22 @@
+from sqlalchemy import func
+from .models import Hobby, user_hobbies
+from . import db
+
+
+def hobbies_with_counts(ids=None):
+    """爱好及其用户数，一条分组聚合查询完成
+
+    ids 为可选的爱好id子查询，用于只统计搜索命中的爱好
+    """
+    query = db.session.query(
+        Hobby.id, Hobby.name, func.count(user_hobbies.c.user_id)
+    ).outerjoin(
+        user_hobbies, user_hobbies.c.hobby_id == Hobby.id
+    )
+    if ids is not None:
+        query = query.filter(Hobby.id.in_(ids))
+    rows = query.group_by(Hobby.id).order_by(Hobby.id).all()
+    return [
+        {'id': hobby_id, 'name': name, 'user_count': user_count}
+        for hobby_id, name, user_count in rows
+    ]
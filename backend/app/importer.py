@@ -0,0 +1,279 @@
+import argparse
+import csv
+import heapq
+import io
+import json
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Set, Tuple
+from sqlalchemy.dialects.sqlite import insert
+from werkzeug.security import generate_password_hash
+from .models import User, Hobby, user_hobbies, user_friends
+from . import db
+
+# 每批处理的名单行数，也是每条 executemany 的行数
+DEFAULT_CHUNK_SIZE = 5000
+# 按学号查询用户id时每条语句的参数个数
+LOOKUP_CHUNK_SIZE = 10000
+FIELDS = ('student_id', 'email', 'name', 'contact')
+REQUIRED_FIELDS = ('student_id', 'email', 'name')
+
+
+def _split(value) -> List[str]:
+    """CSV 中分号分隔的字段，NDJSON 中的列表原样返回"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(';') if item.strip()]
+    return [str(item) for item in value]
+
+
+def read_roster(stream: io.TextIOBase, fmt: str = 'csv') -> Iterator[dict]:
+    """逐行读取名单，fmt 为 csv 或 ndjson（每行一个JSON对象）
+
+    字段：
+      student_id, email, name, contact：与 user_data 表相同，前三个必填
+      password 或 password_hash：二选一，password 在导入时计算哈希
+      hobbies：爱好名，CSV 中用分号分隔，NDJSON 中为列表；不存在的爱好自动创建
+      friends：好友的学号，格式同 hobbies；可以引用名单中后出现的用户或已有用户
+    """
+    if fmt == 'csv':
+        rows = csv.DictReader(stream)
+    else:
+        rows = (json.loads(line) for line in stream if line.strip())
+    for row in rows:
+        if row.get('student_id') is not None:
+            row['student_id'] = str(row['student_id'])
+        row['hobbies'] = _split(row.get('hobbies'))
+        row['friends'] = _split(row.get('friends'))
+        yield row
+
+
+def _weighted_sample(rng: random.Random, names: List[str], weights: Sequence[float], k: int) -> List[str]:
+    """按权重不放回地抽取k个（Efraimidis-Spirakis：每项取 u^(1/w)，保留最大的k个）"""
+    keys = [(rng.random() ** (1.0 / w), name) for name, w in zip(names, weights) if w > 0]
+    return [name for _, name in heapq.nlargest(k, keys)]
+
+
+def synthetic_roster(users: int, hobby_names: List[str], hobbies_per_user: Tuple[int, int] = (1, 4),
+                     friends_per_user: Tuple[int, int] = (2, 5), seed: int = None,
+                     password: str = 'password', first_student_id: int = 20200000,
+                     name_factory: Callable[[int], str] = None,
+                     contact_factory: Callable[[int], str] = None,
+                     hash_method: str = None,
+                     hobby_count: Callable[[int], int] = None,
+                     friend_count: Callable[[int], int] = None,
+                     hobby_weights: Sequence[float] = None) -> Iterator[dict]:
+    """生成合成名单：学号连续，爱好个数、好友个数在给定区间内均匀分布
+
+    hobby_count / friend_count 给出时按用户序号返回个数，取代对应的区间；
+    hobby_weights 为各爱好的热度权重，给出时按权重抽取爱好，否则等概率。
+    所有用户使用同一个密码，只计算一次哈希（hash_method 同 RosterImporter）
+    """
+    rng = random.Random(seed)
+    password_hash = generate_password_hash(password, method=hash_method) if hash_method \
+        else generate_password_hash(password)
+    for i in range(users):
+        friends = set()
+        for _ in range(int(friend_count(i)) if friend_count else rng.randint(*friends_per_user)):
+            j = rng.randrange(users)
+            if j != i:
+                friends.add(str(first_student_id + j))
+        count = min(len(hobby_names), int(hobby_count(i)) if hobby_count else rng.randint(*hobbies_per_user))
+        yield {
+            'student_id': str(first_student_id + i),
+            'email': f'{first_student_id + i}@campus.edu',
+            'name': name_factory(i) if name_factory else f'用户{i}',
+            'contact': contact_factory(i) if contact_factory else f'138{i:08d}',
+            'password_hash': password_hash,
+            'hobbies': _weighted_sample(rng, hobby_names, hobby_weights, count) if hobby_weights
+                       else rng.sample(hobby_names, count),
+            'friends': sorted(friends),
+        }
+
+
+def _chunks(rows: Iterable, size: int) -> Iterator[list]:
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _user_ids(student_ids: Iterable[str]) -> Dict[str, int]:
+    """学号 -> 用户id，只包含已存在的用户"""
+    student_ids = sorted(set(student_ids))
+    found = {}
+    for start in range(0, len(student_ids), LOOKUP_CHUNK_SIZE):
+        found.update(db.session.query(User.student_id, User.id).filter(
+            User.student_id.in_(student_ids[start:start + LOOKUP_CHUNK_SIZE])))
+    return found
+
+
+def _insert_rows(table, columns: Tuple[str, ...], rows: List[tuple]) -> int:
+    """用 INSERT ... ON CONFLICT DO NOTHING 批量插入，返回插入的行数
+
+    语句由 Core 生成，参数以元组直接交给驱动的 executemany，省去逐行的参数处理
+    """
+    if not rows:
+        return 0
+    compiled = insert(table).on_conflict_do_nothing().compile(
+        dialect=db.engine.dialect, column_keys=list(columns))
+    order = [columns.index(name) for name in compiled.positiontup]
+    if order != list(range(len(columns))):
+        rows = [tuple(row[i] for i in order) for row in rows]
+    result = db.session.connection().exec_driver_sql(str(compiled), rows)
+    return max(result.rowcount, 0)
+
+
+def _hobby_ids(names: Set[str], known: Dict[str, int]) -> Dict[str, int]:
+    """爱好名 -> 爱好id，不存在的爱好先创建；known 为已查询过的缓存，原地更新"""
+    missing = sorted(names - known.keys())
+    if missing:
+        db.session.execute(insert(Hobby.__table__).on_conflict_do_nothing(),
+                           [{'name': name} for name in missing])
+        known.update(db.session.query(Hobby.name, Hobby.id).filter(Hobby.name.in_(missing)))
+    return known
+
+
+class RosterImporter:
+    """流式导入名单
+
+    每批行一个事务：计算密码哈希（可用进程池并行）、插入新用户（学号已存在的跳过）、
+    关联爱好；好友关系先按学号对去重收集，全部用户写入后再一次性解析成用户id批量插入
+    """
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, hash_workers: int = 0,
+                 hash_method: str = None):
+        self.chunk_size = chunk_size
+        self.hash_workers = hash_workers
+        self.hash = partial(generate_password_hash, method=hash_method) if hash_method \
+            else generate_password_hash
+        self.hobbies: Dict[str, int] = {}
+        # (较小学号, 较大学号)，同一对只保留一次
+        self.edges: Set[Tuple[str, str]] = set()
+        self.stats = {'rows': 0, 'users': 0, 'skipped': 0, 'invalid': 0,
+                      'user_hobbies': 0, 'friendships': 0}
+
+    def _hash_passwords(self, rows: List[dict], pool) -> List[str]:
+        passwords = [row.get('password') or '' for row in rows if not row.get('password_hash')]
+        if pool is not None and len(passwords) > 1:
+            chunksize = max(1, len(passwords) // (self.hash_workers * 4))
+            hashes = iter(pool.map(self.hash, passwords, chunksize=chunksize))
+        else:
+            hashes = iter(map(self.hash, passwords))
+        return [row.get('password_hash') or next(hashes) for row in rows]
+
+    def _import_chunk(self, rows: List[dict], pool):
+        valid = [row for row in rows if all(row.get(field) for field in REQUIRED_FIELDS)]
+        self.stats['invalid'] += len(rows) - len(valid)
+        rows = valid
+        existing = _user_ids(row['student_id'] for row in rows)
+        new_rows = [row for row in rows if row['student_id'] not in existing]
+        if new_rows:
+            hashes = self._hash_passwords(new_rows, pool)
+            _insert_rows(User.__table__, FIELDS + ('password_hash',), [
+                tuple(row.get(field) or None for field in FIELDS) + (password_hash,)
+                for row, password_hash in zip(new_rows, hashes)
+            ])
+        ids = _user_ids(row['student_id'] for row in rows)
+        self.stats['users'] += len(ids) - len(existing)
+        self.stats['skipped'] += len(rows) - (len(ids) - len(existing))
+
+        hobby_ids = _hobby_ids({name for row in rows for name in row['hobbies']}, self.hobbies)
+        links = {(ids[row['student_id']], hobby_ids[name])
+                 for row in rows if row['student_id'] in ids for name in row['hobbies']}
+        self.stats['user_hobbies'] += _insert_rows(user_hobbies, ('user_id', 'hobby_id'), sorted(links))
+
+        for row in rows:
+            a = row['student_id']
+            self.edges.update((min(a, b), max(a, b)) for b in row['friends'] if b != a)
+        db.session.commit()
+
+    def _import_edges(self):
+        """把收集到的学号对解析为用户id，双向批量插入"""
+        ids = _user_ids(sid for edge in self.edges for sid in edge)
+        # 两个方向都按主键顺序插入，B树页按顺序追加
+        rows = sorted((ids[a], ids[b]) for a, b in self.edges if a in ids and b in ids)
+        rows = sorted(rows + [(b, a) for a, b in rows])
+        for chunk in _chunks(rows, self.chunk_size):
+            self.stats['friendships'] += _insert_rows(user_friends, ('user_id', 'friend_id'), chunk)
+            db.session.commit()
+        self.stats['friendships'] //= 2
+
+    def run(self, rows: Iterable[dict], rescore: bool = True) -> dict:
+        """导入名单，返回统计；rescore 为真时标记需要全量重算分数
+
+        需在应用上下文中调用
+        """
+        from .cache import bump_version
+        from .hobby_index import invalidate_hobby_index
+        from .jobs import mark_all_dirty
+        from .social_graph import GRAPH_VERSION
+        from .user_cache import invalidate_all_users
+        started = time.monotonic()
+        pool = None
+        if self.hash_workers > 1:
+            pool = ProcessPoolExecutor(self.hash_workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            for chunk in _chunks(rows, self.chunk_size):
+                self.stats['rows'] += len(chunk)
+                self._import_chunk(chunk, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self._import_edges()
+
+        # 通知其他进程重新加载好友图、爱好列表
+        bump_version(GRAPH_VERSION)
+        bump_version('hobbies')
+        if rescore:
+            mark_all_dirty()
+        db.session.commit()
+        invalidate_hobby_index()
+        invalidate_all_users()
+        self.stats['seconds'] = round(time.monotonic() - started, 3)
+        return self.stats
+
+
+def main():
+    """导入名单：python -m app.importer roster.csv [--hash-workers 4] [--hash-method pbkdf2:sha256:600000]
+
+    生成合成数据：python -m app.importer --synthetic 100000
+    """
+    from . import create_app
+    parser = argparse.ArgumentParser(description='批量导入用户名单或生成合成数据')
+    parser.add_argument('path', nargs='?', help='名单文件（.csv 或 .ndjson）')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help='默认按扩展名判断')
+    parser.add_argument('--synthetic', type=int, metavar='USERS', help='生成指定数量的合成用户')
+    parser.add_argument('--hobbies', type=int, default=20, help='合成数据的爱好数')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--hash-workers', type=int, default=0, help='并行计算密码哈希的进程数')
+    parser.add_argument('--hash-method', help='密码哈希方法，如 pbkdf2:sha256:600000（默认同注册接口）')
+    parser.add_argument('--no-rescore', action='store_true', help='导入后不标记全量重算分数')
+    args = parser.parse_args()
+    if not args.path and not args.synthetic:
+        parser.error('需要名单文件或 --synthetic')
+
+    app = create_app(SCORE_WORKER='off')
+    with app.app_context():
+        importer = RosterImporter(args.chunk_size, args.hash_workers, args.hash_method)
+        if args.synthetic:
+            rows = synthetic_roster(args.synthetic, [f'爱好{i}' for i in range(1, args.hobbies + 1)],
+                                    seed=args.seed, hash_method=args.hash_method)
+            stats = importer.run(rows, rescore=not args.no_rescore)
+        else:
+            fmt = args.format or ('ndjson' if args.path.endswith(('.ndjson', '.jsonl')) else 'csv')
+            with open(args.path, newline='', encoding='utf-8') as f:
+                stats = importer.run(read_roster(f, fmt), rescore=not args.no_rescore)
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
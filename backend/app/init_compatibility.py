@@ -1,17 +1,38 @@
+import argparse
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app import create_app, db
-from app.compatibility import update_compatibility_scores
+from app.compatibility import update_compatibility_scores, distance_cutoff
+from app.parallel_recompute import DEFAULT_SHARD_PAIRS, recompute_all_parallel
 
-def init_compatibility_scores():
-    """初始化所有用户之间的兼容性分数"""
-    app = create_app()
+def init_compatibility_scores(workers: int = 1, shard_pairs: int = DEFAULT_SHARD_PAIRS,
+                              resume: bool = True):
+    """初始化所有用户之间的兼容性分数
+
+    workers 大于1时多进程分片计算，中断后再次运行会从上次完成的分片继续
+    """
+    # 由本进程直接重算，不启动后台任务线程
+    app = create_app(SCORE_WORKER='off')
     with app.app_context():
-        # 更新所有用户之间的兼容性分数
-        update_compatibility_scores()
+        if workers > 1:
+            recompute_all_parallel(
+                os.path.join(app.instance_path, 'recompute'), workers, shard_pairs,
+                max_hops=distance_cutoff(), resume=resume
+            )
+        else:
+            # 更新所有用户之间的兼容性分数
+            update_compatibility_scores()
         print("已初始化所有用户之间的兼容性分数")
 
 if __name__ == '__main__':
-    init_compatibility_scores() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='全量重算兼容性分数')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='计算进程数，大于1时分片并行计算（默认1，单进程）')
+    parser.add_argument('--shard-pairs', type=int, default=DEFAULT_SHARD_PAIRS,
+                        help='每个分片的用户对数')
+    parser.add_argument('--restart', action='store_true',
+                        help='忽略上次未完成的进度，重新加载数据开始')
+    args = parser.parse_args()
+    init_compatibility_scores(args.workers, args.shard_pairs, resume=not args.restart)
@@ -0,0 +1,255 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Tuple
+from flask import Flask, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# 请求耗时直方图的分桶上界（秒）
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 单个请求SQL条数直方图的分桶上界
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram:
+    """Prometheus 风格的累积直方图"""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """进程内的请求及SQL指标
+
+    多进程部署时每个进程各自统计，/metrics 只返回处理该请求的进程的数据
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (接口, 方法, 状态码) -> 请求数
+        self.requests: Dict[Tuple[str, str, int], int] = Counter()
+        self.durations: Dict[str, Histogram] = {}
+        self.query_counts: Dict[str, Histogram] = {}
+        self.query_seconds: Dict[str, float] = Counter()
+        self.n_plus_one: Dict[str, int] = Counter()
+
+    def record(self, endpoint: str, method: str, status: int, seconds: float,
+               queries: int, query_seconds: float, n_plus_one: bool):
+        with self._lock:
+            self.requests[endpoint, method, status] += 1
+            self.durations.setdefault(endpoint, Histogram(DURATION_BUCKETS)).observe(seconds)
+            self.query_counts.setdefault(endpoint, Histogram(QUERY_COUNT_BUCKETS)).observe(queries)
+            self.query_seconds[endpoint] += query_seconds
+            if n_plus_one:
+                self.n_plus_one[endpoint] += 1
+
+    def render(self, gauges: Dict[str, float] = None) -> str:
+        """Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            lines += ['# HELP http_requests_total 请求数',
+                      '# TYPE http_requests_total counter']
+            for (endpoint, method, status), value in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {value}')
+            lines += _render_histograms('http_request_duration_seconds', '请求耗时（秒）', self.durations)
+            lines += _render_histograms('db_queries_per_request', '单个请求执行的SQL条数', self.query_counts)
+            lines += ['# HELP db_query_duration_seconds_total SQL执行总耗时（秒）',
+                      '# TYPE db_query_duration_seconds_total counter']
+            for endpoint, value in sorted(self.query_seconds.items()):
+                lines.append(f'db_query_duration_seconds_total{_labels(endpoint=endpoint)} {value:.6f}')
+            lines += ['# HELP db_n_plus_one_requests_total 检测到N+1查询的请求数',
+                      '# TYPE db_n_plus_one_requests_total counter']
+            for endpoint, value in sorted(self.n_plus_one.items()):
+                lines.append(f'db_n_plus_one_requests_total{_labels(endpoint=endpoint)} {value}')
+        for name, value in (gauges or {}).items():
+            lines += [f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels) -> str:
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+def _render_histograms(name: str, help_text: str, histograms: Dict[str, Histogram]) -> List[str]:
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for endpoint, hist in sorted(histograms.items()):
+        for bound, count in zip(hist.buckets, hist.counts):
+            lines.append(f'{name}_bucket{_labels(endpoint=endpoint, le=bound)} {count}')
+        lines.append(f'{name}_bucket{_labels(endpoint=endpoint, le="+Inf")} {hist.count}')
+        lines.append(f'{name}_sum{_labels(endpoint=endpoint)} {hist.sum:.6f}')
+        lines.append(f'{name}_count{_labels(endpoint=endpoint)} {hist.count}')
+    return lines
+
+
+metrics = Metrics()
+
+
+class RequestStats:
+    """单个请求内的SQL统计"""
+    __slots__ = ('started', 'queries', 'query_seconds', 'statements', 'status', 'profiler')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        # 语句模板 -> 执行次数，参数以占位符出现，同一模板反复执行即为N+1
+        self.statements: Dict[str, int] = Counter()
+        self.status = 500
+        self.profiler: 'SamplingProfiler' = None
+
+
+def _current_stats() -> RequestStats:
+    if not has_request_context():
+        return None
+    return g.get('_request_stats')
+
+
+def _normalize(statement: str) -> str:
+    """IN (...) 中参数个数不同的语句视为同一模板"""
+    return re.sub(r'\(\?(?:, \?)*\)', '(?)', ' '.join(statement.split()))
+
+
+def instrument_engine(engine: Engine):
+    """通过连接事件统计当前请求执行的SQL条数和耗时（不在请求中执行的SQL不统计）"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current_stats() is not None:
+            conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stats = _current_stats()
+        started = conn.info.get('_query_started')
+        if stats is None or not started:
+            return
+        stats.queries += 1
+        stats.query_seconds += time.perf_counter() - started.pop()
+        stats.statements[_normalize(statement)] += 1
+
+
+class SamplingProfiler(threading.Thread):
+    """定时采样目标线程的调用栈，结果为 folded stacks 格式（可直接用于 flamegraph.pl / speedscope）"""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name='request-profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Dict[str, int] = Counter()
+        # 结果文件路径，在生成响应时确定
+        self.path: str = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> Dict[str, int]:
+        self._stopped.set()
+        self.join()
+        return self.samples
+
+
+def _profile_path(directory: str, endpoint: str) -> str:
+    name = re.sub(r'[^A-Za-z0-9]+', '_', endpoint).strip('_') or 'root'
+    return os.path.join(directory, f'{datetime.utcnow():%Y%m%dT%H%M%S%f}-{name}.folded')
+
+
+def _endpoint() -> str:
+    """接口的路由模板，未匹配到路由时为 unmatched，避免标签数量无限增长"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def init_instrumentation(app: Flask, engine: Engine):
+    """注册请求耗时、SQL统计、N+1检测及按需采样分析
+
+    - 每个响应带 Server-Timing 头（总耗时、SQL耗时及条数）
+    - 同一语句模板在一个请求中执行超过 N_PLUS_ONE_THRESHOLD 次时记录警告
+    - PROFILER_ENABLED 打开时，请求头带 X-Profile: 1 的请求会被采样，
+      结果写入 PROFILE_DIR，文件路径在响应头 X-Profile-Dump 中返回
+    """
+    instrument_engine(engine)
+    threshold = app.config['N_PLUS_ONE_THRESHOLD']
+    slow_seconds = app.config['SLOW_REQUEST_MS'] / 1000
+    profile_dir = app.config['PROFILE_DIR'] or os.path.join(app.instance_path, 'profiles')
+
+    @app.before_request
+    def _start():
+        stats = g._request_stats = RequestStats()
+        if app.config['PROFILER_ENABLED'] and request.headers.get('X-Profile') == '1':
+            stats.profiler = SamplingProfiler(threading.get_ident(), app.config['PROFILER_INTERVAL'])
+            stats.profiler.start()
+
+    @app.after_request
+    def _headers(response):
+        stats = _current_stats()
+        if stats is None:
+            return response
+        stats.status = response.status_code
+        # 流式响应在这之后才开始输出，此处只包含生成响应前的耗时
+        elapsed = (time.perf_counter() - stats.started) * 1000
+        response.headers['Server-Timing'] = (
+            f'app;dur={elapsed:.1f}, db;dur={stats.query_seconds * 1000:.1f};desc="{stats.queries} queries"'
+        )
+        if stats.profiler is not None:
+            stats.profiler.path = _profile_path(profile_dir, _endpoint())
+            response.headers['X-Profile-Dump'] = stats.profiler.path
+        return response
+
+    # 流式响应在输出结束后才执行 teardown，统计包含输出期间的SQL
+    @app.teardown_request
+    def _finish(exc):
+        stats = g.pop('_request_stats', None)
+        if stats is None:
+            return
+        elapsed = time.perf_counter() - stats.started
+        endpoint = _endpoint()
+        repeated = [(statement, count) for statement, count in stats.statements.items()
+                    if count > threshold]
+        metrics.record(endpoint, request.method, stats.status, elapsed,
+                       stats.queries, stats.query_seconds, bool(repeated))
+
+        for statement, count in repeated:
+            logger.warning('n_plus_one endpoint=%s count=%d statement=%r', endpoint, count, statement)
+        log = logger.warning if elapsed > slow_seconds else logger.debug
+        log('request method=%s endpoint=%s status=%s duration_ms=%.1f queries=%d db_ms=%.1f',
+            request.method, endpoint, stats.status, elapsed * 1000, stats.queries,
+            stats.query_seconds * 1000)
+
+        if stats.profiler is not None:
+            samples = stats.profiler.stop()
+            path = stats.profiler.path or _profile_path(profile_dir, endpoint)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                for stack, count in samples.most_common():
+                    f.write(f'{stack} {count}\n')
+            logger.info('profile endpoint=%s samples=%d path=%s', endpoint, sum(samples.values()), path)
@@ -0,0 +1,326 @@
+import fcntl
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, List, Tuple
+from sqlalchemy.dialects.sqlite import insert
+from .models import User, ScoreJob
+from . import db
+
+logger = logging.getLogger(__name__)
+
+# 单个任务最多重试次数
+MAX_ATTEMPTS = 5
+# 没有新任务通知时的轮询间隔（秒）
+POLL_INTERVAL = 2.0
+# 批量加入任务时每条语句的行数（每行6个参数）
+ENQUEUE_CHUNK_SIZE = 2000
+
+
+def _merge(stmt):
+    """相同任务已存在时：待处理的保持不变（好友任务保留第一次变更前的状态）；
+    已被认领、正在处理的改回待处理，好友任务的变更前状态取本次标记的值
+    """
+    table = ScoreJob.__table__
+    return stmt.on_conflict_do_update(
+        index_elements=['kind', 'user_id', 'other_id'],
+        set_={
+            'claim': 0,
+            'claimed_at': None,
+            'existed': stmt.excluded.existed,
+            'attempts': 0,
+            'created_at': stmt.excluded.created_at,
+        },
+        where=table.c.claim != 0
+    )
+
+
+def _enqueue(kind: str, user_id: int = 0, other_id: int = 0, existed: bool = False, connection=None):
+    """加入一个任务，已有相同的待处理任务时合并
+
+    只加入会话，随调用方的数据变更一起提交；给出 connection 时在该连接上执行
+    """
+    (connection or db.session).execute(_merge(insert(ScoreJob.__table__).values(
+        kind=kind, user_id=user_id, other_id=other_id, existed=existed,
+        attempts=0, created_at=datetime.utcnow()
+    )))
+
+
+def _enqueue_many(jobs: List[dict]):
+    """批量加入任务，与 _enqueue 一样合并已有的相同任务"""
+    now = datetime.utcnow()
+    for start in range(0, len(jobs), ENQUEUE_CHUNK_SIZE):
+        chunk = [dict(job, attempts=0, created_at=now) for job in jobs[start:start + ENQUEUE_CHUNK_SIZE]]
+        db.session.execute(_merge(insert(ScoreJob.__table__).values(chunk)))
+
+
+def mark_hobbies_dirty(user_id: int):
+    """标记某用户的爱好已变更"""
+    _enqueue('hobby', user_id)
+
+
+def mark_friendship_dirty(user1_id: int, user2_id: int, existed: bool):
+    """标记一条好友关系已变更，existed 为变更前是否为好友
+
+    同一对用户合并时保留第一次变更前的状态
+    """
+    _enqueue('friendship', min(user1_id, user2_id), max(user1_id, user2_id), existed)
+
+
+def mark_hobbies_dirty_many(user_ids: Iterable[int]):
+    """批量标记多个用户的爱好已变更"""
+    _enqueue_many([{'kind': 'hobby', 'user_id': user_id, 'other_id': 0, 'existed': False}
+                   for user_id in user_ids])
+
+
+def mark_friendships_dirty(changes: Iterable[Tuple[int, int, bool]]):
+    """批量标记好友关系变更，changes 为 (user1_id, user2_id, 变更前是否为好友)"""
+    _enqueue_many([{'kind': 'friendship', 'user_id': min(a, b), 'other_id': max(a, b), 'existed': existed}
+                   for a, b, existed in changes])
+
+
+def mark_all_dirty(connection=None):
+    """标记需要全量重算，connection 同 _enqueue"""
+    _enqueue('all', connection=connection)
+
+
+def _claim_jobs():
+    """认领全部待处理任务，同一事务内取得好友图，返回 (批次号, 任务行, 好友图)
+
+    任务只标记为已认领，处理提交后才删除。UPDATE 让事务持有写锁，随后读到的
+    好友图版本号恰好包含这些任务对应的变更；进程内的好友图停在该版本时直接复用，
+    不再每批重新读取 user_friends
+    """
+    from .social_graph import get_social_graph
+    table = ScoreJob.__table__
+    claim = secrets.randbits(62) + 1
+    rows = db.session.execute(
+        table.update().where(table.c.claim == 0).values(
+            claim=claim, claimed_at=datetime.utcnow()
+        ).returning(
+            table.c.kind, table.c.user_id, table.c.other_id,
+            table.c.existed, table.c.attempts, table.c.created_at
+        )
+    ).all()
+    graph = None
+    friendships = [row for row in rows if row.kind == 'friendship']
+    if friendships:
+        include = {row.user_id for row in friendships} | {row.other_id for row in friendships}
+        graph = get_social_graph().friend_graph(include)
+    db.session.commit()
+    return claim, rows, graph
+
+
+def _process(rows, graph):
+    from .compatibility import (update_compatibility_scores, update_hobby_scores_for_users,
+                                update_scores_for_friendships)
+    if any(row.kind == 'all' for row in rows):
+        # 全量重算覆盖所有其他任务
+        update_compatibility_scores()
+        return
+
+    friendships = [(row.user_id, row.other_id, row.existed) for row in rows if row.kind == 'friendship']
+    if friendships:
+        update_scores_for_friendships(graph, friendships)
+
+    hobby_ids = {row.user_id for row in rows if row.kind == 'hobby'}
+    if hobby_ids:
+        # 批量导入爱好后，所有变更用户的爱好分项一起按块计算
+        update_hobby_scores_for_users(User.query.filter(User.id.in_(hobby_ids)).all())
+
+
+def _requeue(claim: int = None) -> int:
+    """把一批已认领的任务（claim 为None时为全部已认领任务）改回待处理，超过重试次数则丢弃
+
+    返回涉及的任务数
+    """
+    table = ScoreJob.__table__
+    claimed = table.c.claim == claim if claim is not None else table.c.claim != 0
+    dropped = db.session.execute(
+        table.delete().where(claimed, table.c.attempts + 1 >= MAX_ATTEMPTS).returning(
+            table.c.kind, table.c.user_id, table.c.other_id)
+    ).all()
+    for row in dropped:
+        logger.error('丢弃重试次数过多的任务: %s %s %s', row.kind, row.user_id, row.other_id)
+    requeued = db.session.execute(table.update().where(claimed).values(
+        claim=0, claimed_at=None, attempts=table.c.attempts + 1
+    )).rowcount
+    db.session.commit()
+    return len(dropped) + requeued
+
+
+def reclaim_jobs() -> int:
+    """收回已认领但没有处理完的任务，返回收回的任务数
+
+    持有后台任务文件锁时调用：其他进程不可能正在处理任务，
+    已认领的任务来自处理期间被终止的进程（如部署时重启）
+    """
+    count = _requeue()
+    if count:
+        logger.warning('收回 %d 个未处理完的分数任务', count)
+    return count
+
+
+def run_pending_jobs() -> int:
+    """处理当前全部待处理任务，返回处理的任务数"""
+    claim, rows, graph = _claim_jobs()
+    if not rows:
+        return 0
+    try:
+        _process(rows, graph)
+    except Exception:
+        logger.exception('兼容性分数任务处理失败')
+        db.session.rollback()
+        _requeue(claim)
+        raise
+    # 处理结果提交之后再删除；其间被再次标记的任务已改回待处理，不会被删除
+    table = ScoreJob.__table__
+    db.session.execute(table.delete().where(table.c.claim == claim))
+    db.session.commit()
+    return len(rows)
+
+
+def queue_status() -> dict:
+    """队列深度及分数落后的时长，pending 含正在处理（已认领）的任务"""
+    rows = db.session.query(ScoreJob.kind, ScoreJob.created_at, ScoreJob.claim).all()
+    oldest = min((created_at for _, created_at, _ in rows), default=None)
+    return {
+        'pending': len(rows),
+        'pending_by_kind': dict(Counter(kind for kind, _, _ in rows)),
+        'claimed': sum(1 for *_, claim in rows if claim),
+        'oldest_pending_at': oldest.isoformat() if oldest else None,
+        # 最早的待处理任务之后的变更尚未反映到分数中
+        'staleness_seconds': (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0,
+        'worker_running': _worker is not None and _worker.is_alive(),
+        'worker_active': _worker is not None and _worker.active,
+    }
+
+
+class ScoreWorker(threading.Thread):
+    """后台处理分数任务的线程
+
+    多个进程同时启动时，通过文件锁保证只有一个进程在处理任务
+    """
+
+    def __init__(self, app, lock_path: str):
+        super().__init__(name='score-worker', daemon=True)
+        self.app = app
+        self.lock_path = lock_path
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.active = False
+        self._lock_file = None
+        # 分数变化后尚未导出快照；启动时先导出一次
+        self.snapshot_due = True
+        self.snapshot_at = float('-inf')
+
+    def _acquire(self) -> bool:
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.wakeup.wait(POLL_INTERVAL)
+            self.wakeup.clear()
+            if self.stopping.is_set():
+                break
+            if not self.active:
+                self.active = self._acquire()
+                if not self.active:
+                    continue
+                with self.app.app_context():
+                    try:
+                        reclaim_jobs()
+                    finally:
+                        db.session.remove()
+            with self.app.app_context():
+                try:
+                    while not self.stopping.is_set() and run_pending_jobs():
+                        self.snapshot_due = True
+                except Exception:
+                    # 已记录日志并放回队列，等待下次重试
+                    pass
+                finally:
+                    db.session.remove()
+                self._write_snapshot()
+        # 关闭文件即释放锁，其他进程的后台线程可以接手
+        if self._lock_file is not None:
+            self._lock_file.close()
+        self.active = False
+
+    def _write_snapshot(self):
+        """配置了 SCORE_SNAPSHOT_DIR 时，分数变化后最多每 SCORE_SNAPSHOT_INTERVAL 秒导出一次快照"""
+        directory = self.app.config.get('SCORE_SNAPSHOT_DIR')
+        if not directory or not self.snapshot_due:
+            return
+        if time.monotonic() - self.snapshot_at < self.app.config['SCORE_SNAPSHOT_INTERVAL']:
+            return
+        from .score_snapshot import write_score_snapshot
+        try:
+            write_score_snapshot(directory)
+        except Exception:
+            logger.exception('分数快照导出失败')
+            return
+        finally:
+            db.session.remove()
+        self.snapshot_due = False
+        self.snapshot_at = time.monotonic()
+
+
+_worker: ScoreWorker = None
+
+
+def start_worker(app):
+    """启动后台任务线程"""
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        os.makedirs(app.instance_path, exist_ok=True)
+        _worker = ScoreWorker(app, os.path.join(app.instance_path, 'score_worker.lock'))
+        _worker.start()
+    return _worker
+
+
+def stop_worker():
+    """停止本进程的后台任务线程，等待正在处理的一批任务完成
+
+    flask init-db 等命令行命令加载的应用已按配置启动了后台线程，无法再传入 SCORE_WORKER='off'
+    """
+    global _worker
+    if _worker is not None:
+        _worker.stopping.set()
+        _worker.wakeup.set()
+        _worker.join()
+        _worker = None
+
+
+def notify_worker():
+    """提交任务后调用：唤醒后台线程，同步模式下直接处理"""
+    from flask import current_app
+    mode = current_app.config.get('SCORE_WORKER', 'thread')
+    if mode == 'sync':
+        run_pending_jobs()
+    elif mode == 'thread' and _worker is not None:
+        _worker.wakeup.set()
+
+
+def main():
+    """独立的任务处理进程：python -m app.jobs
+
+    Web进程配置 SCORE_WORKER=off 时由该进程处理任务
+    """
+    from . import create_app
+    logging.basicConfig(level=logging.INFO)
+    start_worker(create_app(SCORE_WORKER='off')).join()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,9 @@ from flask_login import UserMixin
 user_hobbies = db.Table(
     'user_hobbies',
     db.Column('user_id', db.Integer, db.ForeignKey('user_data.id'), primary_key=True),
-    db.Column('hobby_id', db.Integer, db.ForeignKey('hobby.id'), primary_key=True)
+    db.Column('hobby_id', db.Integer, db.ForeignKey('hobby.id'), primary_key=True),
+    # 按爱好统计人数、列出成员时使用
+    db.Index('ix_user_hobbies_hobby_id', 'hobby_id', 'user_id')
 )
 
 # 多对多关联表：用户-用户（认识的人，双向）
@@ -51,13 +53,96 @@ class CompatibilityScore(db.Model):
     user1_id = db.Column(db.Integer, db.ForeignKey('user_data.id'), nullable=False)
     user2_id = db.Column(db.Integer, db.ForeignKey('user_data.id'), nullable=False)
     score = db.Column(db.Float, nullable=False)
+    # 分数的三个组成部分，score = hobby_overlap * 0.25 + subject_relatedness * 0.25 + distance_factor
+    hobby_overlap = db.Column(db.Float, nullable=False, default=0.0)
+    subject_relatedness = db.Column(db.Float, nullable=False, default=0.0)
+    distance_factor = db.Column(db.Float, nullable=False, default=0.0)
     last_updated = db.Column(db.DateTime, nullable=False, default=db.func.now())
     
     # Ensure user1_id is always smaller than user2_id to avoid duplicates
     __table_args__ = (
         db.CheckConstraint('user1_id < user2_id', name='check_user_order'),
         db.UniqueConstraint('user1_id', 'user2_id', name='unique_user_pair'),
+        db.Index('ix_compatibility_score_user2', 'user2_id'),
     )
 
     user1 = db.relationship('User', foreign_keys=[user1_id], backref='compatibility_scores_as_user1')
     user2 = db.relationship('User', foreign_keys=[user2_id], backref='compatibility_scores_as_user2')
+
+class TopMatch(db.Model):
+    """每个用户兼容性分数最高的前K个用户，按 (user_id, rank) 范围读取"""
+    __tablename__ = 'top_match'
+    user_id = db.Column(db.Integer, db.ForeignKey('user_data.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    other_id = db.Column(db.Integer, db.ForeignKey('user_data.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+class ScoreJob(db.Model):
+    """待处理的兼容性分数重算任务
+
+    (kind, user_id, other_id) 唯一，重复标记同一用户时自动合并；
+    标记到已被认领的任务时，该任务改回待处理，处理完成后不会被删除
+    """
+    __tablename__ = 'score_job'
+    id = db.Column(db.Integer, primary_key=True)
+    # 'all': 全量重算, 'hobby': 某用户爱好变更, 'friendship': 好友关系变更
+    kind = db.Column(db.String(16), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False, default=0)
+    other_id = db.Column(db.Integer, nullable=False, default=0)
+    # 好友关系任务：合并前第一次变更前是否已是好友
+    existed = db.Column(db.Boolean, nullable=False, default=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
+    # 认领该任务的批次号，0 表示待处理；处理成功提交后才删除，进程中途退出时由下一个后台线程收回
+    claim = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    claimed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'user_id', 'other_id', name='unique_pending_job'),
+    )
+
+class CacheVersion(db.Model):
+    """响应缓存的版本号，相关数据变更时递增，用于ETag和进程内缓存失效"""
+    __tablename__ = 'cache_version'
+    name = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class SubjectRelatedness(db.Model):
+    """学科之间的相关度，按爱好名称成对保存（双向各一行），未列出的学科对相关度为0
+
+    建表时写入 compatibility.SUBJECT_RELATEDNESS 中的默认分组
+    """
+    __tablename__ = 'subject_relatedness'
+    subject1 = db.Column(db.String(64), primary_key=True)
+    subject2 = db.Column(db.String(64), primary_key=True)
+    relatedness = db.Column(db.Float, nullable=False)
+    # 所属分组，仅用于管理
+    group_name = db.Column(db.String(32))
+
+class MutualFriend(db.Model):
+    """每个用户共同好友最多的前K个非好友用户，由好友图批量分析生成（app/graph_analytics.py）"""
+    __tablename__ = 'mutual_friend'
+    user_id = db.Column(db.Integer, db.ForeignKey('user_data.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    other_id = db.Column(db.Integer, db.ForeignKey('user_data.id'), nullable=False)
+    mutual_count = db.Column(db.Integer, nullable=False)
+
+class Community(db.Model):
+    """好友图上标签传播得到的社区，id 为社区内最小的用户id"""
+    __tablename__ = 'community'
+    id = db.Column(db.Integer, primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    computed_at = db.Column(db.DateTime, nullable=False)
+
+# 按 (人数降序, id升序) 分页，一次索引扫描即可，不需要临时排序
+db.Index('ix_community_size', Community.size.desc(), Community.id)
+
+class CommunityMember(db.Model):
+    """用户所属的社区，没有好友的用户不属于任何社区"""
+    __tablename__ = 'community_member'
+    user_id = db.Column(db.Integer, db.ForeignKey('user_data.id'), primary_key=True)
+    community_id = db.Column(db.Integer, db.ForeignKey('community.id'), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_community_member_community', 'community_id', 'user_id'),
+    )
@@ -0,0 +1,139 @@
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, List, Tuple
+import numpy as np
+from .compatibility_engine import load_snapshot, open_snapshot, save_snapshot, score_rows
+from .score_writer import bulk_upsert_scores, delete_stale_scores
+from .top_matches import refresh_all_top_matches
+
+# 每个分片大约包含的用户对数，决定单个分片结果的内存占用（每对约40字节）
+DEFAULT_SHARD_PAIRS = 1_000_000
+MANIFEST_NAME = 'manifest.json'
+SNAPSHOT_DIR = 'snapshot'
+
+
+def plan_shards(size: int, shard_pairs: int = DEFAULT_SHARD_PAIRS) -> List[Tuple[int, int]]:
+    """把上三角按行切分成用户对数量大致相等的分片，返回 [(起始行, 结束行)]"""
+    # 第i行有 size - 1 - i 个用户对
+    cumulative = np.cumsum(np.arange(size - 1, -1, -1))
+    shards = []
+    start = 0
+    while start < size:
+        done = cumulative[start - 1] if start else 0
+        stop = int(np.searchsorted(cumulative, done + shard_pairs, side='left')) + 1
+        stop = max(start + 1, min(stop, size))
+        shards.append((start, stop))
+        start = stop
+    return shards
+
+
+def _pair_count(size: int, start: int, stop: int) -> int:
+    """第 start..stop-1 行的用户对数"""
+    rows = stop - start
+    return rows * (size - 1) - (start + stop - 1) * rows // 2
+
+
+def _write_manifest(path: str, manifest: dict):
+    """先写临时文件再替换，中途退出不会留下损坏的进度文件"""
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+# 工作进程内打开的快照
+_snapshot = None
+
+
+def _init_worker(directory: str):
+    global _snapshot
+    _snapshot = open_snapshot(directory)
+
+
+def _score_shard(index: int, start: int, stop: int, max_hops: int):
+    return index, score_rows(_snapshot, slice(start, stop), max_hops)
+
+
+def _print_progress(done: int, total: int, pairs: int, total_pairs: int, rate: float):
+    remaining = (total_pairs - pairs) / rate if rate else 0.0
+    print(f'[{done}/{total}] 已写入 {pairs}/{total_pairs} 对，'
+          f'{rate:.0f} 对/秒，预计剩余 {remaining:.0f} 秒', flush=True)
+
+
+def recompute_all_parallel(work_dir: str, workers: int = None, shard_pairs: int = DEFAULT_SHARD_PAIRS,
+                           max_hops: int = None, resume: bool = True,
+                           progress: Callable[..., None] = _print_progress) -> int:
+    """多进程分片全量重算兼容性分数，需在应用上下文中调用
+
+    快照保存在 work_dir 下，各工作进程以只读mmap共享；计算结果由当前进程单独写入数据库，
+    每个分片提交后记录到进度文件。resume 为真且 work_dir 中有未完成的进度时，
+    沿用当时的快照和分片，只计算剩余的分片。返回写入的用户对数
+    """
+    manifest_path = os.path.join(work_dir, MANIFEST_NAME)
+    snapshot_dir = os.path.join(work_dir, SNAPSHOT_DIR)
+    if resume and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        started_at = datetime.utcnow()
+        snapshot = load_snapshot()
+        save_snapshot(snapshot, snapshot_dir)
+        manifest = {
+            'size': snapshot.size,
+            'max_hops': max_hops,
+            'started_at': started_at.isoformat(),
+            'shards': plan_shards(snapshot.size, shard_pairs),
+            'done': [],
+        }
+        _write_manifest(manifest_path, manifest)
+
+    size = manifest['size']
+    shards = manifest['shards']
+    done = set(manifest['done'])
+    total_pairs = size * (size - 1) // 2
+    written = sum(_pair_count(size, *shards[i]) for i in done)
+    pending = iter([i for i in range(len(shards)) if i not in done])
+
+    workers = workers or os.cpu_count() or 1
+    started = time.monotonic()
+    resumed_pairs = written
+    # spawn 启动的工作进程不继承父进程的数据库连接和后台线程
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                             initargs=(snapshot_dir,)) as pool:
+        running = set()
+
+        def submit():
+            index = next(pending, None)
+            if index is not None:
+                running.add(pool.submit(_score_shard, index, *shards[index], manifest['max_hops']))
+
+        # 最多积压两倍进程数的分片结果，避免写入跟不上时占满内存
+        for _ in range(workers * 2):
+            submit()
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                running.remove(future)
+                index, block = future.result()
+                bulk_upsert_scores(*block, refresh_top=False, delete_dropped=False)
+                done.add(index)
+                manifest['done'] = sorted(done)
+                _write_manifest(manifest_path, manifest)
+                written += len(block.user1_ids)
+                elapsed = time.monotonic() - started
+                progress(len(done), len(shards), written, total_pairs,
+                         (written - resumed_pairs) / elapsed if elapsed else 0.0)
+                submit()
+
+    # 开始之后没有重写过的行对应分数已不超过存储阈值的用户对
+    delete_stale_scores(datetime.fromisoformat(manifest['started_at']))
+    refresh_all_top_matches()
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return written
@@ -0,0 +1,118 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+from flask import has_app_context
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert
+from .models import SubjectRelatedness
+from . import db
+
+# 进程内缓存的有效期（秒），修改 subject_relatedness 表后最迟在该时间后生效
+RELATEDNESS_TTL = 300
+
+
+class RelatednessTable:
+    """编译后的学科相关度表
+
+    学科名映射为稠密下标，matrix[i, j] 为学科i与学科j的相关度，未列出的学科对为0
+    """
+    __slots__ = ('subjects', 'position', 'matrix', 'loaded_at')
+
+    def __init__(self, subjects: List[str], matrix: np.ndarray):
+        self.subjects = subjects
+        self.position = {name: i for i, name in enumerate(subjects)}
+        self.matrix = matrix
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def from_pairs(cls, pairs: Dict[Tuple[str, str], float]) -> 'RelatednessTable':
+        subjects = sorted({a for a, _ in pairs} | {b for _, b in pairs})
+        position = {name: i for i, name in enumerate(subjects)}
+        matrix = np.zeros((len(subjects), len(subjects)), dtype=np.float64)
+        for (a, b), value in pairs.items():
+            matrix[position[a], position[b]] = value
+        return cls(subjects, matrix)
+
+    def lookup(self, subject1: str, subject2: str) -> float:
+        i = self.position.get(subject1)
+        j = self.position.get(subject2)
+        if i is None or j is None:
+            return 0.0
+        return float(self.matrix[i, j])
+
+    def max_relatedness(self, hobbies1: Iterable[str], hobbies2: Iterable[str]) -> float:
+        """两组爱好之间的最大学科相关度，一次取子矩阵求最大值"""
+        rows = [self.position[name] for name in hobbies1 if name in self.position]
+        cols = [self.position[name] for name in hobbies2 if name in self.position]
+        if not rows or not cols:
+            return 0.0
+        return float(self.matrix[np.ix_(rows, cols)].max())
+
+    def compile(self, hobby_names: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """按爱好列的顺序取出学科子矩阵，返回 (相关度矩阵, 学科爱好所在的列下标)"""
+        columns = np.array(
+            [j for j, name in enumerate(hobby_names) if name in self.position], dtype=np.int64
+        )
+        subjects = [self.position[hobby_names[j]] for j in columns.tolist()]
+        return self.matrix[np.ix_(subjects, subjects)], columns
+
+
+def default_pairs() -> Dict[Tuple[str, str], float]:
+    """SUBJECT_RELATEDNESS 中的默认分组，同一对学科出现在多个分组时取第一个"""
+    from .compatibility import SUBJECT_RELATEDNESS
+    pairs = {}
+    for group in SUBJECT_RELATEDNESS.values():
+        for subject1, row in group.items():
+            for subject2, value in row.items():
+                pairs.setdefault((subject1, subject2), value)
+    return pairs
+
+
+def load_relatedness_table() -> RelatednessTable:
+    """从 subject_relatedness 表加载相关度"""
+    rows = db.session.query(
+        SubjectRelatedness.subject1, SubjectRelatedness.subject2, SubjectRelatedness.relatedness
+    ).all()
+    return RelatednessTable.from_pairs({(a, b): value for a, b, value in rows})
+
+
+_cache_lock = threading.Lock()
+_cached_table: RelatednessTable = None
+_default_table: RelatednessTable = None
+
+
+def get_relatedness_table() -> RelatednessTable:
+    """获取进程内缓存的相关度表，没有应用上下文时使用代码中的默认分组"""
+    global _cached_table, _default_table
+    with _cache_lock:
+        if not has_app_context():
+            if _default_table is None:
+                _default_table = RelatednessTable.from_pairs(default_pairs())
+            return _default_table
+        if _cached_table is None or time.monotonic() - _cached_table.loaded_at > RELATEDNESS_TTL:
+            _cached_table = load_relatedness_table()
+        return _cached_table
+
+
+def invalidate_relatedness_table():
+    """丢弃缓存的相关度表"""
+    global _cached_table
+    with _cache_lock:
+        _cached_table = None
+
+
+@event.listens_for(SubjectRelatedness.__table__, 'after_create')
+def _seed_defaults(target, connection, **kw):
+    """建表时写入默认分组"""
+    from .compatibility import SUBJECT_RELATEDNESS
+    rows = {}
+    for group_name, group in SUBJECT_RELATEDNESS.items():
+        for subject1, row in group.items():
+            for subject2, value in row.items():
+                rows.setdefault((subject1, subject2), {
+                    'subject1': subject1, 'subject2': subject2,
+                    'relatedness': value, 'group_name': group_name
+                })
+    if rows:
+        connection.execute(insert(target).on_conflict_do_nothing(), list(rows.values()))
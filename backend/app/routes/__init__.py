@@ -1,5 +1,14 @@
 from .user_routes import init_user_routes
+from .job_routes import init_job_routes
+from .batch_routes import init_batch_routes
+from .graph_routes import init_graph_routes
+from .metrics_routes import init_metrics_routes
 
 def init_all_routes(app):
     """初始化所有路由"""
-    init_user_routes(app) 
\ No newline at end of file
+    init_user_routes(app)
+    init_job_routes(app)
+    init_batch_routes(app)
+    init_graph_routes(app)
+    if app.config['INSTRUMENTATION']:
+        init_metrics_routes(app) 
\ No newline at end of file
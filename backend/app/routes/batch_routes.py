@@ -0,0 +1,124 @@
+import hmac
+from functools import wraps
+from flask import current_app, request, jsonify
+from .. import db
+from ..models import User, Hobby
+from ..jobs import notify_worker
+from ..social_graph import set_friendships
+from ..hobby_assignments import assign_hobbies
+
+# 单次请求最多包含的用户对/用户数
+MAX_BATCH_ITEMS = 50000
+
+def batch_token_required(view):
+    """批量接口及运维接口需要请求头 Authorization: Bearer <BATCH_API_TOKEN>，未配置时不开放"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = current_app.config.get('BATCH_API_TOKEN')
+        if not token:
+            return jsonify({'error': '接口未启用'}), 403
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not hmac.compare_digest(supplied.encode(), token.encode()):
+            return jsonify({'error': '无权访问'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def unknown_user_ids(user_ids):
+    """不存在的用户id"""
+    user_ids = set(user_ids)
+    found = set()
+    ids = sorted(user_ids)
+    for start in range(0, len(ids), 10000):
+        found.update(uid for uid, in db.session.query(User.id).filter(
+            User.id.in_(ids[start:start + 10000])))
+    return sorted(user_ids - found)
+
+def parse_pairs(items):
+    """[[a, b], ...] -> {(min, max)}，格式错误时抛出 ValueError"""
+    pairs = set()
+    for item in items:
+        a, b = (int(x) for x in item)
+        if a == b:
+            raise ValueError(f'不能与自己建立好友关系: {a}')
+        pairs.add((min(a, b), max(a, b)))
+    return pairs
+
+def parse_assignments(items):
+    """[{"user_id": 1, "hobbies": ["篮球", ...]}, ...] -> {user_id: {爱好名}}，格式错误时抛出 ValueError
+
+    user_id 必须是整数，hobbies 必须是字符串列表（字符串本身不会被当作逐字的列表）
+    """
+    if not isinstance(items, list):
+        raise ValueError('应为列表')
+    wanted = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError(f'应为对象: {item!r}')
+        user_id = item.get('user_id')
+        if isinstance(user_id, bool) or not isinstance(user_id, int):
+            raise ValueError(f'user_id 应为整数: {user_id!r}')
+        hobbies = item.get('hobbies', [])
+        if not isinstance(hobbies, list) or not all(isinstance(name, str) for name in hobbies):
+            raise ValueError(f'hobbies 应为字符串列表: {hobbies!r}')
+        wanted.setdefault(user_id, set()).update(hobbies)
+    return wanted
+
+def init_batch_routes(app):
+    # 批量建立/解除好友关系：{"add": [[user1_id, user2_id], ...], "remove": [...]}
+    @app.route('/api/batch/friendships', methods=['POST'])
+    @batch_token_required
+    def batch_friendships():
+        data = request.get_json() or {}
+        try:
+            add = parse_pairs(data.get('add', []))
+            remove = parse_pairs(data.get('remove', []))
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': f'用户对格式错误: {e}'}), 400
+        if len(add) + len(remove) > MAX_BATCH_ITEMS:
+            return jsonify({'error': f'单次最多 {MAX_BATCH_ITEMS} 个用户对'}), 400
+        if add & remove:
+            return jsonify({'error': '同一对用户不能同时添加和删除'}), 400
+        unknown = unknown_user_ids(uid for pair in add | remove for uid in pair)
+        if unknown:
+            return jsonify({'error': '用户不存在', 'user_ids': unknown}), 400
+
+        # 一个事务内写入，受影响的分数由后台任务统一重算一次
+        changes = set_friendships(add, remove)
+        if changes:
+            notify_worker()
+        added = sum(1 for *_, present in changes if present)
+        return jsonify({
+            'added': added,
+            'removed': len(changes) - added,
+            'unchanged': len(add) + len(remove) - len(changes)
+        })
+
+    # 批量设置用户爱好：{"assignments": [{"user_id": 1, "hobbies": ["篮球", ...]}], "replace": false}
+    # replace 为 false 时只追加爱好，为 true 时替换这些用户原有的爱好
+    @app.route('/api/batch/hobbies', methods=['POST'])
+    @batch_token_required
+    def batch_hobbies():
+        data = request.get_json() or {}
+        try:
+            wanted = parse_assignments(data.get('assignments', []))
+        except ValueError as e:
+            return jsonify({'error': f'assignments 格式错误: {e}'}), 400
+        if len(wanted) > MAX_BATCH_ITEMS:
+            return jsonify({'error': f'单次最多 {MAX_BATCH_ITEMS} 个用户'}), 400
+        unknown = unknown_user_ids(wanted)
+        if unknown:
+            return jsonify({'error': '用户不存在', 'user_ids': unknown}), 400
+
+        # 与单个用户的接口一样，不存在的标签被忽略
+        names = {name for hobby_names in wanted.values() for name in hobby_names}
+        hobby_ids = dict(db.session.query(Hobby.name, Hobby.id).filter(Hobby.name.in_(names)))
+        touched = assign_hobbies(
+            {uid: [hobby_ids[n] for n in hobby_names if n in hobby_ids] for uid, hobby_names in wanted.items()},
+            replace=bool(data.get('replace', False))
+        )
+        if touched:
+            notify_worker()
+        return jsonify({
+            'updated_users': len(touched),
+            'unknown_hobbies': sorted(names - hobby_ids.keys())
+        })
@@ -0,0 +1,67 @@
+from flask import request, jsonify
+from flask_login import login_required, current_user
+from ..models import Community, CommunityMember
+from ..graph_analytics import MUTUALS_K, get_mutuals, list_communities, community_members
+from ..user_queries import InvalidCursor, page_size, paginate_by_score, parse_cursor, encode_cursor
+from .user_routes import member_payload
+
+def init_graph_routes(app):
+    # 共同好友最多的用户（批量分析预先计算，不含分析时已是好友的用户）
+    @app.route('/api/user/me/mutuals', methods=['GET'])
+    @login_required
+    def get_mutuals_for_me():
+        k = request.args.get('k', 20, type=int)
+        k = max(1, min(k, MUTUALS_K))
+        results = []
+        for match, other_user, is_friend, same_community in get_mutuals(current_user.id, k):
+            results.append({
+                'id': other_user.id,
+                'name': other_user.name,
+                'student_id': other_user.student_id,
+                'contact': other_user.contact if other_user.contact else None,
+                'mutual_count': match.mutual_count,
+                'rank': match.rank,
+                'is_friend': bool(is_friend),
+                'same_community': bool(same_community)
+            })
+        return jsonify(results)
+
+    # 好友社区列表，按人数降序分页
+    @app.route('/api/communities', methods=['GET'])
+    @login_required
+    def get_communities():
+        cursor = request.args.get('cursor')
+        try:
+            position = parse_cursor(cursor) if cursor else None
+        except InvalidCursor:
+            return jsonify({'error': 'cursor 格式错误'}), 400
+        limit = page_size(request.args.get('limit', type=int))
+        min_size = request.args.get('min_size', 1, type=int)
+        rows, has_more = list_communities(position, limit, min_size)
+        mine = CommunityMember.query.get(current_user.id)
+        return jsonify({
+            'communities': [{'id': c.id, 'size': c.size} for c in rows],
+            'next_cursor': encode_cursor([rows[-1].size, rows[-1].id]) if has_more else None,
+            'my_community_id': mine.community_id if mine else None,
+            'computed_at': rows[0].computed_at.isoformat() if rows else None
+        })
+
+    # 社区成员，按用户id分页
+    @app.route('/api/communities/<int:community_id>', methods=['GET'])
+    @login_required
+    def get_community(community_id):
+        community = Community.query.get_or_404(community_id)
+        limit = page_size(request.args.get('limit', type=int))
+        try:
+            rows, next_cursor = paginate_by_score(
+                community_members(community.id), None, request.args.get('cursor'), limit
+            )
+        except InvalidCursor:
+            return jsonify({'error': 'cursor 格式错误'}), 400
+        return jsonify({
+            'id': community.id,
+            'size': community.size,
+            'computed_at': community.computed_at.isoformat(),
+            'users': [member_payload(user) for user in rows],
+            'next_cursor': next_cursor
+        })
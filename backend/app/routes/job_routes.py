@@ -0,0 +1,10 @@
+from flask import jsonify
+from ..jobs import queue_status
+from .batch_routes import batch_token_required
+
+def init_job_routes(app):
+    # 分数重算队列状态：队列深度及分数落后的时长
+    @app.route('/api/jobs/status', methods=['GET'])
+    @batch_token_required
+    def get_job_status():
+        return jsonify(queue_status())
@@ -0,0 +1,19 @@
+from flask import current_app
+from ..instrumentation import metrics
+from ..jobs import queue_status
+from .batch_routes import batch_token_required
+
+def init_metrics_routes(app):
+    # Prometheus 抓取接口：请求耗时、SQL条数及耗时、N+1次数、分数任务队列
+    # 与批量接口共用 BATCH_API_TOKEN，抓取配置中用 bearer_token 携带
+    @app.route('/metrics', methods=['GET'])
+    @batch_token_required
+    def get_metrics():
+        status = queue_status()
+        gauges = {
+            'score_jobs_pending': status['pending'],
+            'score_staleness_seconds': status['staleness_seconds'],
+        }
+        return current_app.response_class(
+            metrics.render(gauges), mimetype='text/plain; version=0.0.4'
+        )
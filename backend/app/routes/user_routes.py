@@ -1,8 +1,38 @@
-from flask import request, jsonify
+import json
+import logging
+from flask import Response, request, jsonify, stream_with_context
 from flask_login import login_user, login_required, current_user
 from .. import db
-from ..models import User, Hobby, CompatibilityScore
-from ..compatibility import update_compatibility_scores
+from ..models import User, Hobby
+from ..jobs import mark_hobbies_dirty, notify_worker
+from ..top_matches import TOP_K, get_recommendations as fetch_recommendations
+from ..user_queries import (InvalidCursor, page_size, paginate_by_score, circle_members,
+                            stored_scores, search_users as query_users)
+from ..search_index import matching_ids
+from ..cache import bump_version, cached_json_response
+from ..hobby_queries import hobbies_with_counts
+from ..social_graph import set_friendship
+from ..user_cache import invalidate_users
+
+logger = logging.getLogger(__name__)
+
+# 流式输出时每批从数据库读取的行数
+STREAM_BATCH_SIZE = 500
+
+def member_payload(user, compatibility_score=None, is_friend=None):
+    """列表中单个用户的返回数据，未登录时不含分数和好友关系"""
+    data = {
+        'id': user.id,
+        'name': user.name,
+        'student_id': user.student_id,
+        'contact': user.contact if user.contact else None,
+    }
+    if compatibility_score is not None:
+        data.update({
+            'compatibility_score': compatibility_score,
+            'is_friend': bool(is_friend)
+        })
+    return data
 
 def init_user_routes(app):
     # 注册接口
@@ -69,20 +99,14 @@ def init_user_routes(app):
             user.username = data['username']
         
         db.session.commit()
+        invalidate_users(user.id)
         return jsonify({'message': '更新成功'})
 
     # 获取所有爱好及其拥有用户数量
     @app.route('/api/hobbies', methods=['GET'])
     def get_hobbies():
-        hobbies = Hobby.query.all()
-        data = [
-            {
-                'id': h.id,
-                'name': h.name,
-                'user_count': len(h.users)
-            } for h in hobbies
-        ]
-        return jsonify(data)
+        # 版本号未变时直接返回缓存，客户端带 If-None-Match 时返回304
+        return cached_json_response('hobbies', hobbies_with_counts)
 
     # 获取当前用户信息
     @app.route('/api/user/me', methods=['GET'])
@@ -94,14 +118,15 @@ def init_user_routes(app):
             'email': user.email,
             'name': user.name,
             'contact': user.contact,
-            'hobbies': [h.name for h in user.hobbies]
+            'hobbies': list(user.hobby_names)
         })
 
     # 更新当前用户信息（除账号外）
     @app.route('/api/user/me', methods=['PUT'])
     @login_required
     def update_me():
-        user = current_user
+        # current_user 是只读快照，修改时加载数据库中的用户
+        user = current_user.orm()
         data = request.get_json()
         if 'email' in data:
             user.email = data['email']
@@ -110,69 +135,41 @@ def init_user_routes(app):
         if 'contact' in data:
             user.contact = data['contact']
         db.session.commit()
+        invalidate_users(user.id)
         return jsonify({'message': '更新成功'})
 
     # 搜索用户
     @app.route('/api/users/search')
     def search_users():
         q = request.args.get('q', '')
-        current_user = current_user if current_user.is_authenticated else None
+        viewer = current_user if current_user.is_authenticated else None
+        limit = page_size(request.args.get('limit', type=int))
         
-        # 搜索用户名、学号或联系方式
-        users = User.query.filter(
-            (User.name.like(f'%{q}%')) |
-            (User.student_id.like(f'%{q}%')) |
-            (User.contact.like(f'%{q}%'))
-        ).all()
+        # 一条语句取出匹配用户、与当前用户的兼容性分数和好友关系
+        try:
+            rows, next_cursor = query_users(
+                q, viewer.id if viewer else None, request.args.get('cursor'), limit
+            )
+        except InvalidCursor:
+            return jsonify({'error': 'cursor 格式错误'}), 400
         
-        results = []
-        for user in users:
-            if current_user and user.id == current_user.id:
-                continue
-                
-            user_data = {
-                'id': user.id,
-                'name': user.name,
-                'student_id': user.student_id,
-                'contact': user.contact if user.contact else None,
-            }
-            
-            # 如果用户已登录，添加兼容性分数和好友关系
-            if current_user:
-                # 获取兼容性分数
-                compatibility = CompatibilityScore.query.filter(
-                    ((CompatibilityScore.user1_id == current_user.id) & 
-                     (CompatibilityScore.user2_id == user.id)) |
-                    ((CompatibilityScore.user1_id == user.id) & 
-                     (CompatibilityScore.user2_id == current_user.id))
-                ).first()
-                
-                # 检查是否是好友关系
-                is_friend = user in current_user.friends
-                
-                user_data.update({
-                    'compatibility_score': compatibility.score if compatibility else 0,
-                    'is_friend': is_friend
-                })
-            
-            results.append(user_data)
+        # 如果用户已登录，附带兼容性分数和好友关系（已按分数降序排列）
+        results = [member_payload(*row) if viewer else member_payload(row) for row in rows]
         
-        # 如果用户已登录，按兼容性分数降序排序
-        if current_user:
-            results.sort(key=lambda x: x.get('compatibility_score', 0), reverse=True)
-        
-        return jsonify(results)
+        response = jsonify(results)
+        # 还有下一页时通过响应头返回游标
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
 
     # 模糊搜索标签
     @app.route('/api/hobbies/search')
     def search_hobbies():
         q = request.args.get('q', '')
-        hobbies = Hobby.query.filter(Hobby.name.like(f'%{q}%')).all()
-        return jsonify([{
-            'id': h.id, 
-            'name': h.name,
-            'user_count': len(h.users)
-        } for h in hobbies])
+        ids = matching_ids('hobby_search', q)
+        if ids is None:
+            ids = db.session.query(Hobby.id).filter(Hobby.name.like(f'%{q}%'))
+        return jsonify(hobbies_with_counts(ids))
 
     # 添加新标签
     @app.route('/api/hobbies', methods=['POST'])
@@ -186,6 +183,7 @@ def init_user_routes(app):
         if not hobby:
             hobby = Hobby(name=name)
             db.session.add(hobby)
+            bump_version('hobbies')
             db.session.commit()
         return jsonify({'id': hobby.id, 'name': hobby.name})
 
@@ -193,14 +191,17 @@ def init_user_routes(app):
     @app.route('/api/user/me/hobbies', methods=['PUT'])
     @login_required
     def set_user_hobbies():
-        user = current_user
+        user = current_user.orm()
         data = request.get_json()
         hobby_names = data.get('hobbies', [])
         hobbies = Hobby.query.filter(Hobby.name.in_(hobby_names)).all()
         user.hobbies = hobbies
+        # 标记后由后台任务重算该用户的爱好相关分项
+        mark_hobbies_dirty(user.id)
+        bump_version('hobbies')
         db.session.commit()
-        # 更新该用户的兼容性分数
-        update_compatibility_scores(user)
+        invalidate_users(user.id)
+        notify_worker()
         return jsonify({'message': '标签已更新'})
 
     # 添加好友关系
@@ -208,18 +209,13 @@ def init_user_routes(app):
     @login_required
     def add_friend(friend_id):
         user = current_user
+        if friend_id == user.id:
+            return jsonify({'error': '不能与自己建立好友关系'}), 400
         friend = User.query.get_or_404(friend_id)
         
-        if friend in user.friends:
+        if not set_friendship(user.id, friend.id, present=True):
             return jsonify({'message': '已经是好友关系'})
-        
-        user.friends.append(friend)
-        friend.friends.append(user)
-        db.session.commit()
-        
-        # 更新相关用户的兼容性分数
-        update_compatibility_scores(user)
-        update_compatibility_scores(friend)
+        notify_worker()
         
         return jsonify({'message': '好友关系已建立'})
 
@@ -230,16 +226,9 @@ def init_user_routes(app):
         user = current_user
         friend = User.query.get_or_404(friend_id)
         
-        if friend not in user.friends:
+        if not set_friendship(user.id, friend.id, present=False):
             return jsonify({'message': '不是好友关系'})
-        
-        user.friends.remove(friend)
-        friend.friends.remove(user)
-        db.session.commit()
-        
-        # 更新相关用户的兼容性分数
-        update_compatibility_scores(user)
-        update_compatibility_scores(friend)
+        notify_worker()
         
         return jsonify({'message': '好友关系已删除'})
 
@@ -248,85 +237,90 @@ def init_user_routes(app):
     @login_required
     def get_compatibility_scores():
         user = current_user
-        scores = []
+        # 可选 user_ids=1,2,3 只查询指定用户
+        other_ids = request.args.get('user_ids')
+        if other_ids is not None:
+            try:
+                other_ids = [int(uid) for uid in other_ids.split(',') if uid]
+            except ValueError:
+                return jsonify({'error': 'user_ids 格式错误'}), 400
         
-        # 获取作为user1的分数
-        for score in user.compatibility_scores_as_user1:
-            scores.append({
-                'user_id': score.user2_id,
-                'score': score.score,
-                'last_updated': score.last_updated.isoformat()
-            })
+        scores = [{
+            'user_id': other_id,
+            'score': score,
+            'last_updated': last_updated.isoformat()
+        } for other_id, score, last_updated in stored_scores(user.id, other_ids)]
         
-        # 获取作为user2的分数
-        for score in user.compatibility_scores_as_user2:
-            scores.append({
-                'user_id': score.user1_id,
-                'score': score.score,
-                'last_updated': score.last_updated.isoformat()
-            })
+        # 稀疏存储下没有保存的用户对分数为0
+        if other_ids is not None:
+            found = {s['user_id'] for s in scores}
+            scores.extend({
+                'user_id': other_id,
+                'score': 0.0,
+                'last_updated': None
+            } for other_id in other_ids if other_id not in found and other_id != user.id)
         
         return jsonify(scores)
 
-    # 获取圈子信息
-    @app.route('/api/circle/<int:hobby_id>', methods=['GET'])
+    # 获取推荐组队的用户（预先计算的前K榜单）
+    @app.route('/api/user/me/recommendations', methods=['GET'])
     @login_required
-    def get_circle(hobby_id):
-        print(f"Fetching circle for hobby_id: {hobby_id}")  # 调试日志
-        hobby = Hobby.query.get_or_404(hobby_id)
-        print(f"Found hobby: {hobby.name}, ID: {hobby.id}")  # 调试日志
-        
-        user = current_user
-        print(f"Current user: {user.name} (ID: {user.id})")  # 调试日志
-        print(f"Current user's hobbies: {[h.name for h in user.hobbies]}")  # 调试日志
-        
-        # 获取所有拥有该标签的用户
-        users = hobby.users
-        print(f"Number of users with this hobby: {len(users)}")  # 调试日志
-        print("Users with this hobby:")
-        for u in users:
-            print(f"- {u.name} (ID: {u.id})")
-        
-        # 更新当前用户与这些用户的兼容性分数
-        for other_user in users:
-            if other_user.id != user.id:
-                update_compatibility_scores(other_user)
-        
-        # 获取所有用户的兼容性分数
-        scores = []
-        for other_user in users:
-            if other_user.id == user.id:
-                print(f"Skipping current user: {other_user.name}")  # 调试日志
-                continue
-                
-            # 获取兼容性分数
-            compatibility = CompatibilityScore.query.filter(
-                ((CompatibilityScore.user1_id == user.id) & 
-                 (CompatibilityScore.user2_id == other_user.id)) |
-                ((CompatibilityScore.user1_id == other_user.id) & 
-                 (CompatibilityScore.user2_id == user.id))
-            ).first()
-            
-            # 检查是否是好友关系
-            is_friend = other_user in user.friends
-            
-            user_data = {
+    def get_recommendations():
+        k = request.args.get('k', 20, type=int)
+        k = max(1, min(k, TOP_K))
+        results = []
+        for match, other_user, is_friend in fetch_recommendations(current_user.id, k):
+            results.append({
                 'id': other_user.id,
                 'name': other_user.name,
                 'student_id': other_user.student_id,
                 'contact': other_user.contact if other_user.contact else None,
-                'compatibility_score': compatibility.score if compatibility else 0,
-                'is_friend': is_friend
-            }
-            scores.append(user_data)
+                'compatibility_score': match.score,
+                'rank': match.rank,
+                'is_friend': bool(is_friend)
+            })
+        return jsonify(results)
+
+    # 分页/流式获取圈子成员，直接读取已存储的分数
+    @app.route('/api/circle/<int:hobby_id>/members', methods=['GET'])
+    @login_required
+    def get_circle_members(hobby_id):
+        hobby = Hobby.query.get_or_404(hobby_id)
+        query, score, _ = circle_members(hobby.id, current_user.id)
         
-        # 按兼容性分数降序排序
-        scores.sort(key=lambda x: x['compatibility_score'], reverse=True)
-        print(f"Returning {len(scores)} users")  # 调试日志
+        # NDJSON：按分数降序逐行输出全部成员，不在内存中拼装整个响应
+        if request.args.get('format') == 'ndjson' or \
+                request.accept_mimetypes.best == 'application/x-ndjson':
+            def generate():
+                rows = query.order_by(score.desc(), User.id).yield_per(STREAM_BATCH_SIZE)
+                for other_user, compatibility_score, is_friend in rows:
+                    yield json.dumps(
+                        member_payload(other_user, compatibility_score, is_friend),
+                        ensure_ascii=False
+                    ) + '\n'
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
         
-        response_data = {
+        limit = page_size(request.args.get('limit', type=int))
+        try:
+            rows, next_cursor = paginate_by_score(query, score, request.args.get('cursor'), limit)
+        except InvalidCursor:
+            return jsonify({'error': 'cursor 格式错误'}), 400
+        return jsonify({
             'hobby_name': hobby.name,
-            'users': scores
-        }
-        print(f"Response data: {response_data}")  # 调试日志
-        return jsonify(response_data) 
\ No newline at end of file
+            'users': [member_payload(*row) for row in rows],
+            'next_cursor': next_cursor
+        })
+
+    # 获取圈子信息
+    @app.route('/api/circle/<int:hobby_id>', methods=['GET'])
+    @login_required
+    def get_circle(hobby_id):
+        hobby = Hobby.query.get_or_404(hobby_id)
+        # 成员、分数和好友标记由一条连接查询取出，按分数降序排列
+        query, score, _ = circle_members(hobby.id, current_user.id)
+        rows = query.order_by(score.desc(), User.id).all()
+        logger.debug('circle hobby_id=%s returned=%d', hobby.id, len(rows))
+        return jsonify({
+            'hobby_name': hobby.name,
+            'users': [member_payload(*row) for row in rows]
+        })
@@ -0,0 +1,242 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from flask import current_app, has_app_context
+from . import db
+from .top_matches import TOP_K
+
+logger = logging.getLogger(__name__)
+
+# 指向当前快照目录名的文件，通过 os.replace 原子切换
+CURRENT_FILE = 'CURRENT'
+# 保留的快照个数（含当前），更早的目录在写入新快照后删除
+SNAPSHOTS_KEPT = 2
+# 从 compatibility_score 读取时每次取的行数
+FETCH_SIZE = 100000
+ARRAYS = ('user_ids', 'indptr', 'others', 'scores', 'updated', 'top_indptr', 'top_others', 'top_scores')
+
+
+class ScoreSnapshot:
+    """以只读mmap方式打开的兼容性分数快照，多个进程共享同一份页缓存
+
+    每个用户对按两个方向各存一份，按 (用户id, 对方id) 排序：
+    others/scores/updated[indptr[i]:indptr[i + 1]] 为 user_ids[i] 的全部已保存分数；
+    top_others/top_scores[top_indptr[i]:top_indptr[i + 1]] 为其按 (分数降序, 对方id升序) 的前K个
+    """
+
+    def __init__(self, path: str, version: int, created_at: str, arrays: Dict[str, np.ndarray]):
+        self.path = path
+        self.version = version
+        self.created_at = created_at
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def open(cls, path: str) -> 'ScoreSnapshot':
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in ARRAYS}
+        return cls(path, meta['version'], meta['created_at'], arrays)
+
+    def _row(self, user_id: int) -> int:
+        """用户id对应的行号，没有已保存分数时返回-1"""
+        i = int(np.searchsorted(self.user_ids, user_id))
+        if i < len(self.user_ids) and self.user_ids[i] == user_id:
+            return i
+        return -1
+
+    def scores_for(self, user_id: int, other_ids: Iterable[int] = None) -> List[Tuple[int, float, datetime]]:
+        """与 user_queries.stored_scores 相同的 (对方id, 分数, 更新时间) 列表，没有保存的用户对不在结果中"""
+        row = self._row(user_id)
+        if row < 0:
+            return []
+        start, end = int(self.indptr[row]), int(self.indptr[row + 1])
+        others = self.others[start:end]
+        if other_ids is None:
+            positions = np.arange(len(others))
+        else:
+            wanted = np.unique(np.asarray(list(other_ids), dtype=np.int64))
+            positions = np.searchsorted(others, wanted)
+            inside = positions < len(others)
+            positions = positions[inside]
+            positions = positions[others[positions] == wanted[inside]]
+        positions = positions + start
+        return list(zip(self.others[positions].tolist(), self.scores[positions].tolist(),
+                        self.updated[positions].tolist()))
+
+    def top_matches(self, user_id: int, k: int = TOP_K) -> List[Tuple[int, int, float]]:
+        """前k个推荐的 (排名, 对方id, 分数)"""
+        row = self._row(user_id)
+        if row < 0:
+            return []
+        start = int(self.top_indptr[row])
+        end = min(int(self.top_indptr[row + 1]), start + k)
+        return [(rank, other_id, score) for rank, (other_id, score) in enumerate(
+            zip(self.top_others[start:end].tolist(), self.top_scores[start:end].tolist()), 1)]
+
+
+def build_score_arrays() -> Dict[str, np.ndarray]:
+    """用一条查询读取 compatibility_score，构建快照的全部数组"""
+    from .models import CompatibilityScore
+    # 更新时间在SQLite中换算成整数微秒，四列都是数值，可以不经过 Row 对象直接读成数组
+    # （用户id和微秒时间戳都小于2**53，用float64读取没有精度损失）
+    sql = f"""
+        SELECT user1_id, user2_id, score,
+               CAST(strftime('%s', last_updated) AS INTEGER) * 1000000
+               + CAST(substr(last_updated || '.000000', 21, 6) AS INTEGER)
+        FROM {CompatibilityScore.__tablename__}
+    """
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute(sql)
+    parts = []
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        parts.append(np.fromiter(chain.from_iterable(rows), dtype=np.float64,
+                                 count=4 * len(rows)).reshape(-1, 4))
+    cursor.close()
+    db.session.commit()
+    data = np.concatenate(parts) if parts else np.empty((0, 4))
+    user1 = data[:, 0].astype(np.int64)
+    user2 = data[:, 1].astype(np.int64)
+    scores = data[:, 2]
+    updated = data[:, 3].astype(np.int64).astype('datetime64[us]')
+
+    # 两个方向各一份，按 (用户, 对方) 排序
+    users = np.concatenate([user1, user2])
+    others = np.concatenate([user2, user1])
+    scores = np.concatenate([scores, scores])
+    updated = np.concatenate([updated, updated])
+    order = np.lexsort((others, users))
+    users, others, scores, updated = users[order], others[order], scores[order], updated[order]
+    user_ids = np.unique(users)
+    indptr = np.searchsorted(users, np.append(user_ids, np.iinfo(np.int64).max)).astype(np.int64)
+
+    # 与 top_match 相同的排序：分数降序，同分按对方id升序
+    order = np.lexsort((others, -scores, users))
+    ranks = np.arange(len(order)) - np.searchsorted(users[order], users[order]) + 1
+    top = order[ranks <= TOP_K]
+    top_indptr = np.searchsorted(users[top], np.append(user_ids, np.iinfo(np.int64).max)).astype(np.int64)
+
+    return {
+        'user_ids': user_ids,
+        'indptr': indptr,
+        'others': others,
+        'scores': scores,
+        'updated': updated,
+        'top_indptr': top_indptr,
+        'top_others': others[top],
+        'top_scores': scores[top],
+    }
+
+
+def _current_name(directory: str) -> Optional[str]:
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_score_snapshot(directory: str) -> ScoreSnapshot:
+    """把 compatibility_score 导出为新版本的快照并原子切换为当前快照
+
+    先写入临时目录，改名为版本号后再用 os.replace 替换 CURRENT；
+    已打开旧快照的进程继续读取旧文件，下次检查 CURRENT 时切换
+    """
+    started = time.monotonic()
+    os.makedirs(directory, exist_ok=True)
+    arrays = build_score_arrays()
+    current = _current_name(directory)
+    version = int(current) + 1 if current and current.isdigit() else 1
+    meta = {
+        'version': version,
+        'created_at': datetime.utcnow().isoformat(),
+        'users': len(arrays['user_ids']),
+        'pairs': len(arrays['others']) // 2,
+        'top_k': TOP_K,
+    }
+
+    tmp = tempfile.mkdtemp(prefix='.tmp-', dir=directory)
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + '.npy'), array)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        path = os.path.join(directory, str(version))
+        os.rename(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    pointer = os.path.join(directory, CURRENT_FILE)
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(str(version))
+    os.replace(pointer + '.tmp', pointer)
+
+    # 只保留最近的几个版本；已被其他进程mmap的旧文件在其关闭前仍可读取
+    versions = sorted(int(name) for name in os.listdir(directory) if name.isdigit())
+    for old in versions[:-SNAPSHOTS_KEPT]:
+        shutil.rmtree(os.path.join(directory, str(old)), ignore_errors=True)
+    logger.info('score snapshot version=%d pairs=%d seconds=%.1f',
+                version, meta['pairs'], time.monotonic() - started)
+    return ScoreSnapshot.open(path)
+
+
+_lock = threading.Lock()
+_snapshot: ScoreSnapshot = None
+# 打开 _snapshot 时 CURRENT 文件的 (路径, inode, 修改时间)
+_snapshot_key = None
+
+
+def get_score_snapshot() -> Optional[ScoreSnapshot]:
+    """当前的分数快照，未配置 SCORE_SNAPSHOT_DIR 或还没有快照时返回None（调用方改为查询数据库）
+
+    每次调用 stat 一次 CURRENT，文件被替换后重新打开
+    """
+    directory = current_app.config.get('SCORE_SNAPSHOT_DIR') if has_app_context() else None
+    if not directory:
+        return None
+    global _snapshot, _snapshot_key
+    pointer = os.path.join(directory, CURRENT_FILE)
+    try:
+        stat = os.stat(pointer)
+    except FileNotFoundError:
+        return None
+    key = (pointer, stat.st_ino, stat.st_mtime_ns)
+    with _lock:
+        if key != _snapshot_key:
+            try:
+                snapshot = ScoreSnapshot.open(os.path.join(directory, _current_name(directory) or ''))
+            except (OSError, ValueError, KeyError):
+                logger.exception('无法打开分数快照 %s', directory)
+                return None
+            _snapshot, _snapshot_key = snapshot, key
+        return _snapshot
+
+
+def main():
+    """立即导出一份分数快照：python -m app.score_snapshot
+
+    全量重算 (app/init_compatibility.py) 之后执行；平时由分数任务进程定期导出
+    """
+    from . import create_app
+    app = create_app(SCORE_WORKER='off')
+    directory = app.config['SCORE_SNAPSHOT_DIR']
+    if not directory:
+        raise SystemExit('未配置 SCORE_SNAPSHOT_DIR')
+    with app.app_context():
+        snapshot = write_score_snapshot(directory)
+    print(f'快照版本 {snapshot.version}：{snapshot.path}')
+
+
+if __name__ == '__main__':
+    main()
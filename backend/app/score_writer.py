@@ -0,0 +1,155 @@
+from datetime import datetime
+from typing import Iterable, Sequence
+import numpy as np
+from flask import current_app, has_app_context
+from sqlalchemy.dialects.sqlite import insert
+from .models import CompatibilityScore
+from . import db
+from .top_matches import refresh_top_matches_for_pairs
+
+# 每个事务写入的最大行数
+DEFAULT_CHUNK_SIZE = 5000
+MAX_CHUNK_SIZE = 20000
+
+COMPONENTS = ('hobby_overlap', 'subject_relatedness', 'distance_factor')
+# 默认只保存分数大于0的用户对；各分项都非负，缺失的行即分数为0，不丢失信息
+DEFAULT_STORE_THRESHOLD = 0.0
+
+
+def store_threshold() -> float:
+    """稀疏存储阈值（配置项 SCORE_STORE_THRESHOLD）：只保存分数大于该值的用户对
+
+    设为负数时保存全部用户对；读取时缺失的行按0分处理
+    """
+    if not has_app_context():
+        return DEFAULT_STORE_THRESHOLD
+    return current_app.config.get('SCORE_STORE_THRESHOLD', DEFAULT_STORE_THRESHOLD)
+
+
+def _upsert_statement(update: Sequence[str]):
+    """INSERT ... ON CONFLICT(user1_id, user2_id) DO UPDATE
+
+    update 指定冲突时覆盖的分项，其余分项保留表中的值，score 按公式重新组合
+    """
+    table = CompatibilityScore.__table__
+    stmt = insert(table)
+    parts = {
+        name: stmt.excluded[name] if name in update else table.c[name]
+        for name in COMPONENTS
+    }
+    values = {name: stmt.excluded[name] for name in update}
+    values['score'] = (parts['hobby_overlap'] * 0.25
+                       + parts['subject_relatedness'] * 0.25
+                       + parts['distance_factor'])
+    values['last_updated'] = stmt.excluded.last_updated
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.user1_id, table.c.user2_id],
+        set_=values
+    )
+
+
+def bulk_upsert_scores(user1_ids: Iterable[int], user2_ids: Iterable[int],
+                       hobby_overlap: Iterable[float], subject_relatedness: Iterable[float],
+                       distance_factor: Iterable[float], update: Sequence[str] = COMPONENTS,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE, refresh_top: bool = True,
+                       delete_dropped: bool = True) -> int:
+    """批量写入兼容性分数
+
+    按 unique_user_pair 约束做 upsert，每 chunk_size 行一个事务。
+    新插入的行使用传入的全部分项；已有行只覆盖 update 中列出的分项。
+    分数不超过 store_threshold() 的用户对不保存：覆盖全部分项时直接跳过，
+    delete_dropped 为真时顺带删除这些用户对已有的行（全量重算改为事后统一清理）；
+    部分覆盖时由 RETURNING 取回写入后的分数，删除低于阈值的行。
+    refresh_top 为真时按写入后的分数刷新受影响用户的前K榜单。
+    返回写入的行数
+    """
+    user1_ids = np.asarray(user1_ids, dtype=np.int64)
+    user2_ids = np.asarray(user2_ids, dtype=np.int64)
+    hobby_overlap = np.asarray(hobby_overlap, dtype=np.float64)
+    subject_relatedness = np.asarray(subject_relatedness, dtype=np.float64)
+    distance_factor = np.asarray(distance_factor, dtype=np.float64)
+
+    # 保证 user1_id < user2_id，并丢弃自身配对
+    low = np.minimum(user1_ids, user2_ids)
+    high = np.maximum(user1_ids, user2_ids)
+    keep = low != high
+    low, high = low[keep], high[keep]
+    hobby_overlap = hobby_overlap[keep]
+    subject_relatedness = subject_relatedness[keep]
+    distance_factor = distance_factor[keep]
+    scores = hobby_overlap * 0.25 + subject_relatedness * 0.25 + distance_factor
+
+    table = CompatibilityScore.__table__
+    threshold = store_threshold()
+    full = set(update) == set(COMPONENTS)
+    written = []
+    chunk_size = max(1, min(chunk_size, MAX_CHUNK_SIZE))
+    if full:
+        keep = scores > threshold
+        if delete_dropped and not keep.all():
+            dropped = [
+                {'a': a, 'b': b} for a, b in zip(low[~keep].tolist(), high[~keep].tolist())
+            ]
+            for start in range(0, len(dropped), chunk_size):
+                db.session.execute(
+                    table.delete().where(
+                        (table.c.user1_id == db.bindparam('a')) & (table.c.user2_id == db.bindparam('b'))
+                    ),
+                    dropped[start:start + chunk_size]
+                )
+                db.session.commit()
+            if refresh_top:
+                # 被删除的用户对可能在榜单中，交给榜单刷新判断
+                written.extend(zip(low[~keep].tolist(), high[~keep].tolist(), scores[~keep].tolist()))
+        low, high, scores = low[keep], high[keep], scores[keep]
+        hobby_overlap = hobby_overlap[keep]
+        subject_relatedness = subject_relatedness[keep]
+        distance_factor = distance_factor[keep]
+
+    stmt = _upsert_statement(update)
+    if refresh_top or not full:
+        # 部分覆盖时实际分数取决于表中已有的分项，由 RETURNING 取回
+        stmt = stmt.returning(table.c.id, table.c.user1_id, table.c.user2_id, table.c.score)
+    now = datetime.utcnow()
+    for start in range(0, len(low), chunk_size):
+        end = start + chunk_size
+        rows = [
+            {
+                'user1_id': a, 'user2_id': b, 'score': score,
+                'hobby_overlap': h, 'subject_relatedness': s, 'distance_factor': f,
+                'last_updated': now
+            }
+            for a, b, score, h, s, f in zip(
+                low[start:end].tolist(), high[start:end].tolist(), scores[start:end].tolist(),
+                hobby_overlap[start:end].tolist(), subject_relatedness[start:end].tolist(),
+                distance_factor[start:end].tolist()
+            )
+        ]
+        result = db.session.execute(stmt, rows)
+        if refresh_top or not full:
+            returned = result.all()
+            if refresh_top:
+                written.extend((a, b, score) for _, a, b, score in returned)
+            if not full:
+                below = [row_id for row_id, _, _, score in returned if score <= threshold]
+                if below:
+                    db.session.execute(table.delete().where(table.c.id.in_(below)))
+        db.session.commit()
+
+    if written:
+        written = np.array(written, dtype=np.float64)
+        refresh_top_matches_for_pairs(
+            written[:, 0].astype(np.int64), written[:, 1].astype(np.int64), written[:, 2]
+        )
+    return len(low)
+
+
+def delete_stale_scores(before: datetime) -> int:
+    """删除 before 之后没有重写过的行
+
+    全量重算不逐个删除低于阈值的用户对，结束后用这条语句统一清理
+    """
+    table = CompatibilityScore.__table__
+    result = db.session.execute(table.delete().where(table.c.last_updated < before))
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,163 @@
+from sqlalchemy import event, literal_column, select, text
+from . import db
+
+# trigram 分词至少需要3个字符，更短的查询改查单字/双字索引
+MIN_TRIGRAM_LENGTH = 3
+# 单字/双字索引覆盖的最大字符位置，与可搜索列中最长的 user_data.contact (String(128)) 一致
+MAX_SHORT_GRAM_POSITION = 128
+
+# 外部内容的 FTS5 索引：name/student_id/contact 以 user_data.id 为 rowid，hobby 同理。
+# 触发器在注册、修改资料、新增标签时同步索引
+_USER_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5(
+        name, student_id, contact,
+        content='user_data', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_insert AFTER INSERT ON user_data BEGIN
+        INSERT INTO user_search(rowid, name, student_id, contact)
+        VALUES (new.id, new.name, new.student_id, new.contact);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_delete AFTER DELETE ON user_data BEGIN
+        INSERT INTO user_search(user_search, rowid, name, student_id, contact)
+        VALUES ('delete', old.id, old.name, old.student_id, old.contact);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_update AFTER UPDATE ON user_data BEGIN
+        INSERT INTO user_search(user_search, rowid, name, student_id, contact)
+        VALUES ('delete', old.id, old.name, old.student_id, old.contact);
+        INSERT INTO user_search(rowid, name, student_id, contact)
+        VALUES (new.id, new.name, new.student_id, new.contact);
+    END""",
+]
+
+_HOBBY_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS hobby_search USING fts5(
+        name, content='hobby', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS hobby_search_insert AFTER INSERT ON hobby BEGIN
+        INSERT INTO hobby_search(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS hobby_search_delete AFTER DELETE ON hobby BEGIN
+        INSERT INTO hobby_search(hobby_search, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS hobby_search_update AFTER UPDATE ON hobby BEGIN
+        INSERT INTO hobby_search(hobby_search, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO hobby_search(rowid, name) VALUES (new.id, new.name);
+    END""",
+]
+
+
+def _gram_rows(values: str) -> str:
+    """把 (id, value) 查询展开成值中全部1~2字符子串（小写）及其id"""
+    return f"""SELECT DISTINCT lower(substr(v.value, p.n, w.len)) AS gram, v.id
+        FROM ({values}) AS v, search_position AS p, (SELECT 1 AS len UNION ALL SELECT 2) AS w
+        WHERE p.n <= length(v.value) - w.len + 1"""
+
+
+def _short_index_ddl(index_name: str, table: str, columns, rowid: str = 'id'):
+    """1~2个字符的查询使用的单字/双字索引表及同步触发器
+
+    FTS5 trigram 无法匹配少于3个字符的查询，这里为每个值的全部1、2字符子串
+    各存一行 (gram, id)，按主键查找代替全表 LIKE。
+    SQLite 触发器中不能使用 WITH，子串由 search_position 序号表展开。
+    返回 (建表及触发器语句, 从已有数据重建索引的语句)
+    """
+    short = f'{index_name}_short'
+    changed = ', '.join(columns)
+    new, old = (_gram_rows(' UNION ALL '.join(
+        f'SELECT {row}.{rowid} AS id, {row}.{column} AS value' for column in columns
+    )) for row in ('new', 'old'))
+    existing = _gram_rows(' UNION ALL '.join(
+        f'SELECT {rowid} AS id, {column} AS value FROM {table}' for column in columns
+    ))
+    return [
+        f"""CREATE TABLE IF NOT EXISTS {short} (
+            gram TEXT NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (gram, id)
+        ) WITHOUT ROWID""",
+        f"""CREATE TRIGGER IF NOT EXISTS {short}_insert AFTER INSERT ON {table} BEGIN
+            INSERT OR IGNORE INTO {short}(gram, id) {new};
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {short}_delete AFTER DELETE ON {table} BEGIN
+            DELETE FROM {short} WHERE id = old.{rowid}
+                AND gram IN (SELECT gram FROM ({old}));
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {short}_update AFTER UPDATE OF {changed} ON {table} BEGIN
+            DELETE FROM {short} WHERE id = old.{rowid}
+                AND gram IN (SELECT gram FROM ({old}));
+            INSERT OR IGNORE INTO {short}(gram, id) {new};
+        END""",
+    ], f'INSERT OR IGNORE INTO {short}(gram, id) {existing}'
+
+
+_SHORT_INDEXES = {
+    'user_search': _short_index_ddl('user_search', 'user_data', ('name', 'student_id', 'contact')),
+    'hobby_search': _short_index_ddl('hobby_search', 'hobby', ('name',)),
+}
+
+
+def _table_exists(connection, name: str) -> bool:
+    return connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': name}
+    ).first() is not None
+
+
+def create_search_index(connection):
+    """创建全文索引及同步触发器，新建索引时从已有数据重建"""
+    for index_name, ddl in (('user_search', _USER_INDEX_DDL), ('hobby_search', _HOBBY_INDEX_DDL)):
+        existed = _table_exists(connection, index_name)
+        for statement in ddl:
+            connection.execute(text(statement))
+        if not existed:
+            connection.execute(text(f"INSERT INTO {index_name}({index_name}) VALUES ('rebuild')"))
+
+    connection.execute(text('CREATE TABLE IF NOT EXISTS search_position (n INTEGER PRIMARY KEY)'))
+    connection.execute(text(f"""
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {MAX_SHORT_GRAM_POSITION})
+        INSERT OR IGNORE INTO search_position(n) SELECT n FROM seq
+    """))
+    for index_name, (ddl, rebuild) in _SHORT_INDEXES.items():
+        existed = _table_exists(connection, f'{index_name}_short')
+        for statement in ddl:
+            connection.execute(text(statement))
+        if not existed:
+            connection.execute(text(rebuild))
+
+
+def drop_search_index(connection):
+    """删除全文索引（触发器随基础表一起删除）"""
+    connection.execute(text('DROP TABLE IF EXISTS user_search'))
+    connection.execute(text('DROP TABLE IF EXISTS hobby_search'))
+    for index_name in _SHORT_INDEXES:
+        connection.execute(text(f'DROP TABLE IF EXISTS {index_name}_short'))
+    connection.execute(text('DROP TABLE IF EXISTS search_position'))
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _after_create(target, connection, **kw):
+    create_search_index(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _before_drop(target, connection, **kw):
+    drop_search_index(connection)
+
+
+def _match_phrase(q: str) -> str:
+    """把查询串转成FTS5短语，trigram 分词下即子串匹配"""
+    return '"' + q.replace('"', '""') + '"'
+
+
+def matching_ids(index_name: str, q: str):
+    """全文索引中匹配q的rowid子查询；q为空时返回None
+
+    1~2个字符的查询改查单字/双字索引，与 LIKE 一样只对ASCII字母忽略大小写
+    """
+    if not q:
+        return None
+    if len(q) < MIN_TRIGRAM_LENGTH:
+        return select(literal_column('id')).select_from(text(f'{index_name}_short')).where(
+            text('gram = lower(:gram)').bindparams(gram=q)
+        )
+    return select(literal_column('rowid')).select_from(text(index_name)).where(
+        text(f'{index_name} MATCH :match').bindparams(match=_match_phrase(q))
+    )
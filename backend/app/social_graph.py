@@ -0,0 +1,286 @@
+import threading
+from typing import Dict, Iterable, List, Set, Tuple
+import numpy as np
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from .models import user_friends
+from . import db
+from .cache import bump_version, get_version
+from .user_cache import invalidate_users
+from .graph import FriendGraph, build_csr, load_friend_graph, bfs_distances, bidirectional_distance
+
+# 好友图的版本号名称，好友关系变更时加一，其他进程据此重新加载
+GRAPH_VERSION = 'friends'
+# 增量边数超过该值时合并回CSR
+COMPACT_THRESHOLD = 1024
+# 批量修改好友关系时每条语句处理的用户对数（每对两行、四个参数）
+FRIENDSHIP_CHUNK_SIZE = 2000
+
+
+class SocialGraph:
+    """进程内的好友图
+
+    用户id升序映射为稠密下标，邻接关系存放在 FriendGraph 的CSR数组中
+    （100万条好友关系约占十几MB）。好友增删先记入增量表，
+    需要遍历或增量过多时再合并回CSR
+    """
+    __slots__ = ('base', 'version', '_added', '_removed', '_pending', '_lock')
+
+    def __init__(self, base: FriendGraph, version: int = 0):
+        self.base = base
+        self.version = version
+        # 双向记录：用户id -> 新增/删除的好友id
+        self._added: Dict[int, Set[int]] = {}
+        self._removed: Dict[int, Set[int]] = {}
+        self._pending = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, version: int = 0) -> 'SocialGraph':
+        # 未指定 user_ids 时节点按用户id升序排列
+        return cls(load_friend_graph(), version)
+
+    @property
+    def nbytes(self) -> int:
+        """CSR数组占用的字节数"""
+        return self.base.user_ids.nbytes + self.base.indptr.nbytes + self.base.indices.nbytes
+
+    def _node(self, user_id: int) -> int:
+        """用户id对应的节点下标，不在图中时返回-1"""
+        user_ids = self.base.user_ids
+        i = int(np.searchsorted(user_ids, user_id))
+        if i < len(user_ids) and user_ids[i] == user_id:
+            return i
+        return -1
+
+    def _base_neighbors(self, user_id: int) -> np.ndarray:
+        node = self._node(user_id)
+        if node < 0:
+            return np.empty(0, dtype=np.int64)
+        return self.base.user_ids[self.base.neighbors(node)]
+
+    def neighbors(self, user_id: int) -> np.ndarray:
+        """好友id数组（升序）"""
+        with self._lock:
+            friends = self._base_neighbors(user_id)
+            removed = self._removed.get(user_id)
+            added = self._added.get(user_id)
+            if removed:
+                friends = friends[~np.isin(friends, list(removed))]
+            if added:
+                friends = np.union1d(friends, list(added))
+            return np.sort(friends)
+
+    def degree(self, user_id: int) -> int:
+        return len(self.neighbors(user_id))
+
+    def has_edge(self, user1_id: int, user2_id: int) -> bool:
+        with self._lock:
+            if user2_id in self._added.get(user1_id, ()):
+                return True
+            if user2_id in self._removed.get(user1_id, ()):
+                return False
+            return bool(np.any(self._base_neighbors(user1_id) == user2_id))
+
+    def k_hop(self, user_id: int, k: int) -> np.ndarray:
+        """k跳以内可达的用户id数组（不含自身）"""
+        graph = self.compact()
+        node = self._node(user_id)
+        if node < 0 or k <= 0:
+            return np.empty(0, dtype=np.int64)
+        distances = bfs_distances(graph, node, max_depth=k)
+        return graph.user_ids[(distances > 0) & (distances <= k)]
+
+    def distance(self, user1_id: int, user2_id: int, max_hops: int = None) -> float:
+        """最短路径长度，不可达或超过 max_hops 为inf"""
+        if user1_id == user2_id:
+            return 0
+        graph = self.compact()
+        source = self._node(user1_id)
+        target = self._node(user2_id)
+        if source < 0 or target < 0:
+            return float('inf')
+        return bidirectional_distance(graph, source, target, max_hops)
+
+    def distances_to(self, user_id: int, user_ids: np.ndarray, max_hops: int = None) -> np.ndarray:
+        """一次BFS得到 user_id 到 user_ids 中每个用户的最短路径长度，不可达或超过 max_hops 为inf"""
+        graph = self.compact()
+        distances = np.full(len(user_ids), np.inf)
+        source = self._node(user_id)
+        if source < 0:
+            distances[user_ids == user_id] = 0
+            return distances
+        row = bfs_distances(graph, source, max_depth=max_hops)
+        slots = np.minimum(np.searchsorted(graph.user_ids, user_ids), graph.size - 1)
+        found = graph.user_ids[slots] == user_ids
+        distances[found] = row[slots[found]]
+        return distances
+
+    def friend_graph(self, include: Iterable[int] = ()) -> FriendGraph:
+        """合并后的CSR图；include 中不在图里的用户（如刚解除全部好友关系）作为孤立节点追加在末尾"""
+        graph = self.compact()
+        include = np.asarray(sorted(set(include)), dtype=np.int64)
+        missing = include[~np.isin(include, graph.user_ids)]
+        if not len(missing):
+            return graph
+        indptr = np.concatenate([graph.indptr, np.full(len(missing), graph.indptr[-1])])
+        return FriendGraph(np.concatenate([graph.user_ids, missing]), indptr, graph.indices)
+
+    def apply(self, user1_id: int, user2_id: int, present: bool):
+        """写入一条好友关系的变更（双向）"""
+        with self._lock:
+            in_base = bool(np.any(self._base_neighbors(user1_id) == user2_id))
+            for a, b in ((user1_id, user2_id), (user2_id, user1_id)):
+                if present:
+                    self._removed.get(a, set()).discard(b)
+                    if not in_base:
+                        self._added.setdefault(a, set()).add(b)
+                else:
+                    self._added.get(a, set()).discard(b)
+                    if in_base:
+                        self._removed.setdefault(a, set()).add(b)
+            self._pending += 1
+            if self._pending > COMPACT_THRESHOLD:
+                self.compact()
+
+    def compact(self) -> FriendGraph:
+        """把增量表合并回CSR，返回合并后的图"""
+        with self._lock:
+            if not self._pending:
+                return self.base
+            base = self.base
+            rows = np.repeat(np.arange(base.size), np.diff(base.indptr))
+            sources = base.user_ids[rows]
+            targets = base.user_ids[base.indices]
+
+            removed = [(a, b) for a, friends in self._removed.items() for b in friends]
+            if removed:
+                removed = np.array(removed, dtype=np.int64)
+                keep = ~np.isin(_pair_keys(sources, targets), _pair_keys(removed[:, 0], removed[:, 1]))
+                sources, targets = sources[keep], targets[keep]
+            added = [(a, b) for a, friends in self._added.items() for b in friends]
+            if added:
+                added = np.array(added, dtype=np.int64)
+                sources = np.concatenate([sources, added[:, 0]])
+                targets = np.concatenate([targets, added[:, 1]])
+
+            user_ids = np.union1d(sources, targets)
+            indptr, indices = build_csr(
+                np.searchsorted(user_ids, sources), np.searchsorted(user_ids, targets), len(user_ids)
+            )
+            self.base = FriendGraph(user_ids, indptr, indices)
+            self._added.clear()
+            self._removed.clear()
+            self._pending = 0
+            return self.base
+
+
+def _pair_keys(sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """把 (用户id, 用户id) 编码成一个int64，便于批量比较"""
+    return (sources.astype(np.int64) << 32) | targets.astype(np.int64)
+
+
+_lock = threading.Lock()
+_graph: SocialGraph = None
+
+
+def get_social_graph() -> SocialGraph:
+    """获取进程内的好友图，其他进程修改过好友关系时重新加载"""
+    global _graph
+    # 先读版本号再加载，加载期间的并发修改最多导致下次多加载一次
+    version = get_version(GRAPH_VERSION)
+    with _lock:
+        if _graph is None or _graph.version != version:
+            _graph = SocialGraph.load(version)
+        return _graph
+
+
+def _record(user1_id: int, user2_id: int, present: bool, version: int):
+    """提交后把变更同步到进程内的好友图
+
+    只有图恰好停在上一个版本时才能直接应用，否则等下次使用时重新加载
+    """
+    with _lock:
+        if _graph is not None and _graph.version == version - 1:
+            _graph.apply(user1_id, user2_id, present)
+            _graph.version = version
+
+
+def _record_many(changes: List[Tuple[int, int, bool]], version: int):
+    """批量变更提交后同步进程内的好友图，条件同 _record"""
+    with _lock:
+        if _graph is not None and _graph.version == version - 1:
+            for user1_id, user2_id, present in changes:
+                _graph.apply(user1_id, user2_id, present)
+            _graph.version = version
+
+
+def set_friendships(add: Iterable[Tuple[int, int]] = (),
+                    remove: Iterable[Tuple[int, int]] = ()) -> List[Tuple[int, int, bool]]:
+    """在一个事务中批量建立和解除好友关系，返回实际发生变化的 (user1_id, user2_id, present)
+
+    每批用户对一条 INSERT ... ON CONFLICT DO NOTHING / DELETE 语句，由 RETURNING 得到
+    实际变化的关系；只加入一次分数任务、只加一次好友图版本号。
+    同一对用户不能同时出现在 add 和 remove 中
+    """
+    from .jobs import mark_friendships_dirty
+    changes = []
+    for pairs, present in ((add, True), (remove, False)):
+        pairs = sorted({(min(a, b), max(a, b)) for a, b in pairs if a != b})
+        for start in range(0, len(pairs), FRIENDSHIP_CHUNK_SIZE):
+            chunk = pairs[start:start + FRIENDSHIP_CHUNK_SIZE]
+            both = chunk + [(b, a) for a, b in chunk]
+            if present:
+                stmt = insert(user_friends).values(
+                    [{'user_id': a, 'friend_id': b} for a, b in both]
+                ).on_conflict_do_nothing()
+            else:
+                stmt = user_friends.delete().where(
+                    tuple_(user_friends.c.user_id, user_friends.c.friend_id).in_(both)
+                )
+            returned = db.session.execute(
+                stmt.returning(user_friends.c.user_id, user_friends.c.friend_id)
+            ).all()
+            changes.extend((a, b, present) for a, b in returned if a < b)
+    if not changes:
+        db.session.rollback()
+        return []
+
+    mark_friendships_dirty((a, b, not present) for a, b, present in changes)
+    version = bump_version(GRAPH_VERSION)
+    db.session.commit()
+    _record_many(changes, version)
+    invalidate_users(*{uid for a, b, _ in changes for uid in (a, b)})
+    return changes
+
+
+def set_friendship(user1_id: int, user2_id: int, present: bool) -> bool:
+    """建立或解除双向好友关系，返回是否发生了变化
+
+    直接写关联表，不加载ORM的 friends 集合；与分数任务标记同一事务提交，
+    提交后同步进程内的好友图，并丢弃双方的登录用户快照；与 set_friendships 一样忽略自己和自己
+    """
+    from .jobs import mark_friendship_dirty
+    if user1_id == user2_id:
+        return False
+    if present:
+        stmt = insert(user_friends).values([
+            {'user_id': user1_id, 'friend_id': user2_id},
+            {'user_id': user2_id, 'friend_id': user1_id},
+        ]).on_conflict_do_nothing()
+    else:
+        stmt = user_friends.delete().where(or_(
+            and_(user_friends.c.user_id == user1_id, user_friends.c.friend_id == user2_id),
+            and_(user_friends.c.user_id == user2_id, user_friends.c.friend_id == user1_id),
+        ))
+    if db.session.execute(stmt).rowcount == 0:
+        db.session.rollback()
+        return False
+
+    # 标记后由后台任务只更新最短距离受影响的用户对
+    mark_friendship_dirty(user1_id, user2_id, existed=not present)
+    version = bump_version(GRAPH_VERSION)
+    db.session.commit()
+    _record(user1_id, user2_id, present, version)
+    invalidate_users(user1_id, user2_id)
+    return True
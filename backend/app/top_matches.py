@@ -0,0 +1,110 @@
+from typing import Iterable
+import numpy as np
+from sqlalchemy import text
+from .models import User, TopMatch, user_friends
+from . import db
+
+# 每个用户保留的推荐数量
+TOP_K = 100
+# 每条刷新语句处理的用户数
+REFRESH_BATCH = 500
+
+_REFRESH_SQL = '''
+    INSERT INTO top_match (user_id, rank, other_id, score)
+    SELECT user_id, rank, other_id, score FROM (
+        SELECT user_id, other_id, score,
+               ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY score DESC, other_id) AS rank
+        FROM (
+            SELECT user1_id AS user_id, user2_id AS other_id, score
+            FROM compatibility_score WHERE user1_id IN ({ids})
+            UNION ALL
+            SELECT user2_id AS user_id, user1_id AS other_id, score
+            FROM compatibility_score WHERE user2_id IN ({ids})
+        )
+    )
+    WHERE rank <= :k
+'''
+
+
+def refresh_top_matches(user_ids: Iterable[int]):
+    """按 compatibility_score 重建这些用户的前K榜单"""
+    user_ids = sorted({int(uid) for uid in user_ids})
+    for start in range(0, len(user_ids), REFRESH_BATCH):
+        batch = user_ids[start:start + REFRESH_BATCH]
+        ids = ', '.join(str(uid) for uid in batch)
+        TopMatch.query.filter(TopMatch.user_id.in_(batch)).delete(synchronize_session=False)
+        db.session.execute(text(_REFRESH_SQL.format(ids=ids)), {'k': TOP_K})
+        db.session.commit()
+
+
+def refresh_all_top_matches():
+    """重建所有用户的前K榜单"""
+    refresh_top_matches(row[0] for row in db.session.query(User.id))
+
+
+def refresh_top_matches_for_pairs(user1_ids: np.ndarray, user2_ids: np.ndarray, scores: np.ndarray):
+    """分数写入后，只刷新榜单可能变化的用户
+
+    某用户需要刷新：榜单不满K个、某个变化的分数不低于榜单最低分，或变化的对象本就在榜单中
+    """
+    users = np.concatenate([user1_ids, user2_ids]).tolist()
+    others = np.concatenate([user2_ids, user1_ids]).tolist()
+    pair_scores = np.concatenate([scores, scores]).tolist()
+    touched = sorted(set(users))
+
+    thresholds = {}
+    members = set()
+    for start in range(0, len(touched), REFRESH_BATCH):
+        batch = touched[start:start + REFRESH_BATCH]
+        for user_id, rank, other_id, score in db.session.query(
+                TopMatch.user_id, TopMatch.rank, TopMatch.other_id, TopMatch.score
+        ).filter(TopMatch.user_id.in_(batch)):
+            members.add((user_id, other_id))
+            if rank == TOP_K:
+                thresholds[user_id] = score
+
+    stale = set()
+    for user_id, other_id, score in zip(users, others, pair_scores):
+        if user_id in stale:
+            continue
+        threshold = thresholds.get(user_id)
+        if threshold is None or score >= threshold or (user_id, other_id) in members:
+            stale.add(user_id)
+    refresh_top_matches(stale)
+
+
+def get_recommendations(user_id: int, k: int = TOP_K):
+    """读取某用户的前k个推荐
+
+    按 (user_id, rank) 主键范围查询，同一条语句带出用户信息和好友标记，
+    返回 (TopMatch, User, 是否好友) 列表。有分数快照时榜单从快照读取，
+    只查询用户信息和好友标记
+    """
+    from .score_snapshot import get_score_snapshot
+    snapshot = get_score_snapshot()
+    if snapshot is not None:
+        matches = snapshot.top_matches(user_id, k)
+        if not matches:
+            return []
+        users = {user.id: (user, is_friend) for user, is_friend in db.session.query(
+            User, user_friends.c.friend_id.isnot(None)
+        ).outerjoin(
+            user_friends,
+            (user_friends.c.user_id == user_id) & (user_friends.c.friend_id == User.id)
+        ).filter(User.id.in_([other_id for _, other_id, _ in matches]))}
+        # 快照之后被删除的用户不返回
+        return [
+            (TopMatch(user_id=user_id, rank=rank, other_id=other_id, score=score), *users[other_id])
+            for rank, other_id, score in matches if other_id in users
+        ]
+    return db.session.query(
+        TopMatch, User, user_friends.c.friend_id.isnot(None)
+    ).join(
+        User, User.id == TopMatch.other_id
+    ).outerjoin(
+        user_friends,
+        (user_friends.c.user_id == user_id) & (user_friends.c.friend_id == TopMatch.other_id)
+    ).filter(
+        TopMatch.user_id == user_id,
+        TopMatch.rank <= k
+    ).order_by(TopMatch.rank).all()
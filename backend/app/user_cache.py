@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import FrozenSet, Tuple
+from flask import current_app
+from flask_login import UserMixin
+from .models import User, Hobby, user_hobbies, user_friends
+from . import db
+
+
+class UserSnapshot(UserMixin):
+    """登录用户的只读快照，作为 current_user 使用
+
+    包含资料、爱好和好友id，在多个请求间共享，不能修改；
+    需要修改资料或爱好时通过 orm() 加载数据库中的 User
+    """
+
+    def __init__(self, id: int, student_id: str, email: str, name: str, contact: str,
+                 hobbies: Tuple[Tuple[int, str], ...], friend_ids: FrozenSet[int]):
+        self.id = id
+        self.student_id = student_id
+        self.email = email
+        self.name = name
+        self.contact = contact
+        self.hobby_ids = frozenset(hobby_id for hobby_id, _ in hobbies)
+        self.hobby_names = tuple(name for _, name in hobbies)
+        self.friend_ids = friend_ids
+        self.loaded_at = time.monotonic()
+
+    def orm(self) -> User:
+        return User.query.get(self.id)
+
+
+def load_user_snapshot(user_id: int) -> UserSnapshot:
+    """从数据库读取用户资料、爱好和好友id，用户不存在时返回None"""
+    row = db.session.query(
+        User.id, User.student_id, User.email, User.name, User.contact
+    ).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    hobbies = db.session.query(Hobby.id, Hobby.name).join(
+        user_hobbies, user_hobbies.c.hobby_id == Hobby.id
+    ).filter(user_hobbies.c.user_id == user_id).order_by(Hobby.id).all()
+    friend_ids = db.session.query(user_friends.c.friend_id).filter(
+        user_friends.c.user_id == user_id
+    ).all()
+    return UserSnapshot(*row, tuple(hobbies), frozenset(fid for fid, in friend_ids))
+
+
+_lock = threading.Lock()
+# 用户id -> 快照，按最近使用排序
+_snapshots: 'OrderedDict[int, UserSnapshot]' = OrderedDict()
+# 每次失效加一，加载期间发生过失效的快照不放入缓存
+_generation = 0
+
+
+def get_user_snapshot(user_id: int) -> UserSnapshot:
+    """按用户id获取快照，进程内按 LRU 缓存 USER_CACHE_TTL 秒
+
+    本进程内的修改通过 invalidate_users 立即生效，其他进程的修改最迟在TTL后生效
+    """
+    ttl = current_app.config['USER_CACHE_TTL']
+    with _lock:
+        snapshot = _snapshots.get(user_id)
+        if snapshot is not None and time.monotonic() - snapshot.loaded_at <= ttl:
+            _snapshots.move_to_end(user_id)
+            return snapshot
+        generation = _generation
+
+    snapshot = load_user_snapshot(user_id)
+    if snapshot is not None and ttl > 0:
+        with _lock:
+            if generation != _generation:
+                return snapshot
+            _snapshots[user_id] = snapshot
+            _snapshots.move_to_end(user_id)
+            while len(_snapshots) > current_app.config['USER_CACHE_SIZE']:
+                _snapshots.popitem(last=False)
+    return snapshot
+
+
+def invalidate_users(*user_ids: int):
+    """资料、爱好或好友关系修改后丢弃这些用户的快照"""
+    global _generation
+    with _lock:
+        _generation += 1
+        for user_id in user_ids:
+            _snapshots.pop(user_id, None)
+
+
+def invalidate_all_users():
+    """批量导入等大范围修改后丢弃全部快照"""
+    global _generation
+    with _lock:
+        _generation += 1
+        _snapshots.clear()
@@ -0,0 +1,156 @@
+import base64
+import json
+import math
+from sqlalchemy import and_, func, or_, union_all
+from sqlalchemy.orm import aliased
+from .models import User, CompatibilityScore, user_friends, user_hobbies
+from . import db
+from .search_index import matching_ids
+from .score_snapshot import get_score_snapshot
+
+# 分页默认条数和上限
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(values) -> str:
+    """把排序键编码成不透明的游标字符串"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """解析游标，格式不对时返回None"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+
+
+class InvalidCursor(ValueError):
+    """游标无法解析或不是本接口的排序键，接口返回400"""
+
+
+def parse_cursor(cursor: str, with_score: bool = True):
+    """解析并校验游标：按分数分页时为 [分数, 用户id]，只按id分页时为 [用户id]"""
+    position = decode_cursor(cursor)
+    if not isinstance(position, list) or len(position) != (2 if with_score else 1):
+        raise InvalidCursor(cursor)
+    if with_score:
+        last_score = position[0]
+        if isinstance(last_score, bool) or not isinstance(last_score, (int, float)) \
+                or not math.isfinite(last_score):
+            raise InvalidCursor(cursor)
+    last_id = position[-1]
+    if isinstance(last_id, bool) or not isinstance(last_id, int):
+        raise InvalidCursor(cursor)
+    return position
+
+
+def page_size(limit) -> int:
+    if not limit:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def users_with_scores(viewer_id: int = None):
+    """用户列表查询，附带与viewer的兼容性分数和好友标记
+
+    两个方向的分数各用一次外连接（都能走 unique_user_pair 索引），
+    好友标记外连接 user_friends 主键。返回 (query, 分数表达式, 好友表达式)
+    """
+    if viewer_id is None:
+        return db.session.query(User), None, None
+
+    as_user1 = aliased(CompatibilityScore)
+    as_user2 = aliased(CompatibilityScore)
+    score = func.coalesce(as_user1.score, as_user2.score, 0.0)
+    is_friend = user_friends.c.friend_id.isnot(None)
+    query = db.session.query(User, score, is_friend).outerjoin(
+        as_user1, and_(as_user1.user1_id == viewer_id, as_user1.user2_id == User.id)
+    ).outerjoin(
+        as_user2, and_(as_user2.user1_id == User.id, as_user2.user2_id == viewer_id)
+    ).outerjoin(
+        user_friends, and_(user_friends.c.user_id == viewer_id, user_friends.c.friend_id == User.id)
+    ).filter(User.id != viewer_id)
+    return query, score, is_friend
+
+
+def paginate_by_score(query, score, cursor, limit: int):
+    """按 (分数降序, id升序) 做游标分页，score为None时只按id升序
+
+    多取一行判断是否还有下一页，返回 (本页行, 下一页游标或None)；
+    游标格式不对时抛出 InvalidCursor
+    """
+    position = parse_cursor(cursor, score is not None) if cursor else None
+    if score is None:
+        if position is not None:
+            query = query.filter(User.id > position[-1])
+        rows = query.order_by(User.id).limit(limit + 1).all()
+    else:
+        if position is not None:
+            last_score, last_id = position
+            query = query.filter(or_(
+                score < last_score,
+                and_(score == last_score, User.id > last_id)
+            ))
+        rows = query.order_by(score.desc(), User.id).limit(limit + 1).all()
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    if score is None:
+        return rows, encode_cursor([last.id])
+    return rows, encode_cursor([last[1], last[0].id])
+
+
+def search_users(q: str, viewer_id: int = None, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    """按姓名、学号或联系方式搜索用户，一条语句带出分数和好友标记
+
+    匹配通过 user_search 全文索引完成（1~2个字符的查询查单字/双字索引），空查询才回退到 LIKE
+    """
+    query, score, is_friend = users_with_scores(viewer_id)
+    ids = matching_ids('user_search', q)
+    if ids is not None:
+        query = query.filter(User.id.in_(ids))
+    else:
+        query = query.filter(
+            (User.name.like(f'%{q}%')) |
+            (User.student_id.like(f'%{q}%')) |
+            (User.contact.like(f'%{q}%'))
+        )
+    return paginate_by_score(query, score, cursor, limit)
+
+
+def circle_members(hobby_id: int, viewer_id: int):
+    """某爱好圈子的成员查询，附带与viewer的分数和好友标记
+
+    通过 ix_user_hobbies_hobby_id 索引连接成员，返回 (query, 分数表达式, 好友表达式)
+    """
+    query, score, is_friend = users_with_scores(viewer_id)
+    query = query.join(
+        user_hobbies, and_(user_hobbies.c.user_id == User.id, user_hobbies.c.hobby_id == hobby_id)
+    )
+    return query, score, is_friend
+
+
+def stored_scores(user_id: int, other_ids=None):
+    """某用户已保存的兼容性分数，返回 (对方id, 分数, 更新时间) 列表
+
+    两个方向各一条索引查询；稀疏存储下没有保存的用户对不在结果中，按0分处理。
+    有分数快照时直接从快照读取，不查询数据库
+    """
+    snapshot = get_score_snapshot()
+    if snapshot is not None:
+        return snapshot.scores_for(user_id, other_ids)
+    table = CompatibilityScore.__table__
+    as_user1 = db.select(
+        table.c.user2_id.label('other_id'), table.c.score, table.c.last_updated
+    ).where(table.c.user1_id == user_id)
+    as_user2 = db.select(
+        table.c.user1_id.label('other_id'), table.c.score, table.c.last_updated
+    ).where(table.c.user2_id == user_id)
+    if other_ids is not None:
+        as_user1 = as_user1.where(table.c.user2_id.in_(other_ids))
+        as_user2 = as_user2.where(table.c.user1_id.in_(other_ids))
+    return db.session.execute(union_all(as_user1, as_user2)).all()
@@ -0,0 +1,250 @@
+"""校园规模的关键路径基准测试
+
+按给定规模用 importer.synthetic_roster 生成名单、RosterImporter 导入（爱好个数、
+爱好热度、好友数的分布均可配置），然后对以下路径计时，结果可写入JSON，便于比较不同版本的性能：
+  - update_compatibility_scores 全量重算
+  - GET /api/users/search、/api/circle/<id>、/api/circle/<id>/members、/api/hobbies
+  - 添加/删除好友接口，以及随后的分数任务处理
+
+每个规模在单独的进程中使用新建的数据库运行，进程内的缓存不会互相影响。
+
+用法: python benchmarks/campus.py --users 1000 10000 100000 --degree 8 --output bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import re
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 基准用户的登录密码，synthetic_roster 只计算一次哈希，所有用户共用
+PASSWORD = 'benchmark'
+SEARCH_PREFIX = '学生'
+
+
+def hobby_counts(rng, users: int, dist: str, mean: float, maximum: int) -> np.ndarray:
+    """每个用户的爱好个数：uniform 为 1..2*mean-1 均匀分布，poisson 为泊松分布"""
+    if dist == 'uniform':
+        counts = rng.integers(1, max(2, int(round(2 * mean))), users)
+    else:
+        counts = rng.poisson(mean, users)
+    return np.clip(counts, 0, maximum)
+
+
+def friend_counts(rng, users: int, dist: str, degree: float) -> np.ndarray:
+    """每个用户名单中列出的好友数，平均为 degree/2（另一半来自别人列出自己）；
+    powerlaw 时按帕累托权重分配，度数近似幂律分布"""
+    if dist == 'powerlaw':
+        weights = rng.pareto(2.0, users) + 1
+        return rng.poisson(degree / 2 * weights / weights.mean())
+    return rng.poisson(degree / 2, users)
+
+
+def generate_campus(users: int, args, seed: int) -> dict:
+    """清空数据库并用名单导入器写入一个校园的数据，返回各表行数"""
+    from app import db
+    from app.importer import RosterImporter, synthetic_roster
+    from app.models import Hobby
+    from app.relatedness import default_pairs
+
+    rng = np.random.default_rng(seed)
+    db.drop_all()
+    db.create_all()
+
+    # 学科名参与学科相关度计算，其余为普通爱好；先全部创建，没有人选的爱好也出现在爱好列表中
+    subjects = sorted({a for a, _ in default_pairs()})
+    names = (subjects + [f'爱好{i}' for i in range(1, args.hobbies + 1)])[:args.hobbies]
+    db.session.add_all([Hobby(name=name) for name in names])
+    db.session.commit()
+
+    hobbies = hobby_counts(rng, users, args.hobby_dist, args.hobbies_per_user, len(names))
+    friends = friend_counts(rng, users, args.degree_dist, args.degree)
+    rows = synthetic_roster(
+        users, names, seed=seed, password=PASSWORD,
+        name_factory=lambda i: f'{SEARCH_PREFIX}{i}',
+        hobby_count=hobbies.__getitem__, friend_count=friends.__getitem__,
+        # 爱好热度按 Zipf 分布
+        hobby_weights=(1.0 / np.arange(1, len(names) + 1) ** args.hobby_skew).tolist(),
+    )
+    # 分数由基准测试单独全量重算并计时
+    stats = RosterImporter().run(rows, rescore=False)
+    return {'users': stats['users'], 'hobbies': len(names), 'user_hobbies': stats['user_hobbies'],
+            'friendships': stats['friendships']}
+
+
+def summarize(samples: list, queries: list = None) -> dict:
+    """第一次调用单独记为冷启动耗时，其余调用统计分位数"""
+    warm = samples[1:] or samples
+    ordered = sorted(warm)
+    result = {
+        'cold_seconds': samples[0],
+        'min_seconds': ordered[0],
+        'median_seconds': statistics.median(ordered),
+        'p95_seconds': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'mean_seconds': statistics.fmean(ordered),
+        'calls': len(samples),
+    }
+    if queries:
+        result['queries'] = max(queries)
+    return result
+
+
+def _query_count(response) -> int:
+    """从 Server-Timing 头中读取请求执行的SQL条数"""
+    match = re.search(r'desc="(\d+) queries"', response.headers.get('Server-Timing', ''))
+    return int(match.group(1)) if match else None
+
+
+def time_request(client, repeat: int, method: str, url: str, make_url=None) -> dict:
+    samples, queries = [], []
+    for i in range(repeat):
+        started = time.perf_counter()
+        response = client.open(make_url(i) if make_url else url, method=method)
+        response.get_data()
+        samples.append(time.perf_counter() - started)
+        queries.append(_query_count(response))
+        if response.status_code >= 400:
+            raise RuntimeError(f'{method} {url} 返回 {response.status_code}')
+    return summarize(samples, [q for q in queries if q is not None])
+
+
+def run_size(users: int, args: dict) -> dict:
+    """在新进程中生成一个规模的数据并对关键路径计时"""
+    args = argparse.Namespace(**args)
+    from sqlalchemy import func
+    from app import create_app, db
+    from app.compatibility import update_compatibility_scores
+    from app.jobs import run_pending_jobs
+    from app.models import user_hobbies
+
+    directory = args.db_dir or tempfile.mkdtemp(prefix='lalinea-bench-')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'campus-{users}.db')
+    app = create_app(
+        args.profile,
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + path,
+        CREATE_SCHEMA_ON_STARTUP=False,
+        # 分数任务由基准测试手动处理，单独计时
+        SCORE_WORKER='off',
+        # 旧的圈子接口每次都会触发N+1警告
+        LOG_LEVEL='ERROR',
+    )
+    result = {'users': users}
+    try:
+        with app.app_context():
+            started = time.perf_counter()
+            result['data'] = generate_campus(users, args, args.seed + users)
+            result['generate_seconds'] = time.perf_counter() - started
+
+            paths = result['paths'] = {}
+            if users <= args.full_max_users:
+                started = time.perf_counter()
+                update_compatibility_scores()
+                paths['update_compatibility_scores'] = summarize([time.perf_counter() - started])
+
+            # 选取人数居中的爱好作为圈子，避免最热门的爱好让逐个查询的旧接口耗时过长
+            counts = db.session.query(user_hobbies.c.hobby_id, func.count()).group_by(
+                user_hobbies.c.hobby_id).order_by(func.count()).all()
+            circle_id, circle_size = counts[len(counts) // 2]
+            result['circle'] = {'hobby_id': circle_id, 'members': circle_size}
+
+        rng = np.random.default_rng(args.seed)
+        client = app.test_client()
+        client.post('/login', json={'student_id': '20200000', 'password': PASSWORD})
+        repeat = args.repeat
+        prefixes = rng.integers(1, users, repeat).tolist()
+        paths['hobbies'] = time_request(client, repeat, 'GET', '/api/hobbies')
+        paths['search_users'] = time_request(
+            client, repeat, 'GET', '/api/users/search',
+            lambda i: f'/api/users/search?q={SEARCH_PREFIX}{prefixes[i]}'
+        )
+        paths['get_circle'] = time_request(client, repeat, 'GET', f'/api/circle/{circle_id}')
+        paths['circle_members'] = time_request(client, repeat, 'GET', f'/api/circle/{circle_id}/members')
+
+        # 添加、删除同一批好友，每次接口调用后处理对应的分数任务
+        friends = rng.choice(np.arange(2, users + 1), min(repeat, users - 1), replace=False).tolist()
+        add, remove, jobs = [], [], []
+        queries = {'POST': [], 'DELETE': []}
+        for method, samples in (('POST', add), ('DELETE', remove)):
+            for friend in friends:
+                started = time.perf_counter()
+                response = client.open(f'/api/user/me/friends/{friend}', method=method)
+                samples.append(time.perf_counter() - started)
+                queries[method].append(_query_count(response))
+                if response.status_code >= 400:
+                    raise RuntimeError(f'{method} 好友接口返回 {response.status_code}')
+                with app.app_context():
+                    started = time.perf_counter()
+                    run_pending_jobs()
+                    jobs.append(time.perf_counter() - started)
+        paths['friend_add'] = summarize(add, [q for q in queries['POST'] if q is not None])
+        paths['friend_remove'] = summarize(remove, [q for q in queries['DELETE'] if q is not None])
+        paths['friend_jobs'] = summarize(jobs)
+    finally:
+        if not args.keep_db:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            if not args.db_dir:
+                shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--hobbies', type=int, default=40, help='爱好总数')
+    parser.add_argument('--hobbies-per-user', type=float, default=2.5, help='平均每人的爱好数')
+    parser.add_argument('--hobby-dist', choices=['uniform', 'poisson'], default='poisson')
+    parser.add_argument('--hobby-skew', type=float, default=1.0, help='爱好热度的 Zipf 指数，0为均匀')
+    parser.add_argument('--degree', type=float, default=8.0, help='平均好友数')
+    parser.add_argument('--degree-dist', choices=['uniform', 'powerlaw'], default='powerlaw')
+    parser.add_argument('--repeat', type=int, default=20, help='每个接口的调用次数')
+    parser.add_argument('--full-max-users', type=int, default=5000,
+                        help='用户数超过该值时跳过全量重算（用户对数量随用户数平方增长）')
+    parser.add_argument('--profile', default='production', help='config.py 中的配置名')
+    parser.add_argument('--db-dir', help='数据库文件目录，默认使用临时目录')
+    parser.add_argument('--keep-db', action='store_true', help='保留生成的数据库')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='结果写入该JSON文件')
+    args = parser.parse_args()
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for users in args.users:
+        with context.Pool(1) as pool:
+            result = pool.apply(run_size, (users, vars(args)))
+        results.append(result)
+        data = result['data']
+        print(f'users={users} user_hobbies={data["user_hobbies"]} friendships={data["friendships"]} '
+              f'circle={result["circle"]["members"]} generate={result["generate_seconds"]:.2f}s')
+        print(f'  {"path":<28} {"cold s":>9} {"median s":>9} {"p95 s":>9} {"queries":>8}')
+        for name, row in result['paths'].items():
+            print(f'  {name:<28} {row["cold_seconds"]:>9.4f} {row["median_seconds"]:>9.4f} '
+                  f'{row["p95_seconds"]:>9.4f} {str(row.get("queries", "")):>8}')
+
+    if args.output:
+        environment = {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        }
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'environment': environment, 'results': results},
+                      f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
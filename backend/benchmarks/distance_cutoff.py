@@ -0,0 +1,118 @@
+"""关系距离跳数上限的基准测试
+
+在随机生成的好友图上比较不限跳数与各个跳数上限下：
+  - 一对多BFS（全量/单用户重算使用）和双向BFS（单对查询使用）的耗时
+  - 关系距离得分的偏差，以及每个用户前K推荐与不限跳数时的重合率
+
+用法: python benchmarks/distance_cutoff.py --users 20000 --degree 8 --cutoffs 2 3 4 6
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.graph import FriendGraph, build_csr, bfs_distances, bidirectional_distance
+
+
+def random_graph(users: int, degree: float, seed: int) -> FriendGraph:
+    """按度数近似幂律分布生成无向好友图"""
+    rng = np.random.default_rng(seed)
+    edges = int(users * degree / 2)
+    weights = rng.pareto(2.0, users) + 1
+    weights /= weights.sum()
+    sources = rng.choice(users, edges, p=weights)
+    targets = rng.integers(0, users, edges)
+    keep = sources != targets
+    pairs = np.unique(np.sort(np.stack([sources[keep], targets[keep]], axis=1), axis=1), axis=0)
+    both = np.concatenate([pairs, pairs[:, ::-1]])
+    indptr, indices = build_csr(both[:, 0], both[:, 1], users)
+    return FriendGraph(np.arange(users, dtype=np.int64), indptr, indices)
+
+
+def distance_factors(graph: FriendGraph, sources: np.ndarray, max_hops: int = None):
+    """返回 (各源用户到所有用户的关系距离得分, 耗时秒数)"""
+    start = time.perf_counter()
+    distances = np.vstack([bfs_distances(graph, s, max_depth=max_hops) for s in sources.tolist()])
+    elapsed = time.perf_counter() - start
+    with np.errstate(divide='ignore'):
+        factors = 0.5 / distances
+    factors[np.arange(len(sources)), sources] = 0
+    return factors, elapsed
+
+
+def pair_time(graph: FriendGraph, pairs: np.ndarray, max_hops: int = None) -> float:
+    start = time.perf_counter()
+    for s, t in pairs.tolist():
+        bidirectional_distance(graph, s, t, max_hops)
+    return time.perf_counter() - start
+
+
+def top_k_overlap(reference: np.ndarray, candidate: np.ndarray, k: int) -> float:
+    """每行前k个下标的平均重合率"""
+    ref = np.argsort(-reference, axis=1, kind='stable')[:, :k]
+    cand = np.argsort(-candidate, axis=1, kind='stable')[:, :k]
+    return float(np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(ref, cand)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--degree', type=float, default=8.0, help='平均好友数')
+    parser.add_argument('--sources', type=int, default=200, help='抽样的源用户数')
+    parser.add_argument('--pairs', type=int, default=500, help='抽样的单对查询数')
+    parser.add_argument('--cutoffs', type=int, nargs='+', default=[2, 3, 4, 6])
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='结果写入该JSON文件')
+    args = parser.parse_args()
+
+    graph = random_graph(args.users, args.degree, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    sources = rng.choice(args.users, min(args.sources, args.users), replace=False)
+    pairs = rng.integers(0, args.users, (args.pairs, 2))
+
+    # 爱好分项与跳数无关，这里用随机值模拟，便于观察对推荐排序的影响
+    hobby_terms = rng.random((len(sources), args.users)) * 0.5
+
+    reference, reference_time = distance_factors(graph, sources)
+    results = [{
+        'max_hops': None,
+        'one_to_all_seconds': reference_time,
+        'pair_seconds': pair_time(graph, pairs),
+        'mean_abs_error': 0.0,
+        'max_abs_error': 0.0,
+        'changed_pairs': 0.0,
+        'top_k_overlap': 1.0,
+    }]
+    for max_hops in args.cutoffs:
+        factors, elapsed = distance_factors(graph, sources, max_hops)
+        error = np.abs(reference - factors)
+        results.append({
+            'max_hops': max_hops,
+            'one_to_all_seconds': elapsed,
+            'pair_seconds': pair_time(graph, pairs, max_hops),
+            'mean_abs_error': float(error.mean()),
+            'max_abs_error': float(error.max()),
+            'changed_pairs': float((error > 0).mean()),
+            'top_k_overlap': top_k_overlap(hobby_terms + reference, hobby_terms + factors, args.top_k),
+        })
+
+    print(f'users={args.users} edges={len(graph.indices) // 2} sources={len(sources)} pairs={len(pairs)}')
+    print(f'{"max_hops":>8} {"1-to-all s":>11} {"pairs s":>9} {"mean err":>10} {"max err":>9} '
+          f'{"changed":>8} {"top-k":>6}')
+    for row in results:
+        print(f'{str(row["max_hops"]):>8} {row["one_to_all_seconds"]:>11.3f} {row["pair_seconds"]:>9.3f} '
+              f'{row["mean_abs_error"]:>10.5f} {row["max_abs_error"]:>9.4f} '
+              f'{row["changed_pairs"]:>8.2%} {row["top_k_overlap"]:>6.3f}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
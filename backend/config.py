@@ -2,7 +2,91 @@ import os
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+
+def _optional_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
 class Config:
-    SECRET_KEY = 'dev-key-123'  # 生产环境必须改为随机字符串
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'app', 'database', 'ratings.db')
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key')  # 仅供开发使用，生产配置必须通过环境变量设置
+    # 相对路径由 Flask-SQLAlchemy 解析到 instance 目录下
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///lalinea.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    # 每个新连接上执行的 PRAGMA，仅对SQLite生效
+    SQLITE_PRAGMAS = {
+        'busy_timeout': 5000,
+    }
+    # 启动时自动建表；生产环境改为部署时执行 flask init-db
+    CREATE_SCHEMA_ON_STARTUP = True
+    CORS_ORIGINS = os.environ.get('CORS_ORIGINS', 'http://localhost:3000').split(',')
+
+    # 分数重算方式：thread 后台线程处理，sync 请求内同步处理，off 交给独立进程 (python -m app.jobs)
+    SCORE_WORKER = os.environ.get('SCORE_WORKER', 'thread')
+    # 关系距离的跳数上限，超过上限的用户对不计关系距离得分；不设置则不限制。
+    # 修改后需要全量重算分数 (python app/init_compatibility.py)
+    MAX_DISTANCE_HOPS = _optional_int('MAX_DISTANCE_HOPS')
+    # 只保存分数大于该值的用户对，缺失的用户对按0分处理；设为负数则保存全部用户对
+    SCORE_STORE_THRESHOLD = float(os.environ.get('SCORE_STORE_THRESHOLD', 0.0))
+
+    # 分数快照目录：设置后分数任务进程在分数变化后定期把 compatibility_score 导出为 mmap 快照，
+    # 兼容性分数和推荐接口改为读取快照（可能落后于数据库最多 SCORE_SNAPSHOT_INTERVAL 秒加一次导出的时间），
+    # 目录中还没有快照时查询数据库。适合读多写少的部署，所有进程需能访问同一目录
+    SCORE_SNAPSHOT_DIR = os.environ.get('SCORE_SNAPSHOT_DIR')
+    SCORE_SNAPSHOT_INTERVAL = float(os.environ.get('SCORE_SNAPSHOT_INTERVAL', 60))
+
+    # 登录用户快照（资料、爱好、好友id）在进程内的缓存时长（秒）和数量，设为0不缓存。
+    # 本进程的修改立即生效，其他进程的修改最迟在该时长后生效
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 30))
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+
+    # 批量导入接口 (/api/batch/*)、/metrics 及 /api/jobs/status 的访问令牌，请求头 Authorization: Bearer <令牌>；不设置则不开放
+    BATCH_API_TOKEN = os.environ.get('BATCH_API_TOKEN')
+
+    # app 包下日志的级别，DEBUG 时输出每个请求的耗时和调试信息；设为 CRITICAL 可关闭
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    # 请求耗时、SQL统计及 /metrics 接口
+    INSTRUMENTATION = os.environ.get('INSTRUMENTATION', '1') != '0'
+    # 同一语句在一个请求中执行超过该次数时按N+1查询记录警告
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 20))
+    # 超过该耗时（毫秒）的请求记录警告
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 1000))
+    # 打开后请求头带 X-Profile: 1 的请求会被采样分析，结果写入 PROFILE_DIR（默认 instance/profiles）
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED') == '1'
+    PROFILER_INTERVAL = float(os.environ.get('PROFILER_INTERVAL', 0.005))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+
+
+class DevelopmentConfig(Config):
+    pass
+
+
+class ProductionConfig(Config):
+    """多进程部署（gunicorn -c gunicorn.conf.py wsgi:app）使用的配置"""
+    # 不使用开发默认值，未设置环境变量 SECRET_KEY 时 create_app 直接报错
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'instance', 'lalinea.db')
+    )
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': 10,
+        # 连接上的 busy_timeout 由 SQLITE_PRAGMAS 设置
+        'connect_args': {'timeout': 5},
+    }
+    # WAL 下读不会被写阻塞；synchronous=NORMAL 在 WAL 下仍保证数据库一致，只在断电时可能丢失最后的事务
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'temp_store': 'MEMORY',
+    }
+    CREATE_SCHEMA_ON_STARTUP = False
+
+
+config = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+}
@@ -0,0 +1,15 @@
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+# 每个进程各自持有连接池；SQLite 在 WAL 模式下多个进程可以同时读
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = 60
+graceful_timeout = 30
+# 不预加载：数据库连接和分数后台线程在各个工作进程中创建，
+# 多个进程的后台线程通过文件锁保证只有一个在处理任务
+preload_app = False
+accesslog = '-'
+errorlog = '-'
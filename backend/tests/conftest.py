@@ -0,0 +1,173 @@
+import os
+import random
+import sys
+from collections import defaultdict, deque
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db, cache, hobby_index, relatedness, social_graph, user_cache
+from app.models import CompatibilityScore, Hobby, User, user_friends
+
+# 随机校园使用的爱好：前几个是参与学科相关度的学科
+CAMPUS_HOBBIES = ['计算机科学', '软件工程', '人工智能', '数学', '统计学', '化学', '医学',
+                  '篮球', '围棋', '摄影', '吉他']
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """使用临时SQLite数据库的应用，不启动后台分数线程"""
+    # 进程内缓存按数据库中的版本号失效，每个测试换了数据库，需要清空
+    monkeypatch.setattr(social_graph, '_graph', None)
+    monkeypatch.setattr(hobby_index, '_cached_index', None)
+    monkeypatch.setattr(relatedness, '_cached_table', None)
+    monkeypatch.setattr(cache, '_responses', {})
+    app = create_app(
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'test.db'),
+        SCORE_WORKER='off',
+        LOG_LEVEL='ERROR',
+        INSTRUMENTATION=False,
+        SCORE_SNAPSHOT_DIR=None,
+        TESTING=True,
+    )
+    with app.app_context():
+        user_cache.invalidate_all_users()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def make_users(app):
+    """创建n个用户，返回按id排列的用户id列表"""
+    def make(n, names=None):
+        users = [
+            User(student_id=f's{i}', email=f'u{i}@example.com', name=(names or {}).get(i, f'用户{i}'),
+                 password_hash='-')
+            for i in range(n)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        return [user.id for user in users]
+    return make
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    """以某个用户的身份登录测试客户端"""
+    def login_as(user_id):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return client
+    return login_as
+
+
+@pytest.fixture
+def count_queries(app):
+    """统计 with 块内执行的SQL语句数"""
+    from contextlib import contextmanager
+    from sqlalchemy import event
+
+    @contextmanager
+    def counting():
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+    return counting
+
+
+@pytest.fixture
+def campus(app, make_users):
+    """随机生成用户、爱好和好友关系，返回按id排列的用户id列表"""
+    def build(n=40, friendships=45, seed=0):
+        rng = random.Random(seed)
+        ids = make_users(n)
+        hobbies = [Hobby(name=name) for name in CAMPUS_HOBBIES]
+        db.session.add_all(hobbies)
+        for user in User.query.order_by(User.id):
+            user.hobbies = rng.sample(hobbies, rng.randint(0, 3))
+        pairs = {tuple(sorted(rng.sample(ids, 2))) for _ in range(friendships)}
+        db.session.execute(user_friends.insert(), [
+            {'user_id': a, 'friend_id': b} for pair in pairs for a, b in (pair, pair[::-1])
+        ])
+        # 直接写 user_friends，需要让进程内的好友图重新加载
+        cache.bump_version(social_graph.GRAPH_VERSION)
+        db.session.commit()
+        return ids
+    return build
+
+
+def _bfs(friends, source, max_hops=None):
+    distances = {source: 0}
+    queue = deque([source])
+    while queue:
+        node = queue.popleft()
+        if max_hops is not None and distances[node] >= max_hops:
+            continue
+        for other in friends[node]:
+            if other not in distances:
+                distances[other] = distances[node] + 1
+                queue.append(other)
+    return distances
+
+
+@pytest.fixture
+def reference_scores(app):
+    """按逐对公式（集合求 Jaccard、学科矩阵取最大值、BFS 求距离）计算应保存的分数
+
+    返回 {(user1_id, user2_id): (score, 爱好重合度, 学科相关度, 关系距离得分)}，
+    只包含分数大于 threshold 的用户对
+    """
+    from app.compatibility import SUBJECT_RELATEDNESS
+
+    def relatedness(subject1, subject2):
+        for group in SUBJECT_RELATEDNESS.values():
+            if subject1 in group and subject2 in group[subject1]:
+                return group[subject1][subject2]
+        return 0.0
+
+    def compute(max_hops=None, threshold=0.0):
+        users = [(user.id, {h.name for h in user.hobbies}) for user in User.query.order_by(User.id)]
+        friends = defaultdict(set)
+        for a, b in db.session.query(user_friends.c.user_id, user_friends.c.friend_id):
+            friends[a].add(b)
+        expected = {}
+        for i, (id1, hobbies1) in enumerate(users):
+            distances = _bfs(friends, id1, max_hops)
+            for id2, hobbies2 in users[i + 1:]:
+                union = hobbies1 | hobbies2
+                overlap = len(hobbies1 & hobbies2) / len(union) if hobbies1 and hobbies2 else 0.0
+                subject = max([relatedness(x, y) for x in hobbies1 for y in hobbies2], default=0.0)
+                factor = 0.5 / distances[id2] if id2 in distances else 0.0
+                score = overlap * 0.25 + subject * 0.25 + factor
+                if score > threshold:
+                    expected[(id1, id2)] = (score, overlap, subject, factor)
+        return expected
+    return compute
+
+
+@pytest.fixture
+def check_scores(reference_scores):
+    """断言 compatibility_score 表与逐对公式的结果一致"""
+    def check(max_hops=None, threshold=0.0):
+        expected = reference_scores(max_hops, threshold)
+        stored = {
+            (row.user1_id, row.user2_id): (row.score, row.hobby_overlap, row.subject_relatedness,
+                                           row.distance_factor)
+            for row in CompatibilityScore.query
+        }
+        assert sorted(stored) == sorted(expected)
+        for pair, row in stored.items():
+            assert row == pytest.approx(expected[pair]), pair
+    return check
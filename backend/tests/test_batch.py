@@ -0,0 +1,97 @@
+import pytest
+from app import db
+from app.compatibility import update_compatibility_scores
+from app.jobs import run_pending_jobs
+from app.models import Hobby, ScoreJob, User, user_friends
+
+TOKEN = 'test-token'
+
+
+@pytest.fixture
+def batch(app, client):
+    app.config['BATCH_API_TOKEN'] = TOKEN
+
+    def post(path, payload, token=TOKEN):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        return client.post(f'/api/batch/{path}', json=payload, headers=headers)
+    return post
+
+
+def test_batch_endpoints_require_token(app, client, batch, make_users):
+    a, b = make_users(2)
+    for path in ('friendships', 'hobbies'):
+        assert batch(path, {}, token=None).status_code == 403
+        assert batch(path, {}, token='wrong').status_code == 403
+    app.config['BATCH_API_TOKEN'] = None
+    assert batch('friendships', {'add': [[a, b]]}).status_code == 403
+    assert db.session.query(user_friends).count() == 0
+
+
+@pytest.mark.parametrize('payload', [
+    {'add': [[1, 1]]},
+    {'add': [[1]]},
+    {'add': [['x', 2]]},
+    {'add': [[1, 2]], 'remove': [[2, 1]]},
+    {'add': [[1, 999]]},
+])
+def test_batch_friendships_validation(batch, make_users, payload):
+    make_users(2)
+    assert batch('friendships', payload).status_code == 400
+    assert db.session.query(user_friends).count() == 0
+
+
+def test_batch_friendships(batch, make_users):
+    a, b, c = make_users(3)
+    assert batch('friendships', {'add': [[a, b], [c, b]]}).get_json() == \
+        {'added': 2, 'removed': 0, 'unchanged': 0}
+    assert batch('friendships', {'add': [[b, a]], 'remove': [[b, c]]}).get_json() == \
+        {'added': 0, 'removed': 1, 'unchanged': 1}
+    assert sorted(db.session.query(user_friends)) == [(a, b), (b, a)]
+    assert {job.kind for job in ScoreJob.query} == {'friendship'}
+
+
+@pytest.mark.parametrize('assignments', [
+    [{'user_id': 1, 'hobbies': '篮球'}],
+    [{'user_id': '1', 'hobbies': ['篮球']}],
+    [{'user_id': True, 'hobbies': ['篮球']}],
+    [{'user_id': 1, 'hobbies': [1, 2]}],
+    [{'hobbies': ['篮球']}],
+    ['篮球'],
+    {'user_id': 1},
+])
+def test_batch_hobbies_validation(batch, make_users, assignments):
+    make_users(1)
+    response = batch('hobbies', {'assignments': assignments})
+    assert response.status_code == 400
+    assert 'assignments 格式错误' in response.get_json()['error']
+
+
+def test_batch_hobbies(batch, make_users):
+    a, b = make_users(2)
+    db.session.add_all([Hobby(name='篮球'), Hobby(name='围棋')])
+    db.session.commit()
+    response = batch('hobbies', {'assignments': [
+        {'user_id': a, 'hobbies': ['篮球', '不存在']},
+        {'user_id': b, 'hobbies': ['围棋']},
+    ]})
+    assert response.get_json() == {'updated_users': 2, 'unknown_hobbies': ['不存在']}
+    response = batch('hobbies', {'assignments': [{'user_id': a, 'hobbies': ['围棋']}], 'replace': True})
+    assert response.get_json()['updated_users'] == 1
+    db.session.expire_all()
+    assert [h.name for h in db.session.get(User, a).hobbies] == ['围棋']
+    assert batch('hobbies', {'assignments': [{'user_id': 999, 'hobbies': []}]}).status_code == 400
+
+
+def test_batch_changes_rescore(batch, campus, check_scores):
+    ids = campus()
+    update_compatibility_scores()
+    friends = {(a, b) for a, b in db.session.query(user_friends) if a < b}
+    add = [[a, b] for a, b in zip(ids, ids[5:]) if (a, b) not in friends][:5]
+    remove = [list(pair) for pair in sorted(friends)[:5]]
+    assert batch('friendships', {'add': add, 'remove': remove}).status_code == 200
+    assert batch('hobbies', {'assignments': [
+        {'user_id': ids[0], 'hobbies': ['数学', '篮球']},
+        {'user_id': ids[1], 'hobbies': []},
+    ], 'replace': True}).status_code == 200
+    run_pending_jobs()
+    check_scores()
@@ -0,0 +1,31 @@
+from app import db
+from app.models import Hobby, User
+from app.score_writer import bulk_upsert_scores
+from app.social_graph import set_friendship
+
+
+def test_circle_members_sorted_by_score(app, make_users, login, count_queries):
+    ids = make_users(30)
+    viewer = ids[0]
+    hobby = Hobby(name='围棋')
+    hobby.users = User.query.filter(User.id.in_(ids)).all()
+    db.session.add(hobby)
+    db.session.commit()
+    others = ids[1:]
+    bulk_upsert_scores([viewer] * 10, others[:10], [0.0] * 10, [0.0] * 10,
+                       [0.5 / (i + 1) for i in range(10)])
+    set_friendship(viewer, others[3], True)
+
+    client = login(viewer)
+    client.get('/protected')
+    with count_queries() as statements:
+        data = client.get(f'/api/circle/{hobby.id}').get_json()
+    # 爱好 + 一条成员连接查询，与成员数无关（登录用户快照已缓存）
+    assert len(statements) == 2, statements
+
+    assert data['hobby_name'] == '围棋'
+    assert [user['id'] for user in data['users']] == others
+    assert [user['compatibility_score'] for user in data['users']][:3] == [0.5, 0.25, 0.5 / 3]
+    assert all(user['compatibility_score'] == 0 for user in data['users'][10:])
+    assert [user['id'] for user in data['users'] if user['is_friend']] == [others[3]]
+    assert set(data['users'][0]) == {'id', 'name', 'student_id', 'contact', 'compatibility_score', 'is_friend'}
@@ -0,0 +1,120 @@
+import random
+import numpy as np
+import pytest
+from app import compatibility_engine, db
+from app.compatibility import update_compatibility_scores
+from app.compatibility_engine import iter_all_scores
+from app.jobs import run_pending_jobs
+from app.models import user_friends
+from app.social_graph import set_friendship, set_friendships
+
+
+def test_full_recompute_matches_pair_formula(campus, check_scores):
+    campus()
+    update_compatibility_scores()
+    check_scores()
+
+
+def test_engine_blocks_cover_every_pair(campus, reference_scores, monkeypatch):
+    ids = campus(n=30)
+    # 子块很小时同一行也会拆成多段，结果应与整块相同
+    monkeypatch.setattr(compatibility_engine, 'BLOCK_CELLS', 40)
+    blocks = list(iter_all_scores(block_size=7))
+    user1_ids, user2_ids, overlap, subject, factor = (np.concatenate(field) for field in zip(*blocks))
+    assert len(user1_ids) == len(ids) * (len(ids) - 1) // 2
+    assert (user1_ids < user2_ids).all()
+    expected = reference_scores(threshold=-1)
+    computed = {
+        (a, b): (h * 0.25 + s * 0.25 + f, h, s, f)
+        for a, b, h, s, f in zip(user1_ids.tolist(), user2_ids.tolist(), overlap.tolist(),
+                                 subject.tolist(), factor.tolist())
+    }
+    assert sorted(computed) == sorted(expected)
+    for pair, row in computed.items():
+        assert row == pytest.approx(expected[pair]), pair
+
+
+def random_changes(ids, existing, count, seed):
+    """随机选出 count 个要建立的新关系和 count 个要解除的已有关系"""
+    rng = random.Random(seed)
+    existing = sorted(existing)
+    add = set()
+    while len(add) < count:
+        a, b = sorted(rng.sample(ids, 2))
+        if (a, b) not in existing:
+            add.add((a, b))
+    return sorted(add), rng.sample(existing, count)
+
+
+def friend_pairs():
+    return {(a, b) for a, b in db.session.query(user_friends) if a < b}
+
+
+def test_friend_changes_match_full_recompute(campus, check_scores):
+    ids = campus()
+    update_compatibility_scores()
+    add, remove = random_changes(ids, friend_pairs(), 8, seed=1)
+    # 逐条修改，每次修改后处理分数任务
+    for (a, b), (c, d) in zip(add, remove):
+        assert set_friendship(a, b, True)
+        run_pending_jobs()
+        assert set_friendship(d, c, False)
+        run_pending_jobs()
+        check_scores()
+
+
+def test_batched_friend_changes_match_full_recompute(campus, check_scores):
+    ids = campus(seed=2)
+    update_compatibility_scores()
+    add, remove = random_changes(ids, friend_pairs(), 10, seed=3)
+    # 一批任务中同一对用户先加后删、多条边的距离变化互相影响
+    assert len(set_friendships(add=add, remove=remove)) == 20
+    assert set_friendship(*add[0], False)
+    assert set_friendship(*remove[0], True)
+    run_pending_jobs()
+    check_scores()
+
+
+def test_friend_route_updates_scores(campus, check_scores, login):
+    ids = campus(seed=4)
+    update_compatibility_scores()
+    a, b = next(pair for pair in zip(ids, reversed(ids)) if pair not in friend_pairs())
+    client = login(a)
+    assert client.post(f'/api/user/me/friends/{b}').status_code == 200
+    run_pending_jobs()
+    check_scores()
+    assert client.delete(f'/api/user/me/friends/{b}').status_code == 200
+    run_pending_jobs()
+    check_scores()
+
+
+@pytest.mark.parametrize('max_hops', [1, 2, 3])
+def test_hop_cutoff_matches_bounded_bfs(app, campus, check_scores, max_hops):
+    app.config['MAX_DISTANCE_HOPS'] = max_hops
+    ids = campus(seed=5)
+    update_compatibility_scores()
+    check_scores(max_hops=max_hops)
+    # 增量更新只改写上限内距离变化的用户对
+    add, remove = random_changes(ids, friend_pairs(), 6, seed=6)
+    for (a, b), (c, d) in zip(add, remove):
+        set_friendship(a, b, True)
+        set_friendship(c, d, False)
+        run_pending_jobs()
+    check_scores(max_hops=max_hops)
+
+
+@pytest.mark.parametrize('threshold', [-1.0, 0.0, 0.2])
+def test_store_threshold_prunes_pairs(app, campus, check_scores, login, threshold):
+    app.config['SCORE_STORE_THRESHOLD'] = threshold
+    ids = campus(seed=7)
+    update_compatibility_scores()
+    check_scores(threshold=threshold)
+    # 好友和爱好变更后分数越过阈值的用户对相应地写入或删除
+    add, remove = random_changes(ids, friend_pairs(), 6, seed=8)
+    set_friendships(add=add, remove=remove)
+    run_pending_jobs()
+    check_scores(threshold=threshold)
+    client = login(ids[0])
+    client.put('/api/user/me/hobbies', json={'hobbies': ['数学', '围棋']})
+    run_pending_jobs()
+    check_scores(threshold=threshold)
@@ -0,0 +1,21 @@
+import pytest
+from app import create_app
+from config import ProductionConfig
+
+
+def make_production_app(tmp_path, **overrides):
+    return create_app(
+        'production',
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'test.db'),
+        SCORE_WORKER='off',
+        LOG_LEVEL='ERROR',
+        **overrides,
+    )
+
+
+def test_production_requires_secret_key(tmp_path, monkeypatch):
+    monkeypatch.setattr(ProductionConfig, 'SECRET_KEY', None)
+    with pytest.raises(RuntimeError, match='SECRET_KEY'):
+        make_production_app(tmp_path)
+    app = make_production_app(tmp_path, SECRET_KEY='from-env')
+    assert app.config['SECRET_KEY'] == 'from-env'
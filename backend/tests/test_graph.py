@@ -0,0 +1,54 @@
+import math
+import pytest
+from app.compatibility import calculate_compatibility
+from app.graph import DistanceTable, load_friend_graph
+from app.models import User
+from app.social_graph import get_social_graph
+
+
+def plain_distances(reference):
+    """由参考分数的关系距离得分还原出的距离，不可达为inf"""
+    return {pair: 0.5 / factor if factor else math.inf
+            for pair, (_, _, _, factor) in reference(threshold=-1).items()}
+
+
+def test_distance_table_matches_bfs(campus, reference_scores):
+    ids = campus()
+    expected = plain_distances(reference_scores)
+    table = DistanceTable(load_friend_graph())
+    graph = get_social_graph()
+    for (a, b), distance in expected.items():
+        assert table.distance(a, b) == distance
+        assert table.distance(b, a) == distance
+        assert graph.distance(a, b) == distance
+    for a in ids[:5]:
+        row = graph.distances_to(a, graph.compact().user_ids)
+        for b, distance in zip(graph.compact().user_ids.tolist(), row.tolist()):
+            if b != a:
+                assert distance == expected[min(a, b), max(a, b)]
+
+
+def test_calculate_compatibility_with_distance_table(campus, reference_scores):
+    ids = campus(n=20)
+    expected = reference_scores(threshold=-1)
+    users = {user.id: user for user in User.query.filter(User.id.in_(ids))}
+    table = DistanceTable()
+    for (a, b), (score, _, _, _) in expected.items():
+        assert calculate_compatibility(users[a], users[b], table) == pytest.approx(score)
+    # 不传距离表时走进程内好友图的双向BFS
+    a, b = ids[0], ids[-1]
+    assert calculate_compatibility(users[b], users[a]) == pytest.approx(expected[a, b][0])
+
+
+def test_distance_cutoff(campus, reference_scores):
+    ids = campus()
+    expected = plain_distances(reference_scores)
+    graph = get_social_graph()
+    for max_hops in (1, 2, 4):
+        table = DistanceTable(max_hops=max_hops)
+        for (a, b), distance in expected.items():
+            bounded = distance if distance <= max_hops else math.inf
+            assert graph.distance(a, b, max_hops) == bounded
+            assert table.distance(a, b) == bounded
+        row = graph.distances_to(ids[0], graph.compact().user_ids, max_hops)
+        assert row.max(initial=0, where=row < math.inf) <= max_hops
@@ -0,0 +1,84 @@
+import io
+import json
+from werkzeug.security import check_password_hash
+from app import db
+from app.importer import RosterImporter, read_roster, synthetic_roster
+from app.models import ScoreJob, User, user_friends
+
+ROSTER_CSV = '''student_id,email,name,contact,password,hobbies,friends
+1001,a@campus.edu,甲,138,secret-a,篮球;围棋,1002;1003
+1002,b@campus.edu,乙,,secret-b,围棋,
+1003,c@campus.edu,丙,139,secret-c,,1001;9999
+1004,,缺邮箱,,x,,
+'''
+
+
+def dump_roster():
+    """把数据库中的用户还原成名单行，便于与导入的名单比较"""
+    friends = {}
+    for a, b in db.session.query(user_friends):
+        friends.setdefault(a, set()).add(b)
+    users = {user.id: user for user in User.query}
+    return {
+        user.student_id: {
+            'email': user.email, 'name': user.name, 'contact': user.contact,
+            'hobbies': sorted(h.name for h in user.hobbies),
+            'friends': sorted(users[f].student_id for f in friends.get(user.id, ())),
+        }
+        for user in users.values()
+    }
+
+
+def test_csv_roster_round_trip(app):
+    stats = RosterImporter(chunk_size=2).run(read_roster(io.StringIO(ROSTER_CSV)))
+    assert {key: stats[key] for key in ('rows', 'users', 'invalid', 'user_hobbies', 'friendships')} == \
+        {'rows': 4, 'users': 3, 'invalid': 1, 'user_hobbies': 3, 'friendships': 2}
+    assert dump_roster() == {
+        '1001': {'email': 'a@campus.edu', 'name': '甲', 'contact': '138',
+                 'hobbies': ['围棋', '篮球'], 'friends': ['1002', '1003']},
+        '1002': {'email': 'b@campus.edu', 'name': '乙', 'contact': None,
+                 'hobbies': ['围棋'], 'friends': ['1001']},
+        '1003': {'email': 'c@campus.edu', 'name': '丙', 'contact': '139',
+                 'hobbies': [], 'friends': ['1001']},
+    }
+    user = User.query.filter_by(student_id='1002').one()
+    assert check_password_hash(user.password_hash, 'secret-b')
+    assert [job.kind for job in ScoreJob.query] == ['all']
+
+    # 再次导入时已有学号跳过，好友关系不重复
+    stats = RosterImporter().run(read_roster(io.StringIO(ROSTER_CSV)), rescore=False)
+    assert (stats['users'], stats['skipped'], stats['friendships']) == (0, 3, 0)
+
+
+def test_synthetic_roster_round_trip(app):
+    def generate():
+        return list(synthetic_roster(60, ['篮球', '围棋', '摄影', '数学'], seed=1, password='pw',
+                                     hash_method='pbkdf2:sha256:1000'))
+    rows = generate()
+    # 同一种子生成相同的名单（密码哈希带随机盐）
+    assert [dict(row, password_hash=None) for row in rows] == \
+        [dict(row, password_hash=None) for row in generate()]
+    ndjson = ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+    RosterImporter(chunk_size=7).run(read_roster(io.StringIO(ndjson), 'ndjson'))
+
+    # 名单中的好友关系是单向列出的，导入后双向保存
+    expected = {row['student_id']: set() for row in rows}
+    for row in rows:
+        for friend in row['friends']:
+            expected[row['student_id']].add(friend)
+            expected[friend].add(row['student_id'])
+    imported = dump_roster()
+    assert {sid: set(user['friends']) for sid, user in imported.items()} == expected
+    assert {sid: user['hobbies'] for sid, user in imported.items()} == \
+        {row['student_id']: sorted(row['hobbies']) for row in rows}
+    assert check_password_hash(User.query.first().password_hash, 'pw')
+
+
+def test_synthetic_roster_custom_distributions():
+    counts = [0, 1, 2, 3] * 5
+    rows = list(synthetic_roster(20, ['热门', '冷门'], seed=0, hash_method='pbkdf2:sha256:1000',
+                                 hobby_count=counts.__getitem__, friend_count=lambda i: 0,
+                                 hobby_weights=[1.0, 0.0]))
+    assert [len(row['hobbies']) for row in rows] == [min(count, 1) for count in counts]
+    assert all(row['hobbies'] in ([], ['热门']) for row in rows)
+    assert all(row['friends'] == [] for row in rows)
@@ -0,0 +1,129 @@
+from sqlalchemy import text
+from app import db
+from app.jobs import (_claim_jobs, mark_all_dirty, mark_friendship_dirty, mark_hobbies_dirty,
+                      queue_status, reclaim_jobs, run_pending_jobs)
+from app.models import ScoreJob
+
+
+def pending():
+    return sorted((job.kind, job.user_id, job.claim != 0) for job in ScoreJob.query)
+
+
+def test_jobs_deleted_only_after_processing(app, make_users):
+    a, b = make_users(2)
+    mark_hobbies_dirty(a)
+    mark_friendship_dirty(a, b, existed=False)
+    db.session.commit()
+    assert run_pending_jobs() == 2
+    assert pending() == []
+
+
+def test_interrupted_batch_is_reclaimed(app, make_users):
+    a, b = make_users(2)
+    mark_all_dirty()
+    db.session.commit()
+    # 认领后进程被终止：任务仍在表中，只是标记为已认领
+    _claim_jobs()
+    assert pending() == [('all', 0, True)]
+    assert queue_status()['claimed'] == 1
+    assert run_pending_jobs() == 0
+
+    # 下一个取得文件锁的后台线程收回这些任务
+    assert reclaim_jobs() == 1
+    assert pending() == [('all', 0, False)]
+    assert ScoreJob.query.one().attempts == 1
+    assert run_pending_jobs() == 1
+    assert pending() == []
+
+
+def test_marking_a_claimed_job_requeues_it(app, make_users):
+    a, b = make_users(2)
+    mark_hobbies_dirty(a)
+    mark_friendship_dirty(a, b, existed=False)
+    db.session.commit()
+    claim, rows, graph = _claim_jobs()
+
+    # 处理期间同一任务被再次标记：改回待处理，变更前状态取新的值
+    mark_hobbies_dirty(a)
+    mark_friendship_dirty(a, b, existed=True)
+    db.session.commit()
+    assert pending() == [('friendship', a, False), ('hobby', a, False)]
+    assert ScoreJob.query.filter_by(kind='friendship').one().existed
+
+    # 这一批处理完成后，改回待处理的任务不会被删除
+    table = ScoreJob.__table__
+    db.session.execute(table.delete().where(table.c.claim == claim))
+    db.session.commit()
+    assert len(pending()) == 2
+
+
+def test_marking_a_pending_job_keeps_first_state(app, make_users):
+    a, b = make_users(2)
+    mark_friendship_dirty(a, b, existed=False)
+    mark_friendship_dirty(a, b, existed=True)
+    db.session.commit()
+    assert not ScoreJob.query.one().existed
+
+
+def test_upgrade_adds_claim_columns(app):
+    # 旧版本的 score_job 没有认领列
+    db.session.execute(text('DROP TABLE score_job'))
+    db.session.execute(text(
+        'CREATE TABLE score_job (id INTEGER PRIMARY KEY, kind VARCHAR(16) NOT NULL, '
+        'user_id INTEGER NOT NULL, other_id INTEGER NOT NULL, existed BOOLEAN NOT NULL, '
+        'attempts INTEGER NOT NULL, created_at DATETIME NOT NULL, '
+        'CONSTRAINT unique_pending_job UNIQUE (kind, user_id, other_id))'
+    ))
+    db.session.execute(text(
+        "INSERT INTO score_job (kind, user_id, other_id, existed, attempts, created_at) "
+        "VALUES ('all', 0, 0, 0, 0, '2024-01-01 00:00:00')"
+    ))
+    db.session.commit()
+    db.create_all()
+    assert pending() == [('all', 0, False)]
+    assert run_pending_jobs() == 1
+
+
+def test_status_requires_token(app, client, make_users):
+    a, b = make_users(2)
+    mark_friendship_dirty(a, b, True)
+    db.session.commit()
+    assert client.get('/api/jobs/status').status_code == 403
+    app.config['BATCH_API_TOKEN'] = 'test-token'
+    assert client.get('/api/jobs/status').status_code == 403
+    response = client.get('/api/jobs/status', headers={'Authorization': 'Bearer test-token'})
+    assert response.get_json()['pending'] == 1
+
+
+def test_upgrade_adds_score_components_and_rescores(app, make_users):
+    from app.compatibility import calculate_compatibility
+    from app.models import CompatibilityScore, Hobby, User
+    a, b = make_users(2)
+    hobby = Hobby(name='篮球')
+    db.session.add(hobby)
+    users = [db.session.get(User, user_id) for user_id in (a, b)]
+    for user in users:
+        user.hobbies.append(hobby)
+    db.session.commit()
+    # 旧版本的 compatibility_score 只有总分
+    db.session.execute(text('DROP TABLE compatibility_score'))
+    db.session.execute(text(
+        'CREATE TABLE compatibility_score (id INTEGER PRIMARY KEY, user1_id INTEGER NOT NULL, '
+        'user2_id INTEGER NOT NULL, score FLOAT NOT NULL, last_updated DATETIME NOT NULL, '
+        'CONSTRAINT check_user_order CHECK (user1_id < user2_id), '
+        'CONSTRAINT unique_user_pair UNIQUE (user1_id, user2_id))'
+    ))
+    db.session.execute(text(
+        f"INSERT INTO compatibility_score (user1_id, user2_id, score, last_updated) "
+        f"VALUES ({a}, {b}, 0.25, '2024-01-01 00:00:00')"
+    ))
+    db.session.commit()
+    db.create_all()
+    assert pending() == [('all', 0, False)]
+    assert run_pending_jobs() == 1
+    row = CompatibilityScore.query.one()
+    assert row.hobby_overlap == 1.0
+    assert row.score == calculate_compatibility(db.session.get(User, a), db.session.get(User, b))
+    # 列已存在时不再加入任务
+    db.create_all()
+    assert pending() == []
@@ -0,0 +1,23 @@
+import pytest
+from app import create_app
+
+
+@pytest.fixture
+def metrics_client(tmp_path):
+    app = create_app(
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'test.db'),
+        SCORE_WORKER='off',
+        LOG_LEVEL='ERROR',
+        INSTRUMENTATION=True,
+        BATCH_API_TOKEN='test-token',
+        TESTING=True,
+    )
+    return app.test_client()
+
+
+def test_metrics_requires_token(metrics_client):
+    assert metrics_client.get('/metrics').status_code == 403
+    assert metrics_client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    response = metrics_client.get('/metrics', headers={'Authorization': 'Bearer test-token'})
+    assert response.status_code == 200
+    assert 'score_jobs_pending' in response.get_data(as_text=True)
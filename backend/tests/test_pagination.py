@@ -0,0 +1,59 @@
+import pytest
+from app import db
+from app.models import Hobby, User
+from app.user_queries import encode_cursor
+
+BAD_CURSORS = [
+    'MQ==',                          # 1
+    encode_cursor({'a': 1}),
+    encode_cursor([1, 2, 3]),
+    encode_cursor(['x', 1]),
+    encode_cursor([0.5, 'x']),
+    encode_cursor([True, 1]),
+    '不是游标',
+]
+
+
+@pytest.fixture
+def circle(make_users):
+    ids = make_users(5)
+    hobby = Hobby(name='篮球')
+    hobby.users = User.query.filter(User.id.in_(ids)).all()
+    db.session.add(hobby)
+    db.session.commit()
+    return hobby.id, ids
+
+
+@pytest.mark.parametrize('cursor', BAD_CURSORS)
+def test_invalid_cursor_returns_400(login, circle, cursor):
+    hobby_id, ids = circle
+    client = login(ids[0])
+    for url in (f'/api/circle/{hobby_id}/members', '/api/users/search'):
+        response = client.get(url, query_string={'q': 's', 'cursor': cursor})
+        assert response.status_code == 400, url
+        assert response.get_json() == {'error': 'cursor 格式错误'}
+
+
+def test_id_only_cursor_shape(client, circle):
+    # 未登录的搜索只按id分页，游标为 [id]
+    response = client.get('/api/users/search', query_string={'q': 's', 'limit': 2})
+    assert response.status_code == 200
+    cursor = response.headers['X-Next-Cursor']
+    page = client.get('/api/users/search', query_string={'q': 's', 'limit': 2, 'cursor': cursor})
+    assert [user['id'] for user in page.get_json()] == circle[1][2:4]
+    bad = client.get('/api/users/search', query_string={'q': 's', 'cursor': encode_cursor([0.5, 1])})
+    assert bad.status_code == 400
+
+
+def test_score_cursor_pages_through_members(login, circle):
+    hobby_id, ids = circle
+    client = login(ids[0])
+    seen, cursor = [], None
+    while True:
+        query = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+        data = client.get(f'/api/circle/{hobby_id}/members', query_string=query).get_json()
+        seen += [user['id'] for user in data['users']]
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+    assert seen == ids[1:]
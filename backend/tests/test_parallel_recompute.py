@@ -0,0 +1,46 @@
+import os
+import pytest
+from app.models import CompatibilityScore
+from app.parallel_recompute import _pair_count, plan_shards, recompute_all_parallel
+from app.score_writer import bulk_upsert_scores
+
+
+def test_plan_shards_cover_upper_triangle():
+    for size, shard_pairs in ((1, 10), (7, 1), (50, 100), (200, 3000)):
+        shards = plan_shards(size, shard_pairs)
+        assert shards[0][0] == 0 and shards[-1][1] == size
+        assert all(stop == next_start for (_, stop), (next_start, _) in zip(shards, shards[1:]))
+        counts = [_pair_count(size, start, stop) for start, stop in shards]
+        assert sum(counts) == size * (size - 1) // 2
+        # 除单行超过目标的分片外，每片不超过目标加一行
+        assert all(count <= shard_pairs + size for count in counts)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_parallel_recompute_matches_pair_formula(campus, check_scores, reference_scores, tmp_path):
+    ids = campus()
+    # 实际分数为0的用户对留有旧行，重算后应被清理
+    zero = [pair for pair, row in reference_scores(threshold=-1).items() if row[0] == 0][:3]
+    assert zero
+    bulk_upsert_scores(*zip(*zero), [1.0] * len(zero), [0.0] * len(zero), [0.0] * len(zero))
+    assert CompatibilityScore.query.count() == len(zero)
+    work_dir = str(tmp_path / 'recompute')
+
+    def interrupt(done, total, *args):
+        if done == 2:
+            raise Interrupted
+    with pytest.raises(Interrupted):
+        recompute_all_parallel(work_dir, workers=2, shard_pairs=60, progress=interrupt)
+    assert os.path.exists(os.path.join(work_dir, 'manifest.json'))
+
+    # 从进度文件继续，只计算剩余的分片
+    progress = []
+    written = recompute_all_parallel(work_dir, workers=2, shard_pairs=60,
+                                     progress=lambda *args: progress.append(args))
+    assert written == len(ids) * (len(ids) - 1) // 2
+    assert progress[0][0] == 3 and progress[-1][0] == progress[-1][1]
+    assert not os.path.exists(work_dir)
+    check_scores()
@@ -0,0 +1,50 @@
+import os
+from app.compatibility import update_compatibility_scores
+from app.jobs import run_pending_jobs
+from app.score_snapshot import get_score_snapshot, write_score_snapshot
+from app.social_graph import set_friendship
+from app.top_matches import get_recommendations
+from app.user_queries import stored_scores
+
+
+def read_paths(app, directory, user_ids):
+    """分别从数据库和快照读取每个用户的分数和推荐"""
+    def read():
+        return {user_id: (
+            sorted(stored_scores(user_id)),
+            sorted(stored_scores(user_id, user_ids[::3] + [0])),
+            [(match.rank, match.other_id, match.score, user.id, bool(is_friend))
+             for match, user, is_friend in get_recommendations(user_id, 10)],
+        ) for user_id in user_ids}
+    app.config['SCORE_SNAPSHOT_DIR'] = None
+    from_db = read()
+    app.config['SCORE_SNAPSHOT_DIR'] = directory
+    assert get_score_snapshot() is not None
+    return from_db, read()
+
+
+def test_snapshot_matches_database(app, campus, login, tmp_path):
+    ids = campus()
+    update_compatibility_scores()
+    directory = str(tmp_path / 'snapshots')
+    write_score_snapshot(directory)
+    from_db, from_snapshot = read_paths(app, directory, ids)
+    assert from_snapshot == from_db
+
+    client = login(ids[0])
+    app.config['SCORE_SNAPSHOT_DIR'] = None
+    expected = client.get('/api/user/me/compatibility').get_json()
+    app.config['SCORE_SNAPSHOT_DIR'] = directory
+    assert client.get('/api/user/me/compatibility').get_json() == expected
+
+    # 分数变化后快照落后于数据库，写入新版本后重新一致，旧版本只保留一个
+    set_friendship(ids[0], ids[-1], True)
+    run_pending_jobs()
+    from_db, from_snapshot = read_paths(app, directory, ids)
+    assert from_snapshot != from_db
+    for _ in range(2):
+        snapshot = write_score_snapshot(directory)
+    assert get_score_snapshot().version == snapshot.version == 3
+    assert sorted(os.listdir(directory)) == ['2', '3', 'CURRENT']
+    from_db, from_snapshot = read_paths(app, directory, ids)
+    assert from_snapshot == from_db
@@ -0,0 +1,51 @@
+import pytest
+from app.models import CompatibilityScore
+from app.score_writer import bulk_upsert_scores
+
+
+def stored():
+    return {(row.user1_id, row.user2_id): (row.score, row.hobby_overlap, row.subject_relatedness,
+                                           row.distance_factor)
+            for row in CompatibilityScore.query}
+
+
+def test_bulk_upsert_inserts_and_updates(app, make_users, count_queries):
+    a, b, c, d = make_users(4)
+    # 用户对按 (小id, 大id) 保存，自身配对丢弃；每2行一个事务
+    with count_queries() as statements:
+        written = bulk_upsert_scores([b, a, c, d, a], [a, c, d, b, a], [1.0, 0.5, 0, 0, 1],
+                                     [0.0, 0.7, 0, 0, 1], [0.5, 0, 0.25, 0.125, 1], chunk_size=2)
+    assert written == 4
+    assert len([s for s in statements if s.startswith('INSERT')]) == 2
+    assert stored() == pytest.approx({
+        (a, b): (0.75, 1.0, 0.0, 0.5),
+        (a, c): (0.3, 0.5, 0.7, 0.0),
+        (c, d): (0.25, 0.0, 0.0, 0.25),
+        (b, d): (0.125, 0.0, 0.0, 0.125),
+    })
+
+    # 只覆盖关系距离得分：已有行保留爱好分项并重新组合分数，新行使用全部分项
+    bulk_upsert_scores([a, a], [b, d], [0.0, 0.5], [0.0, 0.0], [0.25, 0.5],
+                       update=('distance_factor',))
+    rows = stored()
+    assert rows[a, b] == pytest.approx((0.5, 1.0, 0.0, 0.25))
+    assert rows[a, d] == pytest.approx((0.625, 0.5, 0.0, 0.5))
+
+
+def test_bulk_upsert_drops_pairs_at_or_below_threshold(app, make_users):
+    a, b, c = make_users(3)
+    app.config['SCORE_STORE_THRESHOLD'] = 0.1
+    bulk_upsert_scores([a, a, b], [b, c, c], [1.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.5, 0.1, 0.05])
+    assert set(stored()) == {(a, b)}
+
+    # 全部覆盖时分数降到阈值以下的已有行被删除
+    bulk_upsert_scores([a], [b], [0.0], [0.0], [0.1])
+    assert stored() == {}
+
+    # 部分覆盖后由写入后的分数判断
+    bulk_upsert_scores([a, b], [c, c], [0.8, 0.8], [0.0, 0.0], [0.0, 0.0])
+    bulk_upsert_scores([a, b], [c, c], [0.0, 0.0], [0.0, 0.0], [0.2, 0.0], update=('distance_factor',))
+    assert stored() == pytest.approx({(a, c): (0.4, 0.8, 0.0, 0.2), (b, c): (0.2, 0.8, 0.0, 0.0)})
+    bulk_upsert_scores([a, b], [c, c], [0.0, 0.0], [0.0, 0.0], [0.0, 0.0],
+                       update=('hobby_overlap', 'subject_relatedness'))
+    assert stored() == pytest.approx({(a, c): (0.2, 0.0, 0.0, 0.2)})
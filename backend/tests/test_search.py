@@ -0,0 +1,49 @@
+import pytest
+from app import db
+from app.models import Hobby, User
+
+
+@pytest.fixture
+def people(make_users):
+    ids = make_users(4, names={0: '张三', 1: '李四', 2: '张伟明', 3: 'Ann'})
+    return dict(zip(('zhang_san', 'li_si', 'zhang_wei', 'ann'), ids))
+
+
+def search(client, q):
+    return {user['id'] for user in client.get('/api/users/search', query_string={'q': q}).get_json()}
+
+
+@pytest.mark.parametrize('q, expected', [
+    ('张', {'zhang_san', 'zhang_wei'}),
+    ('张伟', {'zhang_wei'}),
+    ('四', {'li_si'}),
+    ('an', {'ann'}),
+    ('A', {'ann'}),
+    ('张伟明', {'zhang_wei'}),
+])
+def test_short_queries_use_gram_index(client, people, count_queries, q, expected):
+    with count_queries() as statements:
+        found = search(client, q)
+    assert found == {people[name] for name in expected}
+    assert not any('LIKE' in statement for statement in statements)
+    if len(q) < 3:
+        assert any('user_search_short' in statement for statement in statements)
+
+
+def test_gram_index_follows_profile_changes(client, people):
+    user = db.session.get(User, people['li_si'])
+    user.name = '王五'
+    db.session.commit()
+    assert search(client, '四') == set()
+    assert search(client, '王') == {people['li_si']}
+
+    db.session.delete(db.session.get(User, people['ann']))
+    db.session.commit()
+    assert search(client, 'A') == set()
+
+
+def test_short_hobby_query(client):
+    db.session.add_all([Hobby(name='围棋'), Hobby(name='象棋'), Hobby(name='摄影')])
+    db.session.commit()
+    names = {hobby['name'] for hobby in client.get('/api/hobbies/search', query_string={'q': '棋'}).get_json()}
+    assert names == {'围棋', '象棋'}
@@ -0,0 +1,68 @@
+import pytest
+from app import db, graph, social_graph
+from app.jobs import run_pending_jobs
+from app.models import CompatibilityScore, user_friends
+from app.social_graph import get_social_graph, set_friendship
+
+
+@pytest.fixture
+def graph_loads(monkeypatch):
+    """记录从 user_friends 整表读取好友图的次数"""
+    loads = []
+    load = graph.load_friend_graph
+
+    def counted(*args, **kwargs):
+        loads.append(args)
+        return load(*args, **kwargs)
+    monkeypatch.setattr(graph, 'load_friend_graph', counted)
+    monkeypatch.setattr(social_graph, 'load_friend_graph', counted)
+    return loads
+
+
+def distance_factor(user1_id, user2_id):
+    """已保存的关系距离得分，分数不超过存储阈值的用户对没有记录，按0处理"""
+    return db.session.query(CompatibilityScore.distance_factor).filter_by(
+        user1_id=user1_id, user2_id=user2_id).scalar() or 0.0
+
+
+def test_score_jobs_reuse_graph_across_batches(app, make_users, graph_loads):
+    a, b, c, d = make_users(4)
+    assert set_friendship(a, b, True)
+    run_pending_jobs()
+    cached = get_social_graph()
+    assert len(graph_loads) == 1
+
+    # 本进程的修改直接同步到进程内的好友图，后续批次不再读取 user_friends
+    assert set_friendship(b, c, True)
+    run_pending_jobs()
+    assert set_friendship(c, d, True)
+    assert set_friendship(a, b, False)
+    run_pending_jobs()
+    assert get_social_graph() is cached
+    assert len(graph_loads) == 1
+
+    assert distance_factor(b, d) == 0.5 / 2
+    assert distance_factor(a, b) == 0
+    assert distance_factor(a, d) == 0
+
+
+def test_graph_reloads_after_external_change(app, make_users, graph_loads):
+    from app.cache import bump_version
+    a, b = make_users(2)
+    cached = get_social_graph()
+    # 其他进程修改好友关系时只能看到版本号变化
+    bump_version(social_graph.GRAPH_VERSION)
+    db.session.commit()
+    assert get_social_graph() is not cached
+    assert len(graph_loads) == 2
+
+
+def test_self_friendship_rejected(app, make_users, login):
+    a, b = make_users(2)
+    assert not set_friendship(a, a, True)
+    client = login(a)
+    response = client.post(f'/api/user/me/friends/{a}')
+    assert response.status_code == 400
+    assert client.post(f'/api/user/me/friends/{b}').status_code == 200
+    assert db.session.query(user_friends).count() == 2
+    assert get_social_graph().neighbors(a).tolist() == [b]
@@ -0,0 +1,56 @@
+import pytest
+from app import db, top_matches
+from app.compatibility import update_compatibility_scores
+from app.jobs import run_pending_jobs
+from app.models import CompatibilityScore, TopMatch, User
+from app.social_graph import get_social_graph, set_friendship
+
+K = 5
+
+
+@pytest.fixture(autouse=True)
+def small_k(monkeypatch):
+    monkeypatch.setattr(top_matches, 'TOP_K', K)
+
+
+def expected_top():
+    """由 compatibility_score 直接排序得到的每个用户前K个 (对方id, 分数)"""
+    scores = {user_id: [] for user_id, in db.session.query(User.id)}
+    for row in CompatibilityScore.query:
+        scores[row.user1_id].append((-row.score, row.user2_id))
+        scores[row.user2_id].append((-row.score, row.user1_id))
+    return {user_id: [(other_id, -score) for score, other_id in sorted(rows)[:K]]
+            for user_id, rows in scores.items() if rows}
+
+
+def stored_top():
+    top = {}
+    for match in TopMatch.query.order_by(TopMatch.user_id, TopMatch.rank):
+        assert match.rank == len(top.setdefault(match.user_id, [])) + 1
+        top[match.user_id].append((match.other_id, match.score))
+    return top
+
+
+def test_top_matches_follow_score_updates(campus, login):
+    ids = campus()
+    update_compatibility_scores()
+    assert stored_top() == expected_top()
+
+    # 好友增删只改写部分用户对，榜单只刷新可能变化的用户
+    a = ids[0]
+    friends = get_social_graph().neighbors(a).tolist()
+    assert friends
+    assert set_friendship(a, next(uid for uid in ids[1:] if uid not in friends), True)
+    assert set_friendship(friends[0], a, False)
+    run_pending_jobs()
+    assert stored_top() == expected_top()
+
+    # 爱好变更后分数整体变化
+    client = login(a)
+    assert client.put('/api/user/me/hobbies', json={'hobbies': ['计算机科学', '篮球']}).status_code == 200
+    run_pending_jobs()
+    assert stored_top() == expected_top()
+
+    response = client.get('/api/user/me/recommendations?k=3').get_json()
+    assert [(user['id'], user['compatibility_score']) for user in response] == expected_top()[a][:3]
+    assert [user['rank'] for user in response] == [1, 2, 3]
@@ -0,0 +1,55 @@
+from app import db
+from app.hobby_assignments import assign_hobbies
+from app.models import Hobby
+from app.social_graph import set_friendships
+from app.user_cache import get_user_snapshot
+
+
+def test_snapshot_cached_until_edited(app, make_users, login, count_queries):
+    a, b, c = make_users(3)
+    hobbies = [Hobby(name='篮球'), Hobby(name='围棋')]
+    db.session.add_all(hobbies)
+    db.session.commit()
+    snapshot = get_user_snapshot(a)
+    with count_queries() as statements:
+        assert get_user_snapshot(a) is snapshot
+    assert statements == []
+
+    client = login(a)
+    assert client.put('/api/user/me', json={'name': '新名字', 'contact': '123'}).status_code == 200
+    snapshot = get_user_snapshot(a)
+    assert (snapshot.name, snapshot.contact) == ('新名字', '123')
+
+    assert client.put('/api/user/me/hobbies', json={'hobbies': ['围棋']}).status_code == 200
+    snapshot = get_user_snapshot(a)
+    assert snapshot.hobby_names == ('围棋',)
+
+    assert client.post(f'/api/user/me/friends/{b}').status_code == 200
+    assert get_user_snapshot(a).friend_ids == {b}
+    assert get_user_snapshot(b).friend_ids == {a}
+
+    # 批量接口修改的用户同样失效，未涉及的用户保留缓存
+    cached = get_user_snapshot(c)
+    assign_hobbies({b: [hobbies[0].id]})
+    set_friendships(add=[(a, c)], remove=[(a, b)])
+    assert get_user_snapshot(b).hobby_names == ('篮球',)
+    assert get_user_snapshot(b).friend_ids == set()
+    assert get_user_snapshot(a).friend_ids == {c}
+    assert get_user_snapshot(c) is not cached
+    cached = get_user_snapshot(c)
+    assign_hobbies({b: []}, replace=True)
+    assert get_user_snapshot(c) is cached
+
+
+def test_snapshot_expires_after_ttl(app, make_users):
+    a, = make_users(1)
+    app.config['USER_CACHE_TTL'] = 0
+    assert get_user_snapshot(a) is not get_user_snapshot(a)
+    app.config['USER_CACHE_TTL'] = 30
+    # 其他进程的修改在TTL内不可见
+    snapshot = get_user_snapshot(a)
+    db.session.execute(db.text("UPDATE user_data SET name = '外部修改'"))
+    db.session.commit()
+    assert get_user_snapshot(a) is snapshot
+    app.config['USER_CACHE_TTL'] = 0
+    assert get_user_snapshot(a).name == '外部修改'
@@ -0,0 +1,7 @@
+"""生产环境入口：gunicorn -c gunicorn.conf.py wsgi:app
+
+部署前执行一次 flask --app wsgi init-db 建表
+"""
+from app import create_app
+
+app = create_app('production')